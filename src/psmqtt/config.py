@@ -138,6 +138,10 @@ class Config:
         self._fill_defaults_logging()
         self._fill_defaults_mqtt()
         self._fill_defaults_options()
+        self._fill_defaults_directory_usage()
+        self._fill_defaults_smart()
+        self._fill_defaults_processes()
+        self._fill_defaults_process_events()
         self._fill_defaults_schedule()
         logging.info(f"Configuration file '{filename}' successfully loaded and validated against schema. It contains {len(self.config['schedule'])} validated schedules.")
 
@@ -156,6 +160,78 @@ class Config:
             self.config["options"] = {"exit_after_num_tasks": 0}
         if "exit_after_num_tasks" not in self.config["options"]:
             self.config["options"]["exit_after_num_tasks"] = 0
+        if "schedule_coalescing_window_sec" not in self.config["options"]:
+            self.config["options"]["schedule_coalescing_window_sec"] = 1
+        elif self.config["options"]["schedule_coalescing_window_sec"] < 0:
+            raise ValueError(f"Invalid 'options.schedule_coalescing_window_sec' attribute in configuration file: {self.config['options']['schedule_coalescing_window_sec']}. Expected a non-negative number of seconds")
+        if "worker_threads" not in self.config["options"]:
+            self.config["options"]["worker_threads"] = 0
+        elif self.config["options"]["worker_threads"] < 0:
+            raise ValueError(f"Invalid 'options.worker_threads' attribute in configuration file: {self.config['options']['worker_threads']}. Expected a non-negative integer")
+
+    def _fill_defaults_directory_usage(self):
+        if "directory_usage" not in self.config["options"]:
+            self.config["options"]["directory_usage"] = {}
+        du = self.config["options"]["directory_usage"]
+        if "incremental" not in du:
+            du["incremental"] = False
+        if "state_file" not in du:
+            du["state_file"] = ""
+        if "low_priority" not in du:
+            du["low_priority"] = False
+        if "max_parallel_targets" not in du:
+            du["max_parallel_targets"] = 1
+        elif du["max_parallel_targets"] < 1:
+            raise ValueError(f"Invalid 'options.directory_usage.max_parallel_targets' attribute in configuration file: {du['max_parallel_targets']}. Expected a positive number")
+        if "max_files_per_sec" not in du:
+            du["max_files_per_sec"] = 0
+        elif du["max_files_per_sec"] < 0:
+            raise ValueError(f"Invalid 'options.directory_usage.max_files_per_sec' attribute in configuration file: {du['max_files_per_sec']}. Expected a non-negative number")
+        if "walker_threads" not in du:
+            du["walker_threads"] = 4
+        elif du["walker_threads"] < 1:
+            raise ValueError(f"Invalid 'options.directory_usage.walker_threads' attribute in configuration file: {du['walker_threads']}. Expected a positive number of threads")
+        if "background_refresh_sec" not in du:
+            du["background_refresh_sec"] = 0
+        elif du["background_refresh_sec"] < 0:
+            raise ValueError(f"Invalid 'options.directory_usage.background_refresh_sec' attribute in configuration file: {du['background_refresh_sec']}. Expected a non-negative number of seconds")
+
+    def _fill_defaults_smart(self):
+        if "smart" not in self.config["options"]:
+            self.config["options"]["smart"] = {}
+        smart = self.config["options"]["smart"]
+        if "cache_ttl_sec" not in smart:
+            smart["cache_ttl_sec"] = 10
+        elif smart["cache_ttl_sec"] < 0:
+            raise ValueError(f"Invalid 'options.smart.cache_ttl_sec' attribute in configuration file: {smart['cache_ttl_sec']}. Expected a non-negative number of seconds")
+        if "max_parallel_devices" not in smart:
+            smart["max_parallel_devices"] = 4
+        elif smart["max_parallel_devices"] < 0:
+            raise ValueError(f"Invalid 'options.smart.max_parallel_devices' attribute in configuration file: {smart['max_parallel_devices']}. Expected a non-negative integer")
+        if "backend" not in smart:
+            smart["backend"] = "pysmart"
+        if "standby_check" not in smart:
+            smart["standby_check"] = False
+        if "native_nvme" not in smart:
+            smart["native_nvme"] = False
+        if "stagger_polling" not in smart:
+            smart["stagger_polling"] = False
+        elif smart["stagger_polling"] and smart["max_parallel_devices"] == 0:
+            raise ValueError("Invalid 'options.smart.stagger_polling' attribute in configuration file: staggered polling requires a non-zero 'options.smart.max_parallel_devices'")
+
+    def _fill_defaults_processes(self):
+        if "processes" not in self.config["options"]:
+            self.config["options"]["processes"] = {}
+        pr = self.config["options"]["processes"]
+        if "backend" not in pr:
+            pr["backend"] = "psutil"
+
+    def _fill_defaults_process_events(self):
+        if "process_events" not in self.config["options"]:
+            self.config["options"]["process_events"] = {}
+        pe = self.config["options"]["process_events"]
+        if "proc_connector" not in pe:
+            pe["proc_connector"] = False
 
     def _fill_defaults_mqtt(self):
         m = self.config["mqtt"]
@@ -227,11 +303,28 @@ class Config:
                 # consider this as valid:
                 validated_tasks.append(t)
 
-            validated_schedule.append({"cron": s["cron"], "tasks": validated_tasks})
+            parallel = s.get("parallel", False)
+            max_concurrency = s.get("max_concurrency", 0)
+            if max_concurrency < 0:
+                raise ValueError(f"Invalid 'max_concurrency' attribute in configuration file for schedule '{s['cron']}': {max_concurrency}. Expected a non-negative integer")
+
+            validated_schedule.append({"cron": s["cron"], "tasks": validated_tasks, "parallel": parallel, "max_concurrency": max_concurrency})
 
         # get rid of original schedule and replace with validated scheduling rules:
         self.config["schedule"] = validated_schedule
 
+    def _fill_defaults_publish_on_change(self, t: dict) -> dict[str,float] | None:
+        if "publish_on_change" not in t or t["publish_on_change"] is False:
+            # publish at every execution of the task:
+            return None
+        p = {} if t["publish_on_change"] is True else t["publish_on_change"]
+        for k in ["deadband_abs", "deadband_rel", "max_silence_sec"]:
+            if k not in p:
+                p[k] = 0
+            elif p[k] < 0:
+                raise ValueError(f"{t['task']}: Invalid 'publish_on_change.{k}' attribute in configuration file: {p[k]}. Expected a non-negative number")
+        return p
+
     def _fill_defaults_task(self, t: dict[str,str]) -> dict[str,str]:
         if "params" not in t:
             t["params"] = []
@@ -239,6 +332,11 @@ class Config:
             t["formatter"] = None
         if "topic" not in t:
             t["topic"] = None
+        if "cache_ttl" not in t:
+            t["cache_ttl"] = 0
+        elif t["cache_ttl"] < 0:
+            raise ValueError(f"{t['task']}: Invalid 'cache_ttl' attribute in configuration file: {t['cache_ttl']}. Expected a non-negative number of seconds")
+        t["publish_on_change"] = self._fill_defaults_publish_on_change(t)
 
         if "ha_discovery" not in t:
             # HA discovery disabled for this task:
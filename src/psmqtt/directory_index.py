@@ -0,0 +1,353 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+import time
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Set,
+)
+
+from .directory_walker import RateLimiter
+
+
+class InotifyWatcher:
+    '''
+    Minimal wrapper around the Linux inotify API, accessed through ctypes so that no
+    3rd party library is needed.
+    InotifyWatcher only tracks which watched directories have changed: the content of each
+    event is not relevant for DirectorySizeIndex.
+    '''
+
+    # see "man 7 inotify"
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    _libc = None
+
+    @staticmethod
+    def is_available() -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        if InotifyWatcher._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                libc.inotify_init1  # raises AttributeError if missing
+            except (OSError, AttributeError):
+                return False
+            InotifyWatcher._libc = libc
+        return True
+
+    def __init__(self) -> None:
+        assert InotifyWatcher.is_available()
+        self.fd = InotifyWatcher._libc.inotify_init1(InotifyWatcher.IN_NONBLOCK | InotifyWatcher.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        # watch descriptor -> watched directory
+        self.wd_to_path: Dict[int, str] = {}
+        self.path_to_wd: Dict[str, int] = {}
+
+        # directories that changed since the last call to pop_changes()
+        self.changed_paths: Set[str] = set()
+        self.overflow = False
+
+    def add_watch(self, path: str) -> None:
+        '''
+        Starts watching a directory (not recursively).
+        Raises OSError e.g. when the max number of watches of the system (fs.inotify.max_user_watches) is reached.
+        '''
+        wd = InotifyWatcher._libc.inotify_add_watch(self.fd, os.fsencode(path), InotifyWatcher.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch({path}) failed: {os.strerror(err)}")
+        # the same wd is returned for the same inode, e.g. after a rename: the new path wins
+        old_path = self.wd_to_path.get(wd, None)
+        if old_path is not None and self.path_to_wd.get(old_path, None) == wd:
+            del self.path_to_wd[old_path]
+        self.wd_to_path[wd] = path
+        self.path_to_wd[path] = wd
+
+    def remove_watch(self, path: str) -> None:
+        wd = self.path_to_wd.pop(path, None)
+        if wd is None or self.wd_to_path.get(wd, None) != path:
+            return
+        del self.wd_to_path[wd]
+        # this might fail if the kernel already dropped the watch because the directory was deleted
+        InotifyWatcher._libc.inotify_rm_watch(self.fd, wd)
+
+    def pop_changes(self) -> Optional[Set[str]]:
+        '''
+        Returns the set of watched directories whose content changed since last call, or None if
+        the kernel event queue overflowed (in such case any directory might have changed).
+        '''
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _cookie, name_len = InotifyWatcher.EVENT_HEADER.unpack_from(buf, offset)
+                offset += InotifyWatcher.EVENT_HEADER.size + name_len
+                if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                    self.overflow = True
+                    continue
+                path = self.wd_to_path.get(wd, None)
+                if path is None:
+                    continue
+                if mask & InotifyWatcher.IN_IGNORED:
+                    # the kernel removed this watch
+                    del self.wd_to_path[wd]
+                    if self.path_to_wd.get(path, None) == wd:
+                        del self.path_to_wd[path]
+                    continue
+                self.changed_paths.add(path)
+
+        if self.overflow:
+            ret = None
+        else:
+            ret = self.changed_paths
+        self.changed_paths = set()
+        self.overflow = False
+        return ret
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class DirectoryNode:
+    '''
+    A single directory of a DirectorySizeIndex
+    '''
+
+    def __init__(self, mtime_ns: int, own_bytes: int, subdirs: List[str]) -> None:
+        self.mtime_ns = mtime_ns
+        # total size of the files directly contained in this directory
+        self.own_bytes = own_bytes
+        self.subdirs = subdirs
+
+
+class DirectorySizeIndex:
+    '''
+    DirectorySizeIndex computes the recursive size of a directory tree incrementally.
+
+    The whole tree is walked only once, to build an index containing the size of the files of each
+    directory. Later refresh() calls only rescan the directories that changed:
+     * on Linux, changes are detected using inotify: any file creation, deletion, rename or modification
+       marks its parent directory as changed;
+     * elsewhere (or when inotify watches cannot be allocated), changes are detected by comparing the
+       mtime of each indexed directory; this requires stat()ing every directory but no file, and cannot
+       detect in-place modifications of existing files (which do not update the directory mtime).
+    In both cases the refresh cost is proportional to the amount of changes, not to the size of the tree.
+
+    Sizes are the apparent sizes of regular files; symbolic links are skipped, like the Python
+    implementation of DirectoryUsageCommandHandler does.
+
+    Scans can be throttled to a max number of entries per second ("rate_limiter").
+    '''
+
+    def __init__(self, root: str, use_inotify: bool = True, saved_state: Optional[Dict[str, Any]] = None,
+                 rate_limiter: Optional[RateLimiter] = None) -> None:
+        self.root = root
+        self.rate_limiter = rate_limiter
+        self.nodes: Dict[str, DirectoryNode] = {}
+        self.total_bytes = 0
+
+        # when the index is restored from a saved state, the first refresh must check all directories,
+        # since inotify cannot report the changes that happened while the index was not in memory
+        self.check_all_mtimes = False
+
+        self.watcher: Optional[InotifyWatcher] = None
+        if use_inotify and InotifyWatcher.is_available():
+            try:
+                self.watcher = InotifyWatcher()
+            except OSError as ex:
+                logging.warning(f"DirectorySizeIndex: cannot use inotify for {root}: {ex}. Falling back to mtime checks.")
+
+        # statistics
+        self.num_rescanned_dirs = 0
+
+        start_time = time.time()
+        if saved_state is not None:
+            self._restore_state(saved_state)
+        else:
+            self._add_subtree(root)
+        logging.debug(f"DirectorySizeIndex: {'restored' if saved_state is not None else 'indexed'} {len(self.nodes)} directories of {root} "
+                      f"in {time.time() - start_time:.2f}sec using {'inotify' if self.watcher else 'mtime checks'}: {self.total_bytes}bytes")
+
+    def uses_inotify(self) -> bool:
+        return self.watcher is not None
+
+    def refresh(self) -> int:
+        '''
+        Updates the index rescanning only the directories that changed; returns the total size in bytes
+        '''
+        start_time = time.time()
+        if not os.path.isdir(self.root):
+            raise Exception(f"Directory does not exist: {self.root}")
+
+        changed: Optional[Set[str]] = set()
+        if self.watcher is not None:
+            changed = self.watcher.pop_changes()
+            if changed is None:
+                logging.warning(f"DirectorySizeIndex: inotify event queue overflowed, rescanning all directories of {self.root}")
+                changed = set(self.nodes.keys())
+        if self.watcher is None or self.check_all_mtimes:
+            assert changed is not None
+            for path, node in self.nodes.items():
+                try:
+                    if os.stat(path, follow_symlinks=False).st_mtime_ns != node.mtime_ns:
+                        changed.add(path)
+                except OSError:
+                    # deleted directory: its parent must have changed as well
+                    pass
+            self.check_all_mtimes = False
+
+        # parents first, so that subtrees which were removed are dropped before looking at their content:
+        num_rescanned = 0
+        for path in sorted(changed, key=len):
+            if path in self.nodes:
+                self._rescan_directory(path)
+                num_rescanned += 1
+        self.num_rescanned_dirs += num_rescanned
+
+        logging.debug(f"DirectorySizeIndex: refreshed {num_rescanned}/{len(self.nodes)} directories of {self.root} "
+                      f"in {time.time() - start_time:.2f}sec: {self.total_bytes}bytes")
+        return self.total_bytes
+
+    def close(self) -> None:
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def get_state(self) -> Dict[str, Any]:
+        '''
+        Returns the content of the index as a JSON-serializable object
+        '''
+        return {path: [node.mtime_ns, node.own_bytes, node.subdirs] for path, node in self.nodes.items()}
+
+    def _restore_state(self, saved_state: Dict[str, Any]) -> None:
+        if self.root not in saved_state:
+            raise ValueError(f"the saved state does not contain {self.root}")
+        for path, (mtime_ns, own_bytes, subdirs) in saved_state.items():
+            self.nodes[path] = DirectoryNode(mtime_ns, own_bytes, subdirs)
+            self.total_bytes += own_bytes
+            self._watch(path)
+        self.check_all_mtimes = True
+
+    def _watch(self, path: str) -> None:
+        if self.watcher is None:
+            return
+        try:
+            self.watcher.add_watch(path)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                logging.warning(f"DirectorySizeIndex: cannot watch {path}: {ex}. Falling back to mtime checks for {self.root}.")
+                self.watcher.close()
+                self.watcher = None
+
+    def _scan_directory(self, path: str) -> DirectoryNode:
+        '''
+        Scans the direct content of a single directory
+        '''
+        own_bytes = 0
+        num_entries = 0
+        subdirs = []
+        # the mtime is read before the directory content, so that changes happening during the scan
+        # are detected by the next refresh
+        mtime_ns = os.stat(path, follow_symlinks=False).st_mtime_ns
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        own_bytes += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    # file removed while scanning
+                    pass
+                num_entries += 1
+        if self.rate_limiter is not None:
+            self.rate_limiter.consume(num_entries)
+        return DirectoryNode(mtime_ns, own_bytes, subdirs)
+
+    def _add_subtree(self, start_path: str) -> None:
+        todo = [start_path]
+        while todo:
+            path = todo.pop()
+            # the watch is added before scanning, so that no change can be lost
+            self._watch(path)
+            try:
+                node = self._scan_directory(path)
+            except OSError as ex:
+                if path == start_path == self.root:
+                    raise Exception(f"Cannot scan directory {path}: {ex}")
+                # directory removed while scanning
+                continue
+            self.nodes[path] = node
+            self.total_bytes += node.own_bytes
+            todo += node.subdirs
+
+    def _remove_subtree(self, start_path: str) -> None:
+        todo = [start_path]
+        while todo:
+            path = todo.pop()
+            node = self.nodes.pop(path, None)
+            if node is None:
+                continue
+            self.total_bytes -= node.own_bytes
+            if self.watcher is not None:
+                self.watcher.remove_watch(path)
+            todo += node.subdirs
+
+    def _rescan_directory(self, path: str) -> None:
+        old_node = self.nodes[path]
+        try:
+            new_node = self._scan_directory(path)
+        except OSError:
+            if path == self.root:
+                raise
+            # this directory was removed; its parent will be rescanned as well (or already was)
+            self._remove_subtree(path)
+            return
+
+        self.total_bytes += new_node.own_bytes - old_node.own_bytes
+        self.nodes[path] = new_node
+
+        old_subdirs = set(old_node.subdirs)
+        new_subdirs = set(new_node.subdirs)
+        for d in old_subdirs - new_subdirs:
+            self._remove_subtree(d)
+        for d in new_subdirs - old_subdirs:
+            self._add_subtree(d)
@@ -0,0 +1,86 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import os
+import shutil
+import tempfile
+import unittest
+import pytest
+
+from .directory_index import DirectorySizeIndex, InotifyWatcher
+
+
+def write_file(path: str, size: int) -> None:
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def walk_size(root: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for f in filenames:
+            fp = os.path.join(dirpath, f)
+            if not os.path.islink(fp):
+                total += os.path.getsize(fp)
+    return total
+
+
+@pytest.mark.unit
+class TestDirectorySizeIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp(prefix="psmqtt-test-")
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        os.makedirs(os.path.join(self.root, "c"))
+        write_file(os.path.join(self.root, "f0"), 100)
+        write_file(os.path.join(self.root, "a", "f1"), 1000)
+        write_file(os.path.join(self.root, "a", "b", "f2"), 10000)
+        write_file(os.path.join(self.root, "c", "f3"), 5)
+        os.symlink(os.path.join(self.root, "a", "f1"), os.path.join(self.root, "c", "link"))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def _check_incremental_updates(self, index: DirectorySizeIndex) -> None:
+        self.assertEqual(11105, index.total_bytes)
+        self.assertEqual(walk_size(self.root), index.total_bytes)
+
+        # nothing changed: nothing gets rescanned
+        self.assertEqual(11105, index.refresh())
+        self.assertEqual(0, index.num_rescanned_dirs)
+
+        # new file, new directory, removed directory, renamed directory
+        write_file(os.path.join(self.root, "a", "b", "new"), 7)
+        os.makedirs(os.path.join(self.root, "d", "e"))
+        write_file(os.path.join(self.root, "d", "e", "f4"), 20)
+        shutil.rmtree(os.path.join(self.root, "c"))
+        os.rename(os.path.join(self.root, "a"), os.path.join(self.root, "a2"))
+        self.assertEqual(walk_size(self.root), index.refresh())
+        self.assertEqual(11127, index.total_bytes)
+
+        # changes inside a directory that was renamed are tracked as well
+        write_file(os.path.join(self.root, "a2", "b", "f5"), 3)
+        self.assertEqual(walk_size(self.root), index.refresh())
+
+    def test_mtime_checks(self) -> None:
+        index = DirectorySizeIndex(self.root, use_inotify=False)
+        self.assertFalse(index.uses_inotify())
+        self._check_incremental_updates(index)
+        index.close()
+
+    @pytest.mark.skipif(not InotifyWatcher.is_available(), reason="inotify is not available")
+    def test_inotify(self) -> None:
+        index = DirectorySizeIndex(self.root)
+        self.assertTrue(index.uses_inotify())
+        self._check_incremental_updates(index)
+
+        # in-place modifications of existing files are detected only via inotify
+        num_rescanned_before = index.num_rescanned_dirs
+        with open(os.path.join(self.root, "a2", "b", "f2"), "ab") as f:
+            f.write(b"y" * 50)
+        self.assertEqual(walk_size(self.root), index.refresh())
+        self.assertEqual(num_rescanned_before + 1, index.num_rescanned_dirs)
+        index.close()
+
+    def test_missing_root(self) -> None:
+        self.assertRaises(Exception, DirectorySizeIndex, os.path.join(self.root, "non-existing"))
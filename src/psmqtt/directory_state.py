@@ -0,0 +1,146 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    Optional,
+    Tuple,
+)
+
+
+class DirectoryStateFile:
+    '''
+    DirectoryStateFile persists the directory sizes computed by DirectoryUsageCommandHandler
+    (and their incremental indexes, if any) to a local JSON file, so that after a restart
+    the last known sizes can be published immediately, without rescanning all directories.
+
+    Each record is keyed by the directory path and is considered valid only if the device and the
+    modification time of that directory did not change since the record was saved.
+    '''
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path: str, min_save_interval_sec: float = 60) -> None:
+        self.path = path
+        self.min_save_interval_sec = min_save_interval_sec
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.is_dirty = False
+        self.last_save_time = 0.0
+
+    @staticmethod
+    def get_root_key(directory: str) -> Tuple[int, int]:
+        '''
+        Returns the device and modification time of the provided directory
+        '''
+        st = os.stat(directory)
+        return st.st_dev, st.st_mtime_ns
+
+    def load(self) -> None:
+        '''
+        Loads the state file, if it exists. A corrupted state file is ignored.
+        '''
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            logging.info(f"DirectoryStateFile: no state file found at {self.path}")
+            return
+        except (OSError, ValueError) as ex:
+            logging.warning(f"DirectoryStateFile: ignoring the state file {self.path}: {ex}")
+            return
+
+        if not isinstance(content, dict) or content.get("version", None) != DirectoryStateFile.FORMAT_VERSION:
+            logging.warning(f"DirectoryStateFile: ignoring the state file {self.path}: unsupported format")
+            return
+        with self.lock:
+            self.records = content.get("directories", {})
+        logging.info(f"DirectoryStateFile: loaded {len(self.records)} directory sizes from {self.path}")
+
+    def get(self, directory: str) -> Optional[Dict[str, Any]]:
+        '''
+        Returns the record saved for the provided directory, or None if there is no valid record.
+        Records contain the keys "size_bytes", "computed_at" and, optionally, "index".
+        '''
+        with self.lock:
+            record = self.records.get(directory, None)
+        if record is None:
+            return None
+        try:
+            if tuple(record["root_key"]) != DirectoryStateFile.get_root_key(directory):
+                logging.info(f"DirectoryStateFile: the saved size of {directory} is outdated")
+                return None
+        except (OSError, KeyError, TypeError):
+            return None
+        return record
+
+    def put(self, directory: str, root_key: Tuple[int, int], size_bytes: int, index_state: Optional[Dict[str, Any]] = None) -> None:
+        '''
+        Stores the size of a directory; "root_key" must be obtained from get_root_key() before starting
+        to compute the size, so that changes happening during the computation invalidate the record.
+        '''
+        record = {
+            "root_key": list(root_key),
+            "size_bytes": size_bytes,
+            "computed_at": time.time(),
+        }
+        if index_state is not None:
+            record["index"] = index_state
+        with self.lock:
+            self.records[directory] = record
+            self.is_dirty = True
+
+    def save_if_needed(self) -> None:
+        '''
+        Saves the state file if it changed and it was not saved in the last "min_save_interval_sec" seconds
+        '''
+        if self.is_dirty and time.time() - self.last_save_time >= self.min_save_interval_sec:
+            self.save()
+
+    def get_next_save_time(self) -> Optional[float]:
+        '''
+        Returns when save_if_needed() will save the records not saved yet, or None if all records are saved
+        '''
+        if not self.is_dirty:
+            return None
+        return self.last_save_time + self.min_save_interval_sec
+
+    def flush(self) -> None:
+        '''
+        Saves the state file right away if it changed, regardless of "min_save_interval_sec"
+        '''
+        if self.is_dirty:
+            self.save()
+
+    def save(self) -> None:
+        '''
+        Atomically replaces the state file: readers will find either the old or the new content, never a partial file
+        '''
+        with self.lock:
+            content = json.dumps({"version": DirectoryStateFile.FORMAT_VERSION, "directories": self.records})
+            self.is_dirty = False
+            self.last_save_time = time.time()
+
+        state_dir = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".psmqtt-state-", dir=state_dir)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as ex:
+            logging.warning(f"DirectoryStateFile: cannot save the state file {self.path}: {ex}")
+            return
+        logging.debug(f"DirectoryStateFile: saved {len(self.records)} directory sizes to {self.path}")
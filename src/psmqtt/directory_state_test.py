@@ -0,0 +1,69 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import os
+import tempfile
+import unittest
+import pytest
+
+from .directory_state import DirectoryStateFile
+
+
+@pytest.mark.unit
+class TestDirectoryStateFile(unittest.TestCase):
+
+    def test_save_and_load(self) -> None:
+        with tempfile.TemporaryDirectory() as state_dir, tempfile.TemporaryDirectory() as d:
+            state_path = os.path.join(state_dir, "state.json")
+            state = DirectoryStateFile(state_path)
+            state.put(d, DirectoryStateFile.get_root_key(d), 1234, {d: [0, 1234, []]})
+            state.save_if_needed()
+            # no temporary file is left behind
+            self.assertEqual(["state.json"], os.listdir(state_dir))
+
+            loaded = DirectoryStateFile(state_path)
+            loaded.load()
+            record = loaded.get(d)
+            assert record is not None
+            self.assertEqual(1234, record["size_bytes"])
+            self.assertEqual({d: [0, 1234, []]}, record["index"])
+            self.assertIsNone(loaded.get("/non-existing-directory"))
+
+            # a change of the root directory invalidates the record
+            os.mkdir(os.path.join(d, "new"))
+            self.assertIsNone(loaded.get(d))
+
+    def test_save_interval(self) -> None:
+        with tempfile.TemporaryDirectory() as state_dir, tempfile.TemporaryDirectory() as d:
+            state = DirectoryStateFile(os.path.join(state_dir, "state.json"), min_save_interval_sec=60)
+            state.put(d, DirectoryStateFile.get_root_key(d), 1)
+            state.save_if_needed()
+            state.put(d, DirectoryStateFile.get_root_key(d), 2)
+            state.save_if_needed()
+            self.assertTrue(state.is_dirty)
+
+            loaded = DirectoryStateFile(state.path)
+            loaded.load()
+            record = loaded.get(d)
+            assert record is not None
+            self.assertEqual(1, record["size_bytes"])
+
+            # records not saved yet are saved by the next save_if_needed() after the interval, or by flush()
+            next_save_time = state.get_next_save_time()
+            assert next_save_time is not None
+            self.assertAlmostEqual(state.last_save_time + 60, next_save_time)
+            state.flush()
+            self.assertIsNone(state.get_next_save_time())
+            loaded.load()
+            record = loaded.get(d)
+            assert record is not None
+            self.assertEqual(2, record["size_bytes"])
+
+    def test_corrupted_file(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            state_path = os.path.join(d, "state.json")
+            with open(state_path, "w") as f:
+                f.write("{ not json")
+            state = DirectoryStateFile(state_path)
+            state.load()
+            self.assertIsNone(state.get(d))
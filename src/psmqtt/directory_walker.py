@@ -0,0 +1,175 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import psutil
+
+
+class DirectoryWalkResult(NamedTuple):
+    '''
+    The outcome of a recursive directory walk
+    '''
+    num_files: int
+    num_dirs: int
+    size_bytes: int
+
+
+class RateLimiter:
+    '''
+    Token bucket limiting the number of filesystem entries scanned per second,
+    shared by all threads scanning directories
+    '''
+
+    def __init__(self, max_per_sec: float) -> None:
+        assert max_per_sec > 0
+        self.max_per_sec = max_per_sec
+        self.lock = threading.Lock()
+        # the moment when the entries consumed so far will have been "paid for"
+        self.next_free_time = time.monotonic()
+
+    def consume(self, num_entries: int) -> None:
+        '''
+        Accounts for "num_entries" entries just scanned, sleeping if the rate limit has been exceeded
+        '''
+        with self.lock:
+            now = time.monotonic()
+            # do not accumulate credit while idle, to avoid bursts
+            self.next_free_time = max(self.next_free_time, now) + num_entries / self.max_per_sec
+            delay_sec = self.next_free_time - now
+        if delay_sec > 0:
+            time.sleep(delay_sec)
+
+
+def lower_current_thread_priority() -> None:
+    '''
+    Moves the calling thread into the "idle" I/O scheduling class and to the lowest CPU priority.
+    On Linux both settings apply to a single thread; on other platforms they would apply to
+    the whole process, so nothing is done.
+    Please note that unprivileged threads cannot raise their priority back.
+    '''
+    if not sys.platform.startswith("linux"):
+        return
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+        psutil.Process(tid).ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (OSError, psutil.Error) as ex:
+        logging.warning(f"Cannot lower the priority of thread {tid}: {ex}")
+
+
+def run_with_low_priority(func: Callable[..., Any], *args: Any) -> Any:
+    '''
+    Runs func(*args) in a short-lived thread having idle I/O priority and low CPU priority
+    (see lower_current_thread_priority()) and returns its result; the calling thread is not affected
+    '''
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="psmqtt-low-priority",
+                                               initializer=lower_current_thread_priority) as pool:
+        return pool.submit(func, *args).result()
+
+
+class ParallelDirectoryWalker:
+    '''
+    ParallelDirectoryWalker computes the recursive size of a directory tree, spreading the
+    scan of its sub-directories across a pool of threads so that the latency of the
+    (blocking) filesystem calls of different directories overlaps.
+
+    Compared to os.walk() + os.path.islink() + os.path.getsize(), each file costs a single stat()
+    call at most: os.scandir() already provides the file type, and on some platforms (e.g. Windows)
+    even the file size, through its DirEntry objects.
+
+    Sizes are the apparent sizes of regular files; symbolic links are skipped and never followed.
+
+    To limit the impact on other workloads, the walk can run in threads having idle I/O priority and
+    low CPU priority ("low_priority") and can be throttled to a max number of entries per second ("rate_limiter").
+    '''
+
+    def __init__(self, num_threads: int, low_priority: bool = False, rate_limiter: Optional[RateLimiter] = None) -> None:
+        assert num_threads >= 1
+        self.num_threads = num_threads
+        self.low_priority = low_priority
+        self.rate_limiter = rate_limiter
+
+    def scan_directory(self, path: str) -> Tuple[int, int, List[str]]:
+        '''
+        Scans the direct content of a single directory.
+        Returns the number of files, their total size and the list of sub-directories.
+        '''
+        num_files = 0
+        size_bytes = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            num_files += 1
+                            size_bytes += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        # file removed while scanning
+                        pass
+        except OSError as ex:
+            # directory removed while scanning, or not readable (e.g. PermissionError): skip it, as "du" does
+            logging.debug(f"ParallelDirectoryWalker: skipping directory {path}: {ex}")
+        if self.rate_limiter is not None:
+            self.rate_limiter.consume(num_files + len(subdirs))
+        return num_files, size_bytes, subdirs
+
+    def walk(self, root: str) -> DirectoryWalkResult:
+        '''
+        Returns the number of files, the number of directories (including the root itself)
+        and the total size of the files contained in the provided directory, recursively.
+        '''
+        if not os.path.isdir(root):
+            raise Exception(f"Directory does not exist: {root}")
+
+        if self.num_threads == 1 and not self.low_priority:
+            return self._walk_serial(root)
+
+        num_files = 0
+        num_dirs = 0
+        size_bytes = 0
+        # the priority is lowered only in these short-lived threads, never in the caller thread
+        initializer = lower_current_thread_priority if self.low_priority else None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="psmqtt-walker",
+                                                   initializer=initializer) as pool:
+            pending = {pool.submit(self.scan_directory, root)}
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    dir_files, dir_bytes, subdirs = future.result()
+                    num_files += dir_files
+                    num_dirs += 1
+                    size_bytes += dir_bytes
+                    for d in subdirs:
+                        pending.add(pool.submit(self.scan_directory, d))
+
+        return DirectoryWalkResult(num_files, num_dirs, size_bytes)
+
+    def _walk_serial(self, root: str) -> DirectoryWalkResult:
+        num_files = 0
+        num_dirs = 0
+        size_bytes = 0
+        todo = [root]
+        while todo:
+            dir_files, dir_bytes, subdirs = self.scan_directory(todo.pop())
+            num_files += dir_files
+            num_dirs += 1
+            size_bytes += dir_bytes
+            todo += subdirs
+        return DirectoryWalkResult(num_files, num_dirs, size_bytes)
@@ -0,0 +1,144 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import psutil
+import pytest
+
+from .directory_walker import ParallelDirectoryWalker, RateLimiter, lower_current_thread_priority
+
+
+def generate_tree(root: str, depth: int, fanout: int, files_per_dir: int, file_size: int) -> int:
+    '''
+    Generates a directory tree; returns the total size of the files created
+    '''
+    total = 0
+    for i in range(files_per_dir):
+        with open(os.path.join(root, f"file{i}"), "wb") as f:
+            f.write(b"x" * file_size)
+        total += file_size
+    if depth > 0:
+        for i in range(fanout):
+            d = os.path.join(root, f"dir{i}")
+            os.mkdir(d)
+            total += generate_tree(d, depth - 1, fanout, files_per_dir, file_size)
+    return total
+
+
+@pytest.mark.unit
+class TestParallelDirectoryWalker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp(prefix="psmqtt-test-")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_walk(self) -> None:
+        # 1 + 3 + 9 directories, 2 files each
+        expected_bytes = generate_tree(self.root, 2, 3, 2, 10)
+        os.symlink(os.path.join(self.root, "file0"), os.path.join(self.root, "link"))
+        os.symlink(os.path.join(self.root, "dir0"), os.path.join(self.root, "dirlink"))
+
+        for num_threads in [1, 4]:
+            result = ParallelDirectoryWalker(num_threads).walk(self.root)
+            self.assertEqual(26, result.num_files)
+            self.assertEqual(13, result.num_dirs)
+            self.assertEqual(expected_bytes, result.size_bytes)
+
+    def test_throttled_low_priority_walk(self) -> None:
+        # 1 + 3 + 9 directories, 2 files each: 26 files and 12 sub-directories to be scanned
+        expected_bytes = generate_tree(self.root, 2, 3, 2, 10)
+
+        start = time.monotonic()
+        result = ParallelDirectoryWalker(2, True, RateLimiter(100)).walk(self.root)
+        self.assertEqual(expected_bytes, result.size_bytes)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="thread priorities are supported only on Linux")
+    def test_lower_current_thread_priority(self) -> None:
+        ioclasses = []
+
+        def thread_main():
+            lower_current_thread_priority()
+            ioclasses.append(psutil.Process(threading.get_native_id()).ionice().ioclass)
+
+        t = threading.Thread(target=thread_main)
+        t.start()
+        t.join()
+        self.assertEqual([psutil.IOPRIO_CLASS_IDLE], ioclasses)
+        # the calling thread is not affected
+        self.assertNotEqual(psutil.IOPRIO_CLASS_IDLE, psutil.Process(threading.get_native_id()).ionice().ioclass)
+
+    def test_unreadable_directory(self) -> None:
+        # 1 + 3 directories, 2 files each
+        generate_tree(self.root, 1, 3, 2, 10)
+        unreadable = os.path.join(self.root, "dir1")
+        os.chmod(unreadable, 0)
+        orig_scandir = os.scandir
+
+        def scandir(path):
+            # root can read any directory: simulate the failure
+            if path == unreadable:
+                raise PermissionError(13, "Permission denied", path)
+            return orig_scandir(path)
+        try:
+            with mock.patch("os.scandir", side_effect=scandir):
+                for num_threads in [1, 4]:
+                    # the unreadable directory is counted but its content is skipped
+                    result = ParallelDirectoryWalker(num_threads).walk(self.root)
+                    self.assertEqual(6, result.num_files)
+                    self.assertEqual(4, result.num_dirs)
+                    self.assertEqual(60, result.size_bytes)
+        finally:
+            os.chmod(unreadable, 0o755)
+
+    def test_missing_directory(self) -> None:
+        self.assertRaises(Exception, ParallelDirectoryWalker(4).walk, os.path.join(self.root, "non-existing"))
+
+
+@pytest.mark.benchmark
+class BenchmarkParallelDirectoryWalker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp(prefix="psmqtt-benchmark-")
+        # 1 + 8 + 64 + 512 directories, 20 files each
+        generate_tree(self.root, 3, 8, 20, 100)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def _time(self, func) -> float:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    def _os_walk(self) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                if not os.path.islink(fp):
+                    total += os.path.getsize(fp)
+        return total
+
+    def test_benchmark(self) -> None:
+        results = {
+            "os.walk": self._time(self._os_walk),
+            "walker 1 thread": self._time(lambda: ParallelDirectoryWalker(1).walk(self.root)),
+            "walker 4 threads": self._time(lambda: ParallelDirectoryWalker(4).walk(self.root)),
+            "walker 16 threads": self._time(lambda: ParallelDirectoryWalker(16).walk(self.root)),
+        }
+        if shutil.which("du") is not None:
+            results["du"] = self._time(lambda: subprocess.check_output(['du', '-sk', self.root]))
+
+        for name, elapsed_sec in results.items():
+            print(f"{name:>20}: {elapsed_sec * 1000:8.1f}ms")
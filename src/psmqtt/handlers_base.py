@@ -14,6 +14,7 @@ from typing import (
     Union
 )
 
+from .snapshot_cache import SnapshotCache
 from .utils import list_from_array_of_namedtuples, dict_from_dict_of_namedtupes, string_from_dict_optionally, string_from_dict, string_from_list_optionally
 
 # all command handlers will return from their handle() function a Payload:
@@ -32,6 +33,13 @@ class TaskParam:
     def is_join_wildcard(param: str) -> bool:
         return param == "+"
 
+class PendingValueError(Exception):
+    '''
+    Raised by handlers that compute their values in background, when no value is available yet.
+    This is not an error: the value will be published as soon as it becomes available.
+    '''
+    pass
+
 class BaseHandler:
     '''
     Abstract base class that has a handle() method.
@@ -41,6 +49,11 @@ class BaseHandler:
     The get_value() method is "protected" and should not be called from outside the class.
     '''
 
+    # handlers that may block for a long time (e.g. seconds) should set this flag to True:
+    # when a worker pool is configured, tasks using blocking handlers are always executed
+    # in the worker pool instead of the main thread
+    is_blocking = False
+
     def __init__(self, name:str):
         self.name = name
         return
@@ -73,6 +86,45 @@ class BaseHandler:
     def get_value(self) -> Payload:
         raise Exception("Not implemented")
 
+    def configure(self, options: Dict[str, Any]) -> None:
+        '''
+        Applies the "options" section of the configuration file to this handler.
+        Most handlers have no configuration, so the default implementation does nothing.
+        '''
+        return
+
+    def prefetch(self, params_list: List[list[str]]) -> None:
+        '''
+        Invoked before running a group of tasks using this handler, with the parameters of all those tasks.
+        Slow handlers can start collecting in background all the data needed by those tasks, concurrently,
+        so that the following handle() calls find the data ready (or just wait for it).
+        It is invoked at each sampling pass, with an empty list if no task of that pass uses this handler.
+        This function must not block. The default implementation does nothing.
+        '''
+        return
+
+    def get_value_age(self, params: list[str]) -> Optional[float]:
+        '''
+        Handlers that compute their values in background return from this function
+        the age (in seconds) of the value returned by the last handle() call with the same parameters.
+        Handlers that compute their values synchronously, inside handle(), return None.
+        '''
+        return None
+
+    def pop_refreshed_callers(self) -> List[str]:
+        '''
+        Handlers that compute their values in background return from this function
+        the list of the 'caller_task_id's whose value has been refreshed since the last call.
+        '''
+        return []
+
+    def shutdown(self) -> None:
+        '''
+        Invoked once when PSMQTT exits: handlers having background threads or unsaved state stop and flush them.
+        The default implementation does nothing.
+        '''
+        return
+
 
 class MethodCommandHandler(BaseHandler):
     '''
@@ -97,10 +149,12 @@ class MethodCommandHandler(BaseHandler):
     def get_value(self) -> Payload:
         '''
         Invokes the psutil function pointed by self.method.
+        The result is shared with all other tasks reading the same psutil function
+        during the same sampling pass, see SnapshotCache.
         '''
         if self.method is None:
             raise Exception(f"psutil '{self.name}' not implemented")
-        return self.method()
+        return SnapshotCache.call(self.method)
 
 class ValueCommandHandler(MethodCommandHandler):
     '''
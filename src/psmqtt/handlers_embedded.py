@@ -1,13 +1,43 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+import concurrent.futures
 import logging
 import os
 import shutil
 import subprocess
+import threading
 import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
-from .handlers_base import BaseHandler, Payload
+from .directory_index import DirectorySizeIndex
+from .directory_state import DirectoryStateFile
+from .directory_walker import ParallelDirectoryWalker, RateLimiter, run_with_low_priority
+from .handlers_base import BaseHandler, Payload, PendingValueError
+
+
+class DirectorySizeEntry:
+    '''
+    The last size computed in background for a set of directories
+    '''
+
+    def __init__(self, directories: List[str]) -> None:
+        self.directories = directories
+        self.size_bytes: Optional[int] = None
+        self.error: Optional[Exception] = None
+        # Unix timestamp of the moment when the last refresh started
+        self.computed_at = 0.0
+        # Unix timestamp of the moment when the next refresh is due
+        self.next_refresh_time = 0.0
+        # the tasks that must be notified when the refresh completes
+        self.caller_task_ids: set[str] = set()
 
 
 class DirectoryUsageCommandHandler(BaseHandler):
@@ -16,6 +46,9 @@ class DirectoryUsageCommandHandler(BaseHandler):
     This handler is implemented entirely inside PSMQTT and does not rely on psutil or other 3rd party libs
     '''
 
+    # walking large directory trees might take tens of seconds
+    is_blocking = True
+
     def __init__(self) -> None:
         super().__init__('directory_usage')
 
@@ -23,6 +56,76 @@ class DirectoryUsageCommandHandler(BaseHandler):
         self.has_du_utility = shutil.which("du") is not None
         logging.info("DirectoryUsageCommandHandler: du utility is %savailable", "" if self.has_du_utility else "NOT ")
 
+        # the command used to run "du"; in low-priority mode this is prefixed by "ionice" and "nice"
+        self.du_command = ['du', '-sk']
+
+        # when background refresh is enabled, handle() returns the last computed size immediately
+        # while a background thread refreshes sizes every "background_refresh_sec" seconds
+        self.background_refresh_sec = 0
+        self.entries: Dict[Tuple[str, ...], DirectorySizeEntry] = {}
+        self.refreshed_callers: List[str] = []
+        self.refresh_thread: Optional[threading.Thread] = None
+        self.refresh_cond = threading.Condition()
+        self.stopping = False
+
+        # when incremental mode is enabled, each directory is walked only once and then
+        # only the sub-directories that changed are rescanned
+        self.incremental = False
+        self.indexes: Dict[str, DirectorySizeIndex] = {}
+        # protects "indexes" and "index_locks"; each index is built and refreshed holding its own lock only,
+        # so that different directories can be scanned in parallel (see "max_parallel_targets")
+        self.indexes_lock = threading.Lock()
+        self.index_locks: Dict[str, threading.Lock] = {}
+
+        # optional file where directory sizes are saved, to survive restarts
+        self.state_file: Optional[DirectoryStateFile] = None
+        # directories whose saved size has already been used since startup
+        self.restored_directories: set[str] = set()
+
+        # number of threads used by the python implementation, when "du" is not available
+        self.walker_threads = 4
+
+        # settings limiting the impact of directory scans on other workloads
+        self.max_parallel_targets = 1
+        self.low_priority = False
+        self.rate_limiter: Optional[RateLimiter] = None
+
+        return
+
+    def configure(self, options: Dict[str, Any]) -> None:
+        self.background_refresh_sec = options["directory_usage"]["background_refresh_sec"]
+        self.incremental = options["directory_usage"]["incremental"]
+        self.walker_threads = options["directory_usage"]["walker_threads"]
+        self.max_parallel_targets = options["directory_usage"]["max_parallel_targets"]
+
+        self.low_priority = options["directory_usage"]["low_priority"]
+        self.du_command = ['du', '-sk']
+        if self.low_priority:
+            # idle I/O scheduling class and lowest CPU priority
+            if shutil.which("nice") is not None:
+                self.du_command = ['nice', '-n19'] + self.du_command
+            if shutil.which("ionice") is not None:
+                self.du_command = ['ionice', '-c3'] + self.du_command
+
+        max_files_per_sec = options["directory_usage"]["max_files_per_sec"]
+        self.rate_limiter = None
+        if max_files_per_sec > 0:
+            # "du" cannot be throttled: use the python implementation
+            self.rate_limiter = RateLimiter(max_files_per_sec)
+            self.has_du_utility = False
+            logging.info(f"DirectoryUsageCommandHandler: directory scans will be throttled to {max_files_per_sec} files/sec")
+        if self.incremental:
+            logging.info("DirectoryUsageCommandHandler: directory sizes will be computed incrementally")
+
+        state_file_path = options["directory_usage"]["state_file"]
+        if state_file_path:
+            self.state_file = DirectoryStateFile(state_file_path)
+            self.state_file.load()
+
+        # in background mode handle() is very fast and there's no need to use a worker thread
+        self.is_blocking = self.background_refresh_sec == 0
+        if self.background_refresh_sec > 0:
+            logging.info(f"DirectoryUsageCommandHandler: directory sizes will be refreshed in background every {self.background_refresh_sec}sec")
         return
 
     def handle(self, params: list[str], caller_task_id: str) -> Payload:
@@ -30,18 +133,196 @@ class DirectoryUsageCommandHandler(BaseHandler):
 
         if len(params) < 1:
             raise Exception(f"{self.name}: At least 1 parameter is required; found {len(params)} parameters instead: {params}")
+        if self.background_refresh_sec > 0:
+            return self.get_cached_value(params, caller_task_id)
         return self.get_value(params)
 
+    def get_cached_value(self, directories: list[str], caller_task_id: str) -> int:
+        '''
+        Returns the last size computed in background for the provided directories.
+        Raises PendingValueError if the size was never computed so far.
+        '''
+        key = tuple(directories)
+        with self.refresh_cond:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                # first time these directories are requested: wake up the background thread
+                entry = DirectorySizeEntry(directories)
+                self.entries[key] = entry
+                if self.state_file is not None:
+                    # serve the sizes saved before the last restart while the background thread revalidates them
+                    records = [self._restore_from_state_file(d) for d in directories]
+                    if all(r is not None for r in records):
+                        entry.size_bytes = sum(r["size_bytes"] for r in records)
+                        entry.computed_at = min(r["computed_at"] for r in records)
+                        entry.next_refresh_time = entry.computed_at + self.background_refresh_sec
+                self._start_refresh_thread()
+                self.refresh_cond.notify()
+            entry.caller_task_ids.add(caller_task_id)
+
+            if entry.error is not None:
+                raise entry.error
+            if entry.size_bytes is None:
+                raise PendingValueError(f"{self.name}: size of {directories} is being computed in background")
+            return entry.size_bytes
+
+    def get_value_age(self, params: list[str]) -> Optional[float]:
+        if self.background_refresh_sec == 0:
+            return None
+        with self.refresh_cond:
+            entry = self.entries.get(tuple(params), None)
+            if entry is None or entry.size_bytes is None:
+                return None
+            return time.time() - entry.computed_at
+
+    def pop_refreshed_callers(self) -> List[str]:
+        with self.refresh_cond:
+            ret = self.refreshed_callers
+            self.refreshed_callers = []
+        return ret
+
+    def _start_refresh_thread(self) -> None:
+        if self.refresh_thread is None:
+            self.refresh_thread = threading.Thread(target=self._refresh_thread_main, name="psmqtt-directory-usage", daemon=True)
+            self.refresh_thread.start()
+        return
+
+    def _refresh_thread_main(self) -> None:
+        '''
+        Background thread refreshing all directory sizes, each one with its own cadence
+        '''
+        try:
+            while True:
+                with self.refresh_cond:
+                    if self.stopping:
+                        return
+                    # wait till the first refresh is due, or till the sizes not saved yet can be written to the state file:
+                    now = time.time()
+                    due_entries = [e for e in self.entries.values() if e.next_refresh_time <= now]
+                    if not due_entries:
+                        wakeup_time = min(e.next_refresh_time for e in self.entries.values())
+                        next_save_time = self.state_file.get_next_save_time() if self.state_file is not None else None
+                        if next_save_time is not None:
+                            wakeup_time = min(wakeup_time, next_save_time)
+                        self.refresh_cond.wait(timeout=max(wakeup_time - now, 0.01))
+                if not due_entries:
+                    if self.state_file is not None:
+                        self.state_file.save_if_needed()
+                    continue
+
+                for entry in due_entries:
+                    if self.stopping:
+                        return
+                    self._refresh_entry(entry)
+        finally:
+            if self.state_file is not None:
+                self.state_file.flush()
+
+    def shutdown(self) -> None:
+        '''
+        Stops the background thread (waiting for the directory being scanned, if any) and saves the state file
+        '''
+        with self.refresh_cond:
+            self.stopping = True
+            self.refresh_cond.notify()
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
+            self.refresh_thread = None
+        if self.state_file is not None:
+            self.state_file.flush()
+        return
+
+    def _refresh_entry(self, entry: DirectorySizeEntry) -> None:
+        start_time = time.time()
+        size_bytes = None
+        error = None
+        try:
+            size_bytes = self.get_value(entry.directories)
+        except Exception as ex:
+            error = ex
+
+        with self.refresh_cond:
+            entry.size_bytes = size_bytes
+            entry.error = error
+            entry.computed_at = start_time
+            entry.next_refresh_time = start_time + self.background_refresh_sec
+            self.refreshed_callers += list(entry.caller_task_ids)
+
+        logging.debug(f"DirectoryUsageCommandHandler: refreshed in background the size of {entry.directories} in {time.time() - start_time:.2f}sec")
+        return
+
     def get_recursive_directory_size(self, start_path:str) -> int:
         '''
         Get the total (recursive) size of a directory in bytes.
+        When a state file is configured, the first call after startup returns the size saved in the state file
+        (if still valid) and the computed sizes are saved in the state file.
+        '''
+        if self.state_file is None:
+            return self.compute_recursive_directory_size(start_path)
+
+        record = self._restore_from_state_file(start_path)
+        if record is not None:
+            return record["size_bytes"]
+
+        root_key = DirectoryStateFile.get_root_key(start_path)
+        total_size_bytes = self.compute_recursive_directory_size(start_path)
+        index_state = None
+        with self._get_index_lock(start_path):
+            with self.indexes_lock:
+                index = self.indexes.get(start_path, None)
+            if index is not None:
+                index_state = index.get_state()
+        self.state_file.put(start_path, root_key, total_size_bytes, index_state)
+        self.state_file.save_if_needed()
+        return total_size_bytes
+
+    def _restore_from_state_file(self, directory: str) -> Optional[Dict[str, Any]]:
+        '''
+        Returns the record saved in the state file for the provided directory, restoring its incremental index if any.
+        Saved records are used only once after startup: later calls return None.
+        '''
+        assert self.state_file is not None
+        with self.indexes_lock:
+            if directory in self.restored_directories:
+                return None
+            self.restored_directories.add(directory)
+
+            record = self.state_file.get(directory)
+            if record is None:
+                return None
+            if self.incremental and "index" in record and directory not in self.indexes:
+                try:
+                    self.indexes[directory] = DirectorySizeIndex(directory, saved_state=record["index"])
+                except (ValueError, TypeError) as ex:
+                    logging.warning(f"DirectoryUsageCommandHandler: ignoring the saved index of {directory}: {ex}")
+
+        logging.info(f"DirectoryUsageCommandHandler: using the size of {directory} saved in the state file: {record['size_bytes']}bytes")
+        return record
+
+    def compute_recursive_directory_size(self, start_path:str) -> int:
+        '''
+        Computes the total (recursive) size of a directory in bytes.
         This method is cross-platform but is also _very_ slow for large folders.
         Use with care.
         '''
         start_time = time.time()
         total_size_bytes = 0
 
-        if self.has_du_utility:
+        if self.incremental:
+
+            # the first call walks the whole tree; later calls only rescan what changed
+            with self._get_index_lock(start_path):
+                with self.indexes_lock:
+                    index = self.indexes.get(start_path, None)
+                if index is None:
+                    index = self._run_scan(DirectorySizeIndex, start_path, True, None, self.rate_limiter)
+                    with self.indexes_lock:
+                        self.indexes[start_path] = index
+                    total_size_bytes = index.total_bytes
+                else:
+                    total_size_bytes = self._run_scan(index.refresh)
+
+        elif self.has_du_utility:
 
             # take the fast lane and delegate all the work to the "du" utility
             # this is typically up to 2x-3x faster than the python implementation
@@ -55,7 +336,7 @@ class DirectoryUsageCommandHandler(BaseHandler):
             #
             # where these 3 folders contain real-world data and big dataset (> 400GB)
             try:
-                total_size_kbytes = subprocess.check_output(['du','-sk', start_path]).split()[0].decode('utf-8')
+                total_size_kbytes = subprocess.check_output(self.du_command + [start_path]).split()[0].decode('utf-8')
             except subprocess.CalledProcessError as e:
                 raise Exception(f"Error occurred while executing du command: {e}")
 
@@ -63,27 +344,44 @@ class DirectoryUsageCommandHandler(BaseHandler):
 
         else:
 
-            # python implementation:
-            for dirpath, dirnames, filenames in os.walk(start_path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    # skip if it is symbolic link
-                    if not os.path.islink(fp):
-                        total_size_bytes += os.path.getsize(fp)
+            # python implementation, walking sub-directories in parallel:
+            result = ParallelDirectoryWalker(self.walker_threads, self.low_priority, self.rate_limiter).walk(start_path)
+            logging.debug(f"Found {result.num_files} files in {result.num_dirs} directories of {start_path}")
+            total_size_bytes = result.size_bytes
 
         elapsed_time = time.time() - start_time
-        logging.debug(f"Recursively computed size of directory {start_path} in {elapsed_time:.2f}seconds with {'du' if self.has_du_utility else 'python'} implemention: {total_size_bytes}bytes")
+        implementation = 'incremental' if self.incremental else 'du' if self.has_du_utility else 'python'
+        logging.debug(f"Recursively computed size of directory {start_path} in {elapsed_time:.2f}seconds with {implementation} implemention: {total_size_bytes}bytes")
         return total_size_bytes
 
+    def _get_index_lock(self, directory: str) -> threading.Lock:
+        with self.indexes_lock:
+            lock = self.index_locks.get(directory, None)
+            if lock is None:
+                lock = threading.Lock()
+                self.index_locks[directory] = lock
+            return lock
+
+    def _run_scan(self, func: Callable[..., Any], *args: Any) -> Any:
+        '''
+        Runs an incremental index scan, in a low-priority thread if "low_priority" is configured
+        '''
+        if self.low_priority:
+            return run_with_low_priority(func, *args)
+        return func(*args)
+
     # noinspection PyMethodMayBeStatic
     def get_value(self, directories: list[str]) -> int:
 
-        total_size_bytes = 0
         for directory in directories:
             if directory == '':
                 raise Exception(f"{self.name}: Found an empty directory in the parameters")
             if not os.path.exists(directory):
                 raise Exception(f"{self.name}: Directory does not exist: {directory}")
-            total_size_bytes += self.get_recursive_directory_size(directory)
 
-        return total_size_bytes
+        num_parallel = min(self.max_parallel_targets, len(directories))
+        if num_parallel <= 1:
+            return sum(self.get_recursive_directory_size(d) for d in directories)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_parallel, thread_name_prefix="psmqtt-du") as pool:
+            return sum(pool.map(self.get_recursive_directory_size, directories))
@@ -1,10 +1,14 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+import os
+import tempfile
 import unittest
-from typing import List
+import time
+from typing import Any, Dict, List
 import pytest
 
+from .handlers_base import PendingValueError
 from .handlers_embedded import (
     DirectoryUsageCommandHandler
 )
@@ -12,6 +16,24 @@ from .handlers_embedded import (
 fake_task_id = "0.0"
 directories = ["/test1", "/test2/"]
 
+
+def make_options(**kwargs: Any) -> Dict[str, Any]:
+    '''
+    Returns the "options" section of the configuration, with the default values filled in by Config
+    '''
+    directory_usage = {
+        "background_refresh_sec": 0,
+        "incremental": False,
+        "walker_threads": 4,
+        "max_parallel_targets": 1,
+        "low_priority": False,
+        "max_files_per_sec": 0,
+        "state_file": "",
+    }
+    directory_usage.update(kwargs)
+    return {"directory_usage": directory_usage}
+
+
 @pytest.mark.unit
 class TestHandlers(unittest.TestCase):
 
@@ -34,3 +56,100 @@ class TestHandlers(unittest.TestCase):
                           ['/non-existing-directory-on-whatever-host-is-running-this-unit-test'], fake_task_id)
 
         return
+
+    def test_DirectoryUsageBackgroundRefresh(self) -> None:
+        handler = type("TestHandler", (DirectoryUsageCommandHandler, object),
+                       {"get_value": lambda s,d: self._directory_usage_get_value(directories)})()
+        handler.configure(make_options(background_refresh_sec=60))
+        self.assertFalse(handler.is_blocking)
+
+        # the first call cannot return a value but triggers the background computation:
+        self.assertRaises(PendingValueError, handler.handle, directories, fake_task_id)
+        deadline = time.time() + 5
+        refreshed = []
+        while not refreshed and time.time() < deadline:
+            time.sleep(0.01)
+            refreshed = handler.pop_refreshed_callers()
+        self.assertEqual([fake_task_id], refreshed)
+
+        # now the value is served from the cache
+        self.assertEqual(1000000, handler.handle(directories, fake_task_id))
+        age = handler.get_value_age(directories)
+        assert age is not None
+        self.assertLess(age, 5)
+        self.assertEqual([], handler.pop_refreshed_callers())
+
+    def test_DirectoryUsageParallelLowPriority(self) -> None:
+        with tempfile.TemporaryDirectory() as d1, tempfile.TemporaryDirectory() as d2:
+            for d, size in [(d1, 100), (d2, 23)]:
+                with open(os.path.join(d, "file"), "wb") as f:
+                    f.write(b"x" * size)
+
+            handler = DirectoryUsageCommandHandler()
+            handler.configure(make_options(walker_threads=2, max_parallel_targets=2, low_priority=True, max_files_per_sec=1000))
+            # throttling forces the python implementation, which reports apparent file sizes
+            self.assertFalse(handler.has_du_utility)
+            self.assertEqual(123, handler.handle([d1, d2], fake_task_id))
+
+    def test_DirectoryUsageStateFile(self) -> None:
+        with tempfile.TemporaryDirectory() as state_dir, tempfile.TemporaryDirectory() as d:
+            os.mkdir(os.path.join(d, "sub"))
+            with open(os.path.join(d, "sub", "file1"), "wb") as f:
+                f.write(b"x" * 100)
+            options = make_options(incremental=True, state_file=os.path.join(state_dir, "state.json"))
+
+            handler = DirectoryUsageCommandHandler()
+            handler.configure(options)
+            self.assertEqual(100, handler.handle([d], fake_task_id))
+            self.assertTrue(os.path.exists(options["directory_usage"]["state_file"]))
+
+            # the tree changes while psmqtt is not running; the mtime of the root directory is unchanged
+            with open(os.path.join(d, "sub", "file2"), "wb") as f:
+                f.write(b"x" * 10)
+
+            # after a restart, the saved size is returned immediately...
+            handler = DirectoryUsageCommandHandler()
+            handler.configure(options)
+            self.assertEqual(100, handler.handle([d], fake_task_id))
+            # ...and then revalidated using the saved index
+            self.assertEqual(110, handler.handle([d], fake_task_id))
+            self.assertEqual(1, handler.indexes[d].num_rescanned_dirs)
+
+    def test_DirectoryUsageIncrementalParallelLowPriority(self) -> None:
+        with tempfile.TemporaryDirectory() as d1, tempfile.TemporaryDirectory() as d2:
+            for d, size in [(d1, 100), (d2, 23)]:
+                for i in range(10):
+                    with open(os.path.join(d, f"file{i}"), "wb") as f:
+                        f.write(b"x" * size)
+
+            handler = DirectoryUsageCommandHandler()
+            handler.configure(make_options(incremental=True, max_parallel_targets=2, low_priority=True, max_files_per_sec=40))
+            # 20 files at 40 files/sec: the rate limit also applies to incremental scans
+            start = time.monotonic()
+            self.assertEqual(1230, handler.handle([d1, d2], fake_task_id))
+            self.assertGreaterEqual(time.monotonic() - start, 0.4)
+            self.assertEqual({d1, d2}, set(handler.indexes))
+            self.assertEqual(1230, handler.handle([d1, d2], fake_task_id))
+
+    def test_DirectoryUsageStateFileSavedOnShutdown(self) -> None:
+        with tempfile.TemporaryDirectory() as state_dir, tempfile.TemporaryDirectory() as d1, tempfile.TemporaryDirectory() as d2:
+            options = make_options(background_refresh_sec=3600, state_file=os.path.join(state_dir, "state.json"))
+            handler = DirectoryUsageCommandHandler()
+            handler.configure(options)
+            for d in [d1, d2]:
+                self.assertRaises(PendingValueError, handler.handle, [d], fake_task_id)
+                deadline = time.time() + 5
+                while handler.get_value_age([d]) is None and time.time() < deadline:
+                    time.sleep(0.01)
+
+            # the size of the second directory was computed within the min interval between two saves
+            assert handler.state_file is not None
+            self.assertTrue(handler.state_file.is_dirty)
+            handler.shutdown()
+            self.assertFalse(handler.state_file.is_dirty)
+            assert handler.refresh_thread is None
+
+            handler = DirectoryUsageCommandHandler()
+            handler.configure(options)
+            assert handler.state_file is not None
+            self.assertIsNotNone(handler.state_file.get(d2))
@@ -8,6 +8,7 @@ from typing import (
 
 from .handlers_base import MethodCommandHandler, NameOrTotalTupleCommandHandler, Payload, TaskParam
 from .handlers_derived import RateHandler
+from .snapshot_cache import SnapshotCache
 from .utils import string_from_dict_optionally
 
 class DiskIOCountersCommandHandler(MethodCommandHandler):
@@ -64,7 +65,7 @@ class DiskIOCountersCommandHandler(MethodCommandHandler):
 
     def get_value(self, perdisk:bool, disk:str) -> NamedTuple:
 
-        result = psutil.disk_io_counters(perdisk=perdisk)
+        result = SnapshotCache.call(psutil.disk_io_counters, perdisk=perdisk)
         # result is a namedtuple when perdisk=False or a dict when perdisk=True
 
         disk_without_dev = disk.replace('/dev/', '')
@@ -126,7 +127,7 @@ class DiskUsageCommandHandler(MethodCommandHandler):
 
     # noinspection PyMethodMayBeStatic
     def get_value(self, disk:str) -> NamedTuple:
-        return psutil.disk_usage(disk)
+        return SnapshotCache.call(psutil.disk_usage, disk)
 
 
 class NetIOCountersCommandHandler(NameOrTotalTupleCommandHandler):
@@ -139,7 +140,7 @@ class NetIOCountersCommandHandler(NameOrTotalTupleCommandHandler):
         return
 
     def get_value(self, total:bool) -> Payload:
-        return psutil.net_io_counters(pernic=not total)
+        return SnapshotCache.call(psutil.net_io_counters, pernic=not total)
 
 
 class NetIOCountersRateHandler(RateHandler):
@@ -271,7 +272,8 @@ class GetLoadAvgCommandHandler(MethodCommandHandler):
         assert isinstance(avgload, tuple)
 
         if percent_or_abs == 'percent':
-            avgload = [x / psutil.cpu_count() * 100 for x in avgload]
+            cpu_count = SnapshotCache.call(psutil.cpu_count)
+            avgload = [x / cpu_count * 100 for x in avgload]
         elif percent_or_abs == 'abs' or percent_or_abs == 'absolute':
             pass
         else:
@@ -1,21 +1,127 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+from collections import deque
 import fnmatch
 import logging
+import os
 import psutil
 import re
+import threading
+import time
 from typing import (
     Any,
-    Callable,
+    Deque,
     Dict,
+    FrozenSet,
+    Iterable,
     List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
 )
 
-from .handlers_base import BaseHandler, Payload
+from .handlers_base import BaseHandler, Payload, PendingValueError
+from .proc_connector import ProcConnector, ProcEvent
+from .process_snapshot import ACCESS_DENIED, ProcessIndex, ProcessRegistry, ProcessSnapshot
+from .snapshot_cache import SnapshotCache
 from .utils import string_from_dict_optionally, string_from_list_optionally
 from .handlers_base import TaskParam
 
+class TopMetric(NamedTuple):
+    '''
+    A numeric process metric which can be used to rank processes with "top_<metric>[N]" selectors:
+    the value of the "attr" process property or, for properties returning a named tuple,
+    the sum of its "fields"
+    '''
+    attr: str
+    fields: Tuple[str, ...]
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        '''
+        The names of the ProcessColumns columns storing this metric
+        '''
+        return tuple(f"{self.attr}_{f}" for f in self.fields) if self.fields else (self.attr,)
+
+
+class ProcessSelector:
+    '''
+    A compiled "<kind>[PATTERN]" process selector, e.g. "name[python*]" or "cmdline[*--config*]".
+    The selector matches the processes whose property (name, command line, user name, executable or control group)
+    matches the fnmatch-style PATTERN; by default the matching process having the lowest PID is selected,
+    while a trailing "*" (or "+") selects all matching processes.
+
+    Selectors are resolved against the ProcessIndex of their property: a pattern without wildcards is a
+    single hash probe; otherwise the pattern is matched against the distinct values of the property,
+    remembering the outcome for each value.
+    '''
+
+    regexp = re.compile(r"^(name|cmdline|user|exe|cgroup)\[(.*)\]([*+]?)$")
+    kind_to_attr = {'name': 'name', 'cmdline': 'cmdline', 'user': 'username', 'exe': 'exe', 'cgroup': 'cgroup'}
+
+    # bound the memory used to remember the outcome of matches, e.g. against ever-changing command lines
+    MAX_MEMO_SIZE = 10000
+
+    def __init__(self, kind: str, pattern: str, wildcard: str) -> None:
+        self.kind = kind
+        self.attr = ProcessSelector.kind_to_attr[kind]
+        self.pattern = pattern
+        self.all_matches = wildcard != ''
+        self.join = TaskParam.is_join_wildcard(wildcard)
+        # fnmatch is case-insensitive on Windows: only on POSIX the pattern can be used as-is as a hash key
+        self.is_literal = os.name == 'posix' and not any(c in pattern for c in '*?[')
+        self.memo: Dict[str, bool] = {}
+
+    @staticmethod
+    def parse(process_id: str) -> Optional['ProcessSelector']:
+        '''
+        Compiles the provided "processes" task parameter, or returns None if it's not a "<kind>[PATTERN]" selector
+        '''
+        m = ProcessSelector.regexp.match(process_id)
+        if m is None:
+            return None
+        return ProcessSelector(m.group(1), m.group(2), m.group(3))
+
+    def matches(self, value: str) -> bool:
+        ret = self.memo.get(value, None)
+        if ret is None:
+            if len(self.memo) >= ProcessSelector.MAX_MEMO_SIZE:
+                self.memo = {}
+            ret = self.memo[value] = fnmatch.fnmatch(value, self.pattern)
+        return ret
+
+    def find_groups(self, snapshot: ProcessSnapshot) -> Dict[str, List[int]]:
+        '''
+        Returns the sorted PIDs of the processes of the snapshot matching this selector, grouped by the value of the property
+        '''
+        # the index is shared with the walks of the process table until the snapshot is detached from the registry
+        with snapshot.lock:
+            index = snapshot.indexes.get(self.attr, None)
+            if index is None:
+                # the property was not read by the walk of the process table
+                raise Exception(f"Process property '{self.attr}' not available to select processes")
+            if self.is_literal:
+                value_pids = index.pids_by_value.get(self.pattern, None)
+                matches = {self.pattern: value_pids} if value_pids is not None else {}
+            else:
+                matches = {value: value_pids for value, value_pids in index.pids_by_value.items() if self.matches(value)}
+            groups = {value: sorted(value_pids) for value, value_pids in matches.items()}
+        return groups
+
+    def find_pids(self, snapshot: ProcessSnapshot) -> List[int]:
+        '''
+        Returns the sorted PIDs of all processes of the snapshot matching this selector
+        '''
+        return sorted(pid for pids in self.find_groups(snapshot).values() for pid in pids)
+
+
+# the process properties shared by the "processes" and "process_groups" handlers, so that
+# all their tasks of the same sampling pass share a single walk of the process table
+process_registry = ProcessRegistry()
+
+
 class ProcessesCommandHandler(BaseHandler):
     '''
     This is the handler linking the Task class to the family of the
@@ -24,18 +130,149 @@ class ProcessesCommandHandler(BaseHandler):
      (https://psutil.readthedocs.io/en/latest/#psutil.process_iter)
     to iterate over all running processes and extract the information
     selected via the usual parameters provided to the handle() method.
+
+    All "processes" tasks of the same sampling pass share a single walk of the process table
+    (see ProcessSnapshot), reading at once the union of the process properties needed by those tasks.
+    The properties of processes are kept across sampling passes in a columnar store (see ProcessRegistry):
+    the properties of a process are gathered in a dictionary only when published.
+    Tasks selecting a single process by PID or PID file do not walk the process table, unless they publish a rate.
+
+    "top_<metric>[N]" selectors are served by ranking processes once per sampling pass and metric,
+    see ProcessSnapshot.get_top().
     '''
 
-    top_cpu_regexp = re.compile(r"^top_cpu(\[\d+\])*$")
-    top_memory_regexp = re.compile(r"^top_memory(\[\d+\])*$")
-    top_number_regexp = re.compile(r"^top_[a-z_]+\[(\d+)\]$")
+    # short names of common metrics usable in "top_<metric>" selectors
+    top_metric_aliases = {
+        'cpu': TopMetric('cpu_percent', ()),
+        'memory': TopMetric('memory_percent', ()),
+        'rss': TopMetric('memory_info', ('rss',)),
+        'io': TopMetric('io_counters', ('read_bytes', 'write_bytes')),
+        'io_rate': TopMetric('io_counters_rate', ('read_bytes', 'write_bytes')),
+        'threads': TopMetric('num_threads', ()),
+        'fds': TopMetric('num_fds', ()),
+    }
+    # single-valued numeric process properties usable in "top_<property>" selectors
+    top_numeric_properties = ['cpu_percent', 'memory_percent', 'num_threads', 'num_fds', 'nice', 'create_time']
+    # named-tuple process properties whose fields are usable in "top_<property>_<field>" selectors
+    # (rates first, so that e.g. "io_counters_rate_read_bytes" is not parsed as the "rate_read_bytes" field of "io_counters")
+    top_tuple_properties = ['io_counters_rate', 'cpu_times_rate', 'num_ctx_switches_rate',
+                            'memory_full_info', 'memory_info', 'io_counters', 'cpu_times', 'num_ctx_switches']
+
+    top_regexp = re.compile(r"^top_([a-z_]+)(?:\[(\d+)\])?$")
     pid_file_regexp = re.compile(r"^pid\[(.*)\]$")
-    name_pattern_regexp = re.compile(r"^name\[(.*)\]$")
 
-    def __init__(self) -> None:
+    def __init__(self, registry: Optional[ProcessRegistry] = None) -> None:
         super().__init__('processes')
+
+        # the union of the process properties needed by the tasks of the current sampling pass, see prefetch()
+        self.snapshot_attrs: FrozenSet[str] = frozenset()
+        self.registry = registry if registry is not None else process_registry
+        # metric -> number of processes ranked by the tasks of the current sampling pass, see prefetch()
+        self.top_sizes: Dict[str, int] = {}
+        # "processes" task parameter -> compiled selector, or None if the parameter is not a selector
+        self.selectors: Dict[str, Optional[ProcessSelector]] = {}
+        # PID -> psutil.Process instance of the processes selected by PID, see get_single_process()
+        self.single_processes: Dict[int, psutil.Process] = {}
         return
 
+    def configure(self, options: Dict[str, Any]) -> None:
+        # the registry, and thus the backend, is shared with the "process_groups" and "process_events" tasks
+        self.registry.set_backend(options["processes"]["backend"])
+        return
+
+    def prefetch(self, params_list: List[List[str]]) -> None:
+        '''
+        Computes the union of the process properties needed by all "processes" tasks about to run,
+        so that the first task reads all of them in a single walk of the process table
+        '''
+        attrs: Set[str] = set()
+        top_sizes: Dict[str, int] = {}
+        for params in params_list:
+            if len(params) >= 2:
+                try:
+                    attrs |= self.get_required_attrs(params[0], params[1])
+                except Exception:
+                    # invalid parameters: the error will be reported by the task itself
+                    continue
+                # compile selectors ahead of the sampling pass
+                self.get_selector(params[0])
+                m = self.top_regexp.match(params[0])
+                if m is not None:
+                    # rank, at once, enough processes for all tasks using the same metric
+                    index = int(m.group(2)) if m.group(2) is not None else 0
+                    top_sizes[m.group(1)] = max(top_sizes.get(m.group(1), 0), index + 1)
+        self.snapshot_attrs = frozenset(attrs)
+        self.registry.set_prefetch_attrs(self.name, self.snapshot_attrs)
+        self.top_sizes = top_sizes
+        return
+
+    @staticmethod
+    def get_top_metric(name: str) -> TopMetric:
+        '''
+        Parses the <metric> of a "top_<metric>" selector
+        '''
+        metric: Optional[TopMetric] = ProcessesCommandHandler.top_metric_aliases.get(name, None)
+        if metric is None:
+            if name in ProcessesCommandHandler.top_numeric_properties:
+                metric = TopMetric(name, ())
+            else:
+                for prop in ProcessesCommandHandler.top_tuple_properties:
+                    if name.startswith(prop + '_'):
+                        metric = TopMetric(prop, (name[len(prop) + 1:],))
+                        break
+        if metric is None or (metric.attr not in psutil_process_attrs and metric.attr not in process_rate_attrs):
+            raise Exception(f"Metric 'top_{name}' in 'processes' task is not supported")
+        return metric
+
+    @staticmethod
+    def get_required_attrs(process_id: str, property: str) -> FrozenSet[str]:
+        '''
+        Returns the process properties that must be read for all processes to serve a task
+        selecting processes with "process_id" and publishing their "property"
+        '''
+        attrs = set()
+        if property in process_rate_attrs:
+            # rates are computed by the walks of the process table, comparing the counters of each process with the previous walk
+            attrs.add(property)
+        m = ProcessesCommandHandler.top_regexp.match(process_id)
+        selector = ProcessSelector.parse(process_id)
+        if m is not None:
+            attrs.add(ProcessesCommandHandler.get_top_metric(m.group(1)).attr)
+        elif selector is not None:
+            attrs.add(selector.attr)
+            if selector.all_matches:
+                attrs |= ProcessesCommandHandler.get_property_attrs(property)
+        elif TaskParam.is_wildcard(process_id):
+            # the property is published for all processes
+            attrs |= ProcessesCommandHandler.get_property_attrs(property)
+        return frozenset(attrs)
+
+    @staticmethod
+    def get_property_attrs(property: str) -> FrozenSet[str]:
+        '''
+        Returns the process properties that must be read to publish "property"
+        '''
+        if property in psutil_process_attrs or property in process_rate_attrs:
+            return frozenset({property})
+        handler = process_handlers.get(property, None)
+        if isinstance(handler, ProcessPropertiesCommandHandler):
+            return handler.attrs
+        return frozenset()
+
+    def get_selector(self, process_id: str) -> Optional[ProcessSelector]:
+        '''
+        Returns the compiled selector for the provided "processes" task parameter; selectors are compiled only once
+        '''
+        if process_id not in self.selectors:
+            self.selectors[process_id] = ProcessSelector.parse(process_id)
+        return self.selectors[process_id]
+
+    def get_snapshot(self, required_attrs: FrozenSet[str]) -> ProcessSnapshot:
+        '''
+        Returns the snapshot of the process table of the current sampling pass
+        '''
+        return SnapshotCache.call(self.registry.take_snapshot, self.registry.get_prefetch_attrs() | required_attrs)
+
     def handle(self, params:list[str], caller_task_id: str) -> Payload:
         assert isinstance(params, list)
 
@@ -45,27 +282,38 @@ class ProcessesCommandHandler(BaseHandler):
         property = params[1]
         remaining_params = [params[2]] if len(params) == 3 else []
 
-        if TaskParam.is_wildcard(process_id):
+        required_attrs = self.get_required_attrs(process_id, property)
+        selector = self.get_selector(process_id) if isinstance(process_id, str) else None
+        # processes selected by PID are read directly, without walking the process table
+        snapshot: Optional[ProcessSnapshot] = None
+
+        if selector is not None:
+            snapshot = self.get_snapshot(required_attrs)
+            pids = selector.find_pids(snapshot)
+            if selector.all_matches:
+                return string_from_dict_optionally(self.get_snapshot_values(snapshot, pids, property, remaining_params), selector.join)
+            if not pids:
+                raise Exception(f"Process matching '{selector.pattern}' not found")
+            pid = pids[0]
+        elif TaskParam.is_wildcard(process_id):
             if TaskParam.is_regular_wildcard(property):
                 raise Exception(f"The process property in '{self.name}' should be specified")
-            result = {p.pid: self.get_process_value(p, property, remaining_params) for p in psutil.process_iter()}
+            snapshot = self.get_snapshot(required_attrs)
+            result = self.get_snapshot_values(snapshot, snapshot.pids, property, remaining_params)
             return string_from_dict_optionally(result, process_id.endswith(';'))
         elif isinstance(process_id, int):
             pid = process_id
         elif process_id.isdigit():
             pid = int(process_id)
-        elif self.top_cpu_regexp.match(process_id):
-            pid = self.find_process(process_id, lambda p: p.cpu_percent(), True)
-        elif self.top_memory_regexp.match(process_id):
-            pid = self.find_process(process_id, lambda p: p.memory_percent(), True)
+        elif self.top_regexp.match(process_id):
+            m = self.top_regexp.match(process_id)
+            assert m is not None
+            snapshot = self.get_snapshot(required_attrs)
+            pid = self.find_top_process(snapshot, m.group(1), int(m.group(2)) if m.group(2) is not None else 0)
         elif self.pid_file_regexp.match(process_id):
             m = self.pid_file_regexp.match(process_id)
             assert m is not None
             pid = self.get_pid_from_file(m.group(1).replace('|', '/'))
-        elif self.name_pattern_regexp.match(process_id):
-            m = self.name_pattern_regexp.match(process_id)
-            assert m is not None
-            pid = self.get_find_process(m.group(1))
         else:
             raise Exception("Process in '{self.name}' should be selected")
 
@@ -73,20 +321,49 @@ class ProcessesCommandHandler(BaseHandler):
             raise Exception(f"Process {process_id} not found")
 
         # we have a PID and property to fetch:
-        return self.get_process_value(psutil.Process(pid), property, remaining_params)
-
-    def find_process(self, request:str, cmp_func:Callable[..., float],
-            reverse:bool) -> int:
-        procs:List[psutil.Process] = []
-        for p in psutil.process_iter():
-            # do we just set a new attribute on a built-in object?
-            p._sort_value = cmp_func(p)
-            procs.append(p)
-
-        procs = sorted(procs, key=lambda p: p._sort_value, reverse=reverse)
-        m = self.top_number_regexp.match(request)
-        index = 0 if m is None else int(m.group(1))
-        return procs[index].pid
+        if snapshot is None and required_attrs:
+            # rates are computed only by the walks of the process table
+            snapshot = self.get_snapshot(required_attrs)
+        process = snapshot.get_process(pid) if snapshot is not None else None
+        if process is None:
+            return self.get_process_value(self.get_single_process(pid), property, remaining_params)
+        assert snapshot is not None
+        return self.get_process_value(process, property, remaining_params, snapshot.get_info(pid, self.get_property_attrs(property)))
+
+    def get_snapshot_values(self, snapshot: ProcessSnapshot, pids: Iterable[int], property: str, remaining_params: List[str]) -> Dict[int, Any]:
+        '''
+        Returns the provided property of the processes of the snapshot having the provided PIDs,
+        skipping the processes that exited since the snapshot was taken
+        '''
+        attrs = self.get_property_attrs(property)
+        result = {}
+        for pid in pids:
+            process = snapshot.get_process(pid)
+            if process is not None:
+                result[pid] = self.get_process_value(process, property, remaining_params, snapshot.get_info(pid, attrs))
+        return result
+
+    def get_single_process(self, pid: int) -> psutil.Process:
+        '''
+        Returns the psutil.Process instance of a process selected by PID; instances are kept across sampling passes,
+        so that e.g. the CPU usage of the process is measured since the previous pass
+        '''
+        process = self.single_processes.get(pid, None)
+        if process is None or not process.is_running():
+            process = psutil.Process(pid)
+            # forget the processes that exited, e.g. those selected by a PID file before a restart
+            single_processes = {p.pid: p for p in self.single_processes.values() if p.is_running()}
+            single_processes[pid] = process
+            self.single_processes = single_processes
+        return process
+
+    def find_top_process(self, snapshot: ProcessSnapshot, metric_name: str, index: int) -> int:
+        '''
+        Returns the PID of the process having the index-th largest value of the provided metric, or -1
+        '''
+        metric = self.get_top_metric(metric_name)
+        top = snapshot.get_top(metric_name, max(index + 1, self.top_sizes.get(metric_name, 0)), metric.columns)
+        return top[index] if index < len(top) else -1
 
     @staticmethod
     def get_pid_from_file(filename:str) -> int:
@@ -94,28 +371,332 @@ class ProcessesCommandHandler(BaseHandler):
             return int(f.read())
 
     @staticmethod
-    def get_find_process(pattern:str) -> int:
-        for p in psutil.process_iter():
-            if fnmatch.fnmatch(p.name(), pattern):
-                return p.pid
-        raise Exception("Process matching '" + pattern + "' not found")
-
-    @staticmethod
-    def get_process_value(process:psutil.Process, property:str, remaining_params:list[str]) -> Any:
+    def get_process_value(process:psutil.Process, property:str, remaining_params:list[str], info: Optional[Dict[str, Any]] = None) -> Any:
         process_handler = process_handlers.get(property, None)
         if process_handler is None:
             raise Exception(f"Property '{property}' in 'processes' task is not supported")
 
-        return process_handler.handle(remaining_params, process)
+        return process_handler.handle(remaining_params, process, info)
+
+class ProcessGroupsCommandHandler(BaseHandler):
+    '''
+    Publishes the sum of a numeric metric (e.g. CPU usage or RSS) over a group of processes:
+     * the processes matching a "<kind>[PATTERN]" selector (see ProcessSelector); with a trailing "*" or "+"
+       the matching processes are grouped by the value of their property, e.g. one group per process name;
+     * the processes of a "subtree[PID]" (a process and all its descendants).
+    Groups are computed on the same snapshot of the "processes" tasks, summing the columns of its ProcessColumns store.
+    '''
+
+    subtree_regexp = re.compile(r"^subtree\[(.*)\]$")
+
+    def __init__(self, registry: Optional[ProcessRegistry] = None) -> None:
+        super().__init__('process_groups')
+        self.registry = registry if registry is not None else process_registry
+        # "process_groups" task parameter -> compiled selector, or None if the parameter is not a selector
+        self.selectors: Dict[str, Optional[ProcessSelector]] = {}
+        return
+
+    def get_selector(self, group: str) -> Optional[ProcessSelector]:
+        if group not in self.selectors:
+            self.selectors[group] = ProcessSelector.parse(group)
+        return self.selectors[group]
+
+    def get_required_attrs(self, group: str, metric_name: str) -> FrozenSet[str]:
+        '''
+        Returns the process properties that must be read for all processes to serve a task
+        summing "metric_name" over the processes of "group"
+        '''
+        attrs = set()
+        if metric_name != 'count':
+            attrs.add(ProcessesCommandHandler.get_top_metric(metric_name).attr)
+        selector = self.get_selector(group)
+        if selector is not None:
+            attrs.add(selector.attr)
+        elif self.subtree_regexp.match(group):
+            attrs.add('ppid')
+        else:
+            raise Exception(f"Process group '{group}' in '{self.name}' is not supported")
+        return frozenset(attrs)
+
+    def prefetch(self, params_list: List[List[str]]) -> None:
+        '''
+        Declares the process properties needed by all "process_groups" tasks about to run,
+        so that they are read by the same walk of the process table of the "processes" tasks
+        '''
+        attrs: Set[str] = set()
+        for params in params_list:
+            if len(params) == 2:
+                try:
+                    attrs |= self.get_required_attrs(params[0], params[1])
+                except Exception:
+                    # invalid parameters: the error will be reported by the task itself
+                    continue
+        self.registry.set_prefetch_attrs(self.name, frozenset(attrs))
+        return
+
+    def handle(self, params:list[str], caller_task_id: str) -> Payload:
+        assert isinstance(params, list)
+
+        if len(params) != 2:
+            raise Exception(f"Exactly 2 parameters are supported for '{self.name}'; found {len(params)} parameters instead: {params}")
+        group = params[0]
+        metric_name = params[1]
+        required_attrs = self.get_required_attrs(group, metric_name)
+        snapshot = SnapshotCache.call(self.registry.take_snapshot, self.registry.get_prefetch_attrs() | required_attrs)
+
+        selector = self.get_selector(group)
+        if selector is not None:
+            if selector.all_matches:
+                groups = selector.find_groups(snapshot)
+                if selector.join:
+                    result = {value: self.sum_metric(snapshot, metric_name, pids) for value, pids in groups.items()}
+                    return string_from_dict_optionally(result, True)
+                # group values like "/system.slice/nginx.service" become a single MQTT topic level
+                return {value.replace('/', '|'): self.sum_metric(snapshot, metric_name, pids) for value, pids in groups.items()}
+            return self.sum_metric(snapshot, metric_name, selector.find_pids(snapshot))
+
+        m = self.subtree_regexp.match(group)
+        assert m is not None
+        root = m.group(1)
+        if root.isdigit():
+            root_pid = int(root)
+        else:
+            root_pid = ProcessesCommandHandler.get_pid_from_file(root.replace('|', '/'))
+        pids = snapshot.get_subtree(root_pid)
+        if not pids:
+            raise Exception(f"Process {root_pid} not found")
+        return self.sum_metric(snapshot, metric_name, pids)
+
+    @staticmethod
+    def sum_metric(snapshot: ProcessSnapshot, metric_name: str, pids: List[int]) -> Payload:
+        '''
+        Returns the sum of the provided metric over the provided processes, skipping values that could not be read
+        '''
+        if metric_name == 'count':
+            return len(pids)
+        metric = ProcessesCommandHandler.get_top_metric(metric_name)
+        total = snapshot.sum_values(metric.columns, pids)
+        if total is None:
+            # no process has a readable value of this metric
+            return 0
+        return int(total) if float(total).is_integer() else total
+
+
+class ProcessEventsCommandHandler(BaseHandler):
+    '''
+    Publishes the processes that started or exited since the previous run of each task, as a JSON list of events.
+
+    By default events are computed from the processes found started or exited by the walks of the process table
+    (shared with the "processes" tasks) since the previous run of each task, see ProcessRegistry:
+    processes living less than the interval between two runs of a task are never reported.
+    On Linux the netlink proc connector can be used instead (see the "proc_connector" option): events are received
+    from the kernel as they happen, and the tasks are published again as soon as new events are available.
+    '''
+
+    event_types = ['start', 'exit']
+    required_attrs = frozenset({'name', 'cmdline'})
+
+    # max number of events received from the proc connector and kept until they are published
+    MAX_PENDING_EVENTS = 10000
+
+    def __init__(self, registry: Optional[ProcessRegistry] = None) -> None:
+        super().__init__('process_events')
+        self.registry = registry if registry is not None else process_registry
+        self.use_proc_connector = False
+        self.connector: Optional[ProcConnector] = None
+        self.lock = threading.Lock()
+
+        # without proc connector: caller task ID -> ID of the walk of the process table used by its last run
+        self.last_walk_ids: Dict[str, int] = {}
+
+        # with proc connector: the events received so far, with their sequence number, and the last sequence number
+        # published by each caller task
+        self.events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=ProcessEventsCommandHandler.MAX_PENDING_EVENTS)
+        self.last_seq = 0
+        self.caller_seqs: Dict[str, int] = {}
+        # PID -> start event of the processes started since the subscription to the proc connector
+        self.started: Dict[int, Dict[str, Any]] = {}
+        self.refreshed_callers: Set[str] = set()
+        return
+
+    def configure(self, options: Dict[str, Any]) -> None:
+        self.use_proc_connector = options["process_events"]["proc_connector"]
+        return
+
+    def prefetch(self, params_list: List[List[str]]) -> None:
+        '''
+        Subscribes to the proc connector, if configured, or declares the process properties needed by
+        the "process_events" tasks about to run
+        '''
+        if not params_list:
+            self.registry.set_prefetch_attrs(self.name, frozenset())
+            return
+        if self.use_proc_connector and self.connector is None:
+            connector = ProcConnector(self.on_proc_events, self.on_proc_connector_failure)
+            try:
+                connector.start()
+                self.connector = connector
+                logging.info("ProcessEventsCommandHandler: receiving process events from the proc connector")
+            except (OSError, AttributeError) as ex:
+                # AttributeError: netlink sockets are not available outside Linux
+                logging.warning(f"ProcessEventsCommandHandler: proc connector not available, falling back to polling: {ex}")
+                self.use_proc_connector = False
+        if self.connector is None:
+            self.registry.set_prefetch_attrs(self.name, self.required_attrs)
+        return
+
+    def shutdown(self) -> None:
+        '''
+        Unsubscribes from the proc connector, if subscribed, and closes its netlink socket
+        '''
+        connector = self.connector
+        self.connector = None
+        if connector is not None:
+            connector.stop()
+        return
+
+    def on_proc_connector_failure(self, ex: OSError) -> None:
+        '''
+        Invoked by the thread of the proc connector when it stops receiving events: falls back to polling
+        '''
+        logging.warning(f"ProcessEventsCommandHandler: proc connector failed, falling back to polling: {ex}")
+        self.use_proc_connector = False
+        self.connector = None
+        self.registry.set_prefetch_attrs(self.name, self.required_attrs)
+        return
+
+    def handle(self, params:list[str], caller_task_id: str) -> Payload:
+        assert isinstance(params, list)
+
+        if len(params) != 1:
+            raise Exception(f"Exactly 1 parameter is supported for '{self.name}'; found {len(params)} parameters instead: {params}")
+        event_type = params[0]
+        if event_type not in self.event_types and not TaskParam.is_join_wildcard(event_type):
+            raise Exception(f"Parameter '{event_type}' in '{self.name}' is not supported")
+
+        if self.connector is not None:
+            events = self.get_received_events(caller_task_id)
+        else:
+            events = self.get_polled_events(caller_task_id)
+        if not TaskParam.is_join_wildcard(event_type):
+            events = [e for e in events if e["event"] == event_type]
+        if not events:
+            # nothing to publish
+            raise PendingValueError("no process started or exited")
+        return string_from_list_optionally(events, True)
+
+    @staticmethod
+    def make_event(event: str, pid: int, name: Any, cmdline: Any, create_time: Optional[float], detected_at: float) -> Dict[str, Any]:
+        return {
+            "event": event,
+            "pid": pid,
+            "name": None if name is ACCESS_DENIED else name,
+            "cmdline": ProcessIndex.get_key(cmdline),
+            "create_time": create_time,
+            "detected_at": detected_at,
+        }
+
+    def get_polled_events(self, caller_task_id: str) -> List[Dict[str, Any]]:
+        '''
+        Returns the processes started or exited since the previous call by the same task;
+        the first call returns no event
+        '''
+        snapshot = SnapshotCache.call(self.registry.take_snapshot, self.registry.get_prefetch_attrs() | self.required_attrs)
+        with self.lock:
+            last_walk_id = self.last_walk_ids.get(caller_task_id, None)
+            self.last_walk_ids[caller_task_id] = snapshot.walk_id
+        if last_walk_id is None or last_walk_id >= snapshot.walk_id:
+            return []
+
+        events = []
+        for pid in snapshot.get_started(last_walk_id):
+            info = snapshot.get_info(pid, self.required_attrs)
+            assert info is not None
+            events.append(self.make_event("start", pid, info['name'], info['cmdline'], snapshot.get_create_time(pid), snapshot.timestamp))
+        for pid, create_time, name, cmdline in self.registry.get_exits(last_walk_id, snapshot.walk_id):
+            events.append(self.make_event("exit", pid, name, cmdline, create_time, snapshot.timestamp))
+        return events
+
+    def get_received_events(self, caller_task_id: str) -> List[Dict[str, Any]]:
+        '''
+        Returns the events received from the proc connector since the previous call by the same task;
+        the first call returns no event
+        '''
+        with self.lock:
+            last_seq = self.caller_seqs.get(caller_task_id, None)
+            self.caller_seqs[caller_task_id] = self.last_seq
+            if last_seq is None:
+                return []
+            # start events are updated by the thread of the proc connector: return copies
+            return [dict(e) for seq, e in self.events if seq > last_seq]
+
+    @staticmethod
+    def read_process_info(pid: int) -> Dict[str, Any]:
+        try:
+            p = psutil.Process(pid)
+            return p.as_dict(attrs=['name', 'cmdline', 'create_time'], ad_value=None)
+        except psutil.NoSuchProcess:
+            # the process already exited
+            return {'name': None, 'cmdline': None, 'create_time': None}
+
+    def on_proc_events(self, proc_events: List[ProcEvent]) -> None:
+        '''
+        Invoked by the thread of the proc connector: processes are reported as started when they are forked, so that
+        every exit event has its start event, also for processes that never execute a new program (e.g. the workers
+        of prefork servers). When a started process executes a new program, its start event reports that program
+        to the tasks that did not publish it yet.
+        '''
+        now = time.time()
+        events = []
+        for ev in proc_events:
+            if ev.what == "fork":
+                info = self.read_process_info(ev.pid)
+                event = self.make_event("start", ev.pid, info['name'], info['cmdline'], info['create_time'], now)
+                with self.lock:
+                    self.started[ev.pid] = event
+                events.append(event)
+            elif ev.what == "exec":
+                with self.lock:
+                    start_event = self.started.get(ev.pid, None)
+                if start_event is not None:
+                    info = self.read_process_info(ev.pid)
+                    with self.lock:
+                        start_event["name"] = info['name']
+                        start_event["cmdline"] = ProcessIndex.get_key(info['cmdline'])
+            elif ev.what == "exit":
+                with self.lock:
+                    start_event = self.started.pop(ev.pid, None)
+                info = start_event if start_event is not None else self.registry.get_known_info(ev.pid)
+                event = self.make_event("exit", ev.pid, info['name'], info['cmdline'], info['create_time'], now)
+                event["exit_code"] = ev.exit_code
+                event["signal"] = ev.signal
+                events.append(event)
+        if not events:
+            return
+        with self.lock:
+            for event in events:
+                self.last_seq += 1
+                self.events.append((self.last_seq, event))
+            # publish the new events right away
+            self.refreshed_callers.update(self.caller_seqs.keys())
+        return
+
+    def pop_refreshed_callers(self) -> List[str]:
+        with self.lock:
+            callers = list(self.refreshed_callers)
+            self.refreshed_callers = set()
+        return callers
+
 
 class ProcessCommandHandler:
     '''
     Base abstract class for all process-related command handlers.
+    The "info" dictionary passed to handle() holds the properties of the process read by the walk of the process table, if any.
     '''
     def __init__(self, name:str):
         self.name = name
 
-    def handle(self, params: list[str], process:psutil.Process) -> Payload:
+    def handle(self, params: list[str], process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
         assert isinstance(params, list)
         raise Exception("Not implemented")
 
@@ -134,27 +715,39 @@ class ProcessMethodCommandHandler(ProcessCommandHandler):
             self.method = None  # method not defined
         return
 
-    def handle(self, params: list[str], process:psutil.Process) -> Payload:
+    def handle(self, params: list[str], process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
         assert isinstance(params, list)
         if params != []:
             raise Exception(f"Parameter '{params}' in '{self.name}' is not supported")
 
-        return self.get_value(process)
+        return self.get_value(process, info)
 
-    def get_value(self, process:psutil.Process) -> Payload:
+    def get_value(self, process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
         if self.method is None:
             raise Exception(f"Not implemented: psutil.{self.name}")
+        return self.call_method(process, info)
+
+    def call_method(self, process:psutil.Process, info: Optional[Dict[str, Any]]) -> Any:
+        # use the value read by the process snapshot, if any
+        if info is not None:
+            value = info.get(self.name, ACCESS_DENIED)
+            if value is not ACCESS_DENIED:
+                return value
         # invoke the psutil method (e.g. "pid", "exe" etc) on the psutil.Process instance;
         # e.g.
         #     process = psutil.Process(1)
         #     method = getattr(psutil.Process, "exe")
         #     method(process)
         #   >> '/usr/lib/systemd/systemd'
+        assert self.method is not None
         return self.method(process)
 
 
 class ProcessPropertiesCommandHandler(ProcessCommandHandler):
     '''
+    Publishes all the properties of a process (and, optionally, their fields, e.g. "memory_info/rss").
+    All properties are read at once by psutil.Process.as_dict() inside oneshot(), unless they were already
+    read by the walk of the process table.
     '''
 
     def __init__(self, name:str, join:bool, subproperties:bool):
@@ -163,28 +756,41 @@ class ProcessPropertiesCommandHandler(ProcessCommandHandler):
         self.subproperties = subproperties
         return
 
-    def handle(self, params: list[str],process:psutil.Process) -> Payload:
+    @property
+    def attrs(self) -> FrozenSet[str]:
+        '''
+        The process properties published by this handler on the current platform
+        '''
+        return psutil_compound_attrs | psutil_scalar_attrs if self.subproperties else psutil_scalar_attrs
+
+    def handle(self, params: list[str], process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
         assert isinstance(params, list)
         if params != []:
-            raise Exception("Parameter '" + params + "' in '" + self.name + "' is not supported")
+            raise Exception(f"Parameter '{params}' in '{self.name}' is not supported")
+
+        return self.get_value(process, info)
 
-        return self.get_value(process)
+    def get_value(self, process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
+        attrs = self.attrs
+        # properties that could not be read by the walk of the process table are not read again
+        values = {k: v for k, v in (info or {}).items() if k in attrs}
+        missing = sorted(attrs - values.keys())
+        if missing:
+            with process.oneshot():
+                values.update(process.as_dict(attrs=missing, ad_value=ACCESS_DENIED))
 
-    def get_value(self, process:psutil.Process) -> Payload:
         result: Dict[str, Any] = dict()
-        for k, handler in process_handlers.items():
-            if hasattr(handler, "method") and handler.method is not None:  # property is defined for current OS
-                try:
-                    if isinstance(handler, ProcessMethodCommandHandler):
-                        v = handler.handle('', process)
-                        self.add_to_dict(result, k, v)
-                    elif self.subproperties:
-                        if isinstance(handler, ProcessMethodIndexCommandHandler) \
-                                or isinstance(handler, ProcessMethodTupleCommandHandler):
-                            v = handler.handle('*', process)
-                            self.add_to_dict(result, k, v)
-                except psutil.AccessDenied:  # just skip with property
-                    logging.warning(f"AccessDenied when calling {handler}.handle()")
+        for k in psutil_dump_attrs:
+            if k == 'pid':
+                self.add_to_dict(result, k, process.pid)
+            elif k in attrs:
+                v = values[k]
+                if v is ACCESS_DENIED:  # just skip with property
+                    logging.warning(f"AccessDenied when reading '{k}' of process {process.pid}")
+                elif k in psutil_compound_attrs and not isinstance(v, list):
+                    self.add_to_dict(result, k, v._asdict())
+                else:
+                    self.add_to_dict(result, k, v)
 
         return string_from_dict_optionally(result, self.join)
 
@@ -208,14 +814,15 @@ class ProcessPropertiesCommandHandler(ProcessCommandHandler):
 
 class ProcessMethodIndexCommandHandler(ProcessMethodCommandHandler):
 
-    def handle(self, params: list[str], process:psutil.Process) -> Payload:
+    def handle(self, params: list[str], process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
         assert isinstance(params, list)
         if len(params) != 1:
             raise Exception(f"Exactly 1 parameter is supported for '{self.name}'; found {len(params)} parameters instead: {params}")
         param = params[0]
 
-        assert self.method is not None
-        arr = self.method(process)
+        if self.method is None:
+            raise Exception(f"Not implemented: psutil.{self.name}")
+        arr = self.call_method(process, info)
 
         if TaskParam.is_wildcard(param):
             return string_from_list_optionally(arr, param.endswith(';'))
@@ -231,13 +838,14 @@ class ProcessMethodIndexCommandHandler(ProcessMethodCommandHandler):
 
 class ProcessMethodTupleCommandHandler(ProcessMethodCommandHandler):
 
-    def handle(self, params: list[str], process:psutil.Process) -> Payload:
+    def handle(self, params: list[str], process:psutil.Process, info: Optional[Dict[str, Any]] = None) -> Payload:
         assert isinstance(params, list)
         if len(params) != 1:
             raise Exception(f"Exactly 1 parameter is supported for '{self.name}'; found {len(params)} parameters instead: {params}")
 
-        assert self.method is not None
-        tup = self.method(process)
+        if self.method is None:
+            raise Exception(f"Not implemented: psutil.{self.name}")
+        tup = self.call_method(process, info)
 
         param = params[0]
         if TaskParam.is_wildcard(param):
@@ -248,13 +856,33 @@ class ProcessMethodTupleCommandHandler(ProcessMethodCommandHandler):
         raise Exception(f"Parameter '{param}' in '{self.name}' is not supported")
 
 
+class ProcessRateCommandHandler(ProcessMethodTupleCommandHandler):
+    '''
+    Publishes the rate of change per second of the counters returned by a psutil.Process method (e.g. "io_counters"),
+    since the previous walk of the process table (see ProcessRegistry.RATE_ATTRS).
+    The first value published for each process is zero.
+    '''
+
+    def __init__(self, name:str, counters_name:str):
+        super().__init__(counters_name)
+        # the rate is available on the platforms implementing the counters method
+        self.name = name
+        return
+
+    def call_method(self, process:psutil.Process, info: Optional[Dict[str, Any]]) -> Any:
+        value = info.get(self.name, ACCESS_DENIED) if info is not None else ACCESS_DENIED
+        if value is ACCESS_DENIED:
+            raise Exception(f"Property '{self.name}' of process {process.pid} not available")
+        return value
+
+
 process_handlers = {
     '*': ProcessPropertiesCommandHandler('*', False, False),
     '**': ProcessPropertiesCommandHandler('**', False, True),
     '*;': ProcessPropertiesCommandHandler('*;', True, False),
     '**;': ProcessPropertiesCommandHandler('**;', True, True),
     'pid': type("ProcessPidCommandHandler", (ProcessMethodCommandHandler, object),
-                {"get_value": lambda self, process: process.pid})('pid'),
+                {"get_value": lambda self, process, info=None: process.pid})('pid'),
     'ppid': ProcessMethodCommandHandler('ppid'),
     'name': ProcessMethodCommandHandler('name'),
     'exe': ProcessMethodCommandHandler('exe'),
@@ -277,4 +905,23 @@ process_handlers = {
     'num_fds': ProcessMethodCommandHandler('num_fds'),
     'num_ctx_switches': ProcessMethodTupleCommandHandler('num_ctx_switches'),
     'nice': ProcessMethodCommandHandler('nice'),
+    'io_counters_rate': ProcessRateCommandHandler('io_counters_rate', 'io_counters'),
+    'num_ctx_switches_rate': ProcessRateCommandHandler('num_ctx_switches_rate', 'num_ctx_switches'),
+    'cpu_times_rate': ProcessRateCommandHandler('cpu_times_rate', 'cpu_times'),
 }
+
+# the process properties that psutil.Process.as_dict() and psutil.process_iter() can read on this platform
+psutil_process_attrs = frozenset(k for k, h in process_handlers.items()
+                                 if isinstance(h, ProcessMethodCommandHandler) and not isinstance(h, ProcessRateCommandHandler)
+                                 and h.method is not None and k != 'pid')
+
+# the rates of process counters that the walks of the process table can compute on this platform
+process_rate_attrs = frozenset(k for k, h in process_handlers.items()
+                               if isinstance(h, ProcessRateCommandHandler) and h.method is not None)
+
+# the properties published by the "*" and "**" process property dumps on this platform, in publishing order;
+# "compound" properties are lists or named tuples, published only by "**"
+psutil_dump_attrs = ['pid'] + [k for k in process_handlers if k in psutil_process_attrs]
+psutil_compound_attrs = frozenset(k for k in psutil_process_attrs
+                                  if isinstance(process_handlers[k], (ProcessMethodIndexCommandHandler, ProcessMethodTupleCommandHandler)))
+psutil_scalar_attrs = psutil_process_attrs - psutil_compound_attrs
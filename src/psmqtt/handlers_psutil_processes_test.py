@@ -1,12 +1,33 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+from array import array
+import collections
+import heapq
+import json
+import os
+import psutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
 import unittest
+from unittest import mock
 import pytest
 
 from .handlers_psutil_processes import (
-    ProcessesCommandHandler
+    ProcessesCommandHandler,
+    ProcessEventsCommandHandler,
+    ProcessGroupsCommandHandler,
+    psutil_scalar_attrs,
 )
+from .handlers_base import PendingValueError
+from .proc_connector import ProcConnector, ProcEvent
+from .procfs_reader import ProcfsReader
+from .process_snapshot import ACCESS_DENIED, ProcessColumns, ProcessIndex, ProcessRegistry, ProcessSnapshot, compute_rate, read_cgroup
+from .snapshot_cache import SnapshotCache
 
 fake_task_id = "0.0"
 
@@ -42,3 +63,511 @@ class TestHandlers(unittest.TestCase):
         pid = handler.handle([f'name[{last_name}]','pid'], fake_task_id)
         self.assertEqual(pid, last_pid)
         return
+
+    def test_ProcessesCommandHandlerSnapshot(self) -> None:
+        handler = ProcessesCommandHandler()
+        params_list = [['*', 'name'], ['top_cpu', 'name'], ['top_memory[1]', 'pid'], ['name[python*]', 'pid'],
+                       [str(os.getpid()), 'num_threads'], ['+', 'cpu_percent']]
+
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+        handler.prefetch(params_list)
+        self.assertEqual(frozenset({'name', 'cpu_percent', 'memory_percent'}), handler.snapshot_attrs)
+
+        num_misses = SnapshotCache.num_misses
+        SnapshotCache.begin_pass()
+        try:
+            for i, params in enumerate(params_list):
+                handler.handle(params, str(i))
+        finally:
+            SnapshotCache.end_pass()
+        # all tasks were served by a single walk of the process table
+        self.assertEqual(num_misses + 1, SnapshotCache.num_misses)
+
+        # the property of a single process not found in the snapshot is read from the process itself
+        self.assertEqual(os.getpid(), handler.handle([str(os.getpid()), 'pid'], fake_task_id))
+
+    def test_ProcessesCommandHandlerSinglePid(self) -> None:
+        registry = ProcessRegistry()
+        handler = ProcessesCommandHandler(registry)
+        with tempfile.NamedTemporaryFile("w", suffix=".pid") as pid_file:
+            pid_file.write(str(os.getpid()))
+            pid_file.flush()
+            params_list = [[str(os.getpid()), 'num_threads'], [f"pid[{pid_file.name.replace('/', '|')}]", 'name']]
+            handler.prefetch(params_list)
+            self.assertEqual(frozenset(), registry.get_prefetch_attrs())
+
+            SnapshotCache.clear()
+            SnapshotCache.set_max_age(0)
+            num_misses = SnapshotCache.num_misses
+            SnapshotCache.begin_pass()
+            try:
+                results = [handler.handle(params, str(i)) for i, params in enumerate(params_list)]
+            finally:
+                SnapshotCache.end_pass()
+        # processes selected by PID do not need a walk of the process table
+        self.assertEqual(num_misses, SnapshotCache.num_misses)
+        self.assertEqual(0, registry.num_created)
+        me = psutil.Process()
+        self.assertEqual([me.num_threads(), me.name()], results)
+
+        # CPU usage of a process selected by PID is measured since the previous pass
+        self.assertEqual(0.0, handler.handle([str(os.getpid()), 'cpu_percent'], fake_task_id))
+        busy_until = time.time() + 0.3
+        while time.time() < busy_until:
+            pass
+        self.assertGreater(handler.handle([str(os.getpid()), 'cpu_percent'], fake_task_id), 10)
+
+        # a walk needing no property reads just the PIDs, not all properties
+        with mock.patch.object(psutil.Process, 'as_dict', autospec=True, return_value={}) as as_dict:
+            snapshot = registry.take_snapshot(frozenset())
+        self.assertTrue(snapshot.has_process(os.getpid()))
+        self.assertTrue(all(call.kwargs['attrs'] == ['pid'] for call in as_dict.call_args_list))
+        self.assertEqual({}, snapshot.get_info(os.getpid()))
+
+    def test_ProcessRegistry(self) -> None:
+        registry = ProcessRegistry()
+        attrs = frozenset({'name', 'cpu_percent'})
+        snapshot = registry.take_snapshot(attrs)
+        self.assertIsNotNone(snapshot.get_process(os.getpid()))
+        num_created = registry.num_created
+        self.assertEqual(len(snapshot), num_created)
+        slot = registry.slots_by_pid[os.getpid()]
+
+        # slots are kept by the next walks, so that CPU usage is measured between walks
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.5)"])
+        try:
+            busy_until = time.time() + 0.2
+            while time.time() < busy_until:
+                pass
+            snapshot2 = registry.take_snapshot(attrs)
+            self.assertEqual(slot, registry.slots_by_pid[os.getpid()])
+            self.assertGreater(snapshot2.get_info(os.getpid())['cpu_percent'], 0)
+            self.assertTrue(snapshot2.has_process(child.pid))
+            child_slot = registry.slots_by_pid[child.pid]
+        finally:
+            child.wait()
+
+        # slots of exited processes are freed, and reused by new processes
+        snapshot3 = registry.take_snapshot(attrs)
+        self.assertFalse(snapshot3.has_process(child.pid))
+        self.assertGreaterEqual(registry.num_evicted, 1)
+        self.assertIn(child_slot, registry.store.free_slots)
+        self.assertEqual(len(snapshot3), len(registry.store) - len(registry.store.free_slots))
+        # the store does not grow with processes starting and exiting
+        for _ in range(3):
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            registry.take_snapshot(attrs)
+        self.assertLessEqual(len(registry.store), len(snapshot3) + 5)
+
+        # a PID reused by a new process gets a new slot
+        registry.store.create_times[slot] = 0.0
+        snapshot4 = registry.take_snapshot(attrs)
+        self.assertNotEqual(slot, registry.slots_by_pid[os.getpid()])
+        self.assertEqual(0.0, snapshot4.get_info(os.getpid())['cpu_percent'])
+
+    def test_ProcessSnapshotConsistency(self) -> None:
+        # a snapshot kept alive (e.g. by "cache_ttl") is not altered by the next walks of the process table
+        registry = ProcessRegistry()
+        attrs = frozenset({'num_threads'})
+        pid = os.getpid()
+        snapshot = registry.take_snapshot(attrs)
+        num_threads = snapshot.get_info(pid)['num_threads']
+
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            snapshot2 = registry.take_snapshot(attrs)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(num_threads + 1, snapshot2.get_info(pid)['num_threads'])
+        # the store of the registry is refreshed in place, while the first snapshot got its own copy
+        self.assertIs(registry.store, snapshot2.store)
+        self.assertIsNot(registry.store, snapshot.store)
+
+        self.assertEqual(num_threads, snapshot.get_info(pid)['num_threads'])
+        self.assertEqual(num_threads, snapshot.sum_values(['num_threads'], [pid]))
+        self.assertEqual(num_threads, ProcessesCommandHandler.get_process_value(snapshot.get_process(pid), 'num_threads', [],
+                                                                                snapshot.get_info(pid)))
+
+    def test_ProcessSnapshotIndexes(self) -> None:
+        # selectors resolved on a snapshot kept alive by a worker task ignore the processes found by later walks
+        registry = ProcessRegistry()
+        handler = ProcessesCommandHandler(registry)
+        marker = f"psmqtt-indexes-test-{os.getpid()}"
+        selector = handler.get_selector(f'cmdline[*{marker}]*')
+        assert selector is not None
+        snapshot = registry.take_snapshot(frozenset({'cmdline'}))
+        self.assertEqual([], selector.find_pids(snapshot))
+
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)", marker])
+        try:
+            snapshot2 = registry.take_snapshot(frozenset({'cmdline'}))
+        finally:
+            child.kill()
+            child.wait()
+        self.assertEqual([child.pid], selector.find_pids(snapshot2))
+        self.assertEqual([], selector.find_pids(snapshot))
+        self.assertIsNot(registry.indexes['cmdline'], snapshot.indexes['cmdline'])
+
+    def test_ProcessesCommandHandlerTop(self) -> None:
+        handler = ProcessesCommandHandler()
+        params_list = [['top_threads', 'pid'], ['top_num_threads[2]', 'pid'], ['top_memory_info_rss[1]', 'pid'],
+                       ['top_rss', 'pid'], ['top_io', 'pid'], ['top_cpu[1]', 'name']]
+
+        handler.prefetch(params_list)
+        self.assertEqual({'threads': 1, 'num_threads': 3, 'memory_info_rss': 2, 'rss': 1, 'io': 1, 'cpu': 2}, handler.top_sizes)
+
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+        SnapshotCache.begin_pass()
+        try:
+            results = [handler.handle(params, str(i)) for i, params in enumerate(params_list)]
+            snapshot = handler.get_snapshot(frozenset())
+        finally:
+            SnapshotCache.end_pass()
+
+        # same ranking of a full sort
+        infos = {pid: snapshot.get_info(pid) for pid in snapshot.pids}
+        by_threads = sorted(infos.values(), key=lambda info: info['num_threads'], reverse=True)
+        self.assertEqual(by_threads[0]['num_threads'], infos[results[0]]['num_threads'])
+        self.assertEqual(by_threads[2]['num_threads'], infos[results[1]]['num_threads'])
+        by_rss = sorted(infos, key=lambda pid: infos[pid]['memory_info'].rss, reverse=True)
+        self.assertEqual(by_rss[1], results[2])
+        self.assertEqual(by_rss[0], results[3])
+
+        # each metric was ranked once, for all tasks using it
+        self.assertEqual(3, snapshot.top_processes['num_threads'][0])
+        self.assertEqual(3, len(snapshot.get_top('num_threads', 3, ['num_threads'])))
+
+        with self.assertRaises(Exception):
+            handler.handle(['top_foo', 'pid'], fake_task_id)
+        with self.assertRaises(Exception):
+            handler.handle(['top_cpu[100000000]', 'pid'], fake_task_id)
+
+    def test_ProcessIndex(self) -> None:
+        index = ProcessIndex('cmdline')
+        index.update(10, ['python', 'a.py'])
+        index.update(11, ['python', 'a.py'])
+        index.update(12, ACCESS_DENIED)
+        self.assertEqual({'python a.py': {10, 11}}, index.pids_by_value)
+
+        index.update(11, ['python', 'b.py'])
+        self.assertEqual({'python a.py': {10}, 'python b.py': {11}}, index.pids_by_value)
+        index.remove(10)
+        index.remove(12)
+        self.assertEqual({'python b.py': {11}}, index.pids_by_value)
+        self.assertEqual({11: 'python b.py'}, index.value_by_pid)
+
+    def test_ProcessesCommandHandlerSelectors(self) -> None:
+        handler = ProcessesCommandHandler()
+        marker = f"psmqtt-selector-test-{os.getpid()}"
+        children = [subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)", marker]) for _ in range(2)]
+        try:
+            SnapshotCache.clear()
+            SnapshotCache.set_max_age(0)
+            SnapshotCache.begin_pass()
+            try:
+                pids = sorted(p.pid for p in children)
+                self.assertEqual(pids[0], handler.handle([f'cmdline[*{marker}]', 'pid'], fake_task_id))
+                self.assertEqual({pid: pid for pid in pids}, handler.handle([f'cmdline[*{marker}]*', 'pid'], fake_task_id))
+                joined = handler.handle([f'cmdline[*{marker}]+', 'pid'], fake_task_id)
+                self.assertEqual({str(pid): pid for pid in pids}, json.loads(joined))
+
+                me = psutil.Process()
+                self.assertEqual(os.getpid(), handler.handle([f'exe[{me.exe()}]*', 'pid'], fake_task_id)[os.getpid()])
+                self.assertIn(os.getpid(), handler.handle([f'user[{me.username()}]*', 'pid'], fake_task_id))
+                self.assertIn(os.getpid(), handler.handle([f'name[{me.name()}]*', 'pid'], fake_task_id))
+
+                with self.assertRaises(Exception):
+                    handler.handle(['name[no-such-process-name]', 'pid'], fake_task_id)
+                self.assertEqual({}, handler.handle(['name[no-such-process-name]*', 'pid'], fake_task_id))
+            finally:
+                SnapshotCache.end_pass()
+        finally:
+            for child in children:
+                child.kill()
+                child.wait()
+
+        # selectors are compiled once
+        self.assertIs(handler.get_selector(f'cmdline[*{marker}]'), handler.get_selector(f'cmdline[*{marker}]'))
+        self.assertIsNone(handler.get_selector('top_cpu'))
+
+    def test_ProcessPropertiesCommandHandler(self) -> None:
+        handler = ProcessesCommandHandler()
+        pid = os.getpid()
+
+        props = handler.handle([str(pid), '*'], fake_task_id)
+        assert isinstance(props, dict)
+        self.assertEqual(pid, props['pid'])
+        self.assertEqual(psutil.Process().name(), props['name'])
+        self.assertNotIn('memory_info/rss', props)
+
+        props = handler.handle([str(pid), '**'], fake_task_id)
+        assert isinstance(props, dict)
+        self.assertEqual(pid, props['pid'])
+        self.assertIn('memory_info/rss', props)
+        self.assertEqual(sys.executable, props['cmdline/0'])
+
+        props = json.loads(handler.handle([str(pid), '**;'], fake_task_id))
+        self.assertIn('rss', props['memory_info'])
+
+        # a dump of all processes reuses the properties read by the walk of the process table
+        params = ['*', '*;']
+        self.assertEqual(psutil_scalar_attrs, handler.get_required_attrs(*params))
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+        SnapshotCache.begin_pass()
+        try:
+            handler.get_snapshot(handler.get_required_attrs(*params))
+            with mock.patch.object(psutil.Process, 'as_dict', side_effect=AssertionError("unexpected as_dict() call")):
+                dumps = handler.handle(params, fake_task_id)
+        finally:
+            SnapshotCache.end_pass()
+        assert isinstance(dumps, dict)
+        self.assertEqual(pid, json.loads(dumps[pid])['pid'])
+
+    def test_ProcessColumns(self) -> None:
+        io = collections.namedtuple('io', ['read_bytes', 'write_bytes'])
+        columns = ProcessColumns()
+        slots = [columns.allocate(pid, 100.0 + pid, 1) for pid in (1, 2, 3, 4)]
+        columns.store(slots[0], {'pid': 1, 'name': 'a', 'num_threads': 4, 'io_counters': ACCESS_DENIED})
+        columns.store(slots[1], {'pid': 2, 'name': 'b', 'num_threads': ACCESS_DENIED, 'io_counters': io(10, 5)})
+        columns.store(slots[2], {'pid': 3, 'name': 'c', 'num_threads': 9, 'io_counters': io(1, 1)})
+        columns.store(slots[3], {'pid': 4, 'name': 'd', 'num_threads': 1, 'io_counters': ACCESS_DENIED})
+
+        self.assertEqual(4, len(columns))
+        self.assertEqual({'num_threads', 'io_counters_read_bytes', 'io_counters_write_bytes'}, set(columns.columns))
+        self.assertEqual(4, len(columns.columns['io_counters_read_bytes']))
+        # dictionaries are built on request, restoring the types of the values
+        self.assertEqual({'name': 'a', 'num_threads': 4, 'io_counters': ACCESS_DENIED},
+                         columns.get_info(slots[0], ['name', 'num_threads', 'io_counters']))
+        self.assertEqual({'num_threads': ACCESS_DENIED, 'io_counters': io(10, 5)}, columns.get_info(slots[1], ['num_threads', 'io_counters']))
+        self.assertIsInstance(columns.get_info(slots[2], ['num_threads'])['num_threads'], int)
+
+        # rates are computed from the counters stored by the previous reading
+        columns.store_rate('io_counters_rate', 'io_counters', slots[1], io(30, 5), 2.0)
+        self.assertEqual(io(10, 0), columns.get_info(slots[1], ['io_counters_rate'])['io_counters_rate'])
+
+        # the slots of exited processes are reused
+        columns.free(slots[1])
+        self.assertEqual(slots[1], columns.allocate(5, 105.0, 2))
+        self.assertEqual(4, len(columns))
+        self.assertEqual({'name': None}, columns.get_info(slots[1], ['name']))
+
+        # rankings and sums are computed on the columns
+        snapshot = ProcessSnapshot(frozenset({'num_threads', 'io_counters'}), 1, columns, array('q', [1, 3, 4]),
+                                   array('q', [slots[0], slots[2], slots[3]]))
+        self.assertEqual([3, 1], snapshot.get_top('num_threads', 2, ['num_threads']))
+        self.assertEqual([3], snapshot.get_top('io', 5, ['io_counters_read_bytes', 'io_counters_write_bytes']))
+        self.assertEqual(14, snapshot.sum_values(['num_threads'], [1, 3, 4, 5]))
+        self.assertEqual([], snapshot.get_top('rss', 1, ['memory_info_rss']))
+
+        # same ranking computed on the properties of each process
+        snapshot = ProcessRegistry().take_snapshot(frozenset({'num_threads', 'memory_info'}))
+        by_rss = heapq.nlargest(3, snapshot.pids, key=lambda pid: snapshot.get_info(pid)['memory_info'].rss)
+        self.assertEqual(by_rss, snapshot.get_top('rss', 3, ['memory_info_rss']))
+
+    def test_ProcessGroupsCommandHandler(self) -> None:
+        registry = ProcessRegistry()
+        processes_handler = ProcessesCommandHandler(registry)
+        handler = ProcessGroupsCommandHandler(registry)
+        marker = f"psmqtt-groups-test-{os.getpid()}"
+        children = [subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)", marker]) for _ in range(2)]
+        try:
+            params_list = [[f'cmdline[*{marker}]', 'count'], [f'cmdline[*{marker}]', 'threads'], [f'subtree[{os.getpid()}]', 'rss'],
+                           ['user[*]*', 'count'], [f'subtree[{os.getpid()}]', 'count']]
+            handler.prefetch(params_list)
+            processes_handler.prefetch([['top_cpu', 'pid']])
+            self.assertEqual(frozenset({'cmdline', 'num_threads', 'ppid', 'memory_info', 'username', 'cpu_percent'}), registry.get_prefetch_attrs())
+
+            SnapshotCache.clear()
+            SnapshotCache.set_max_age(0)
+            num_misses = SnapshotCache.num_misses
+            SnapshotCache.begin_pass()
+            try:
+                results = [handler.handle(params, str(i)) for i, params in enumerate(params_list)]
+                processes_handler.handle(['top_cpu', 'pid'], fake_task_id)
+                snapshot = processes_handler.get_snapshot(frozenset())
+            finally:
+                SnapshotCache.end_pass()
+            # "processes" and "process_groups" tasks share a single walk of the process table
+            self.assertEqual(num_misses + 1, SnapshotCache.num_misses)
+
+            self.assertEqual(2, results[0])
+            self.assertEqual(sum(snapshot.get_info(p.pid)['num_threads'] for p in children), results[1])
+            subtree = [os.getpid()] + [p.pid for p in children]
+            self.assertGreaterEqual(results[2], sum(snapshot.get_info(pid)['memory_info'].rss for pid in subtree))
+            self.assertIsInstance(results[3], dict)
+            self.assertEqual(len(snapshot), sum(results[3].values()))
+            self.assertGreaterEqual(results[4], 3)
+
+            with self.assertRaises(Exception):
+                handler.handle(['foo', 'count'], fake_task_id)
+            with self.assertRaises(Exception):
+                handler.handle(['name[*]', 'foo'], fake_task_id)
+        finally:
+            for child in children:
+                child.kill()
+                child.wait()
+
+    def test_read_cgroup(self) -> None:
+        with tempfile.TemporaryDirectory() as procfs_root:
+            os.makedirs(os.path.join(procfs_root, "1"))
+            os.makedirs(os.path.join(procfs_root, "2"))
+            with open(os.path.join(procfs_root, "1", "cgroup"), "w") as f:
+                f.write("0::/system.slice/postgresql.service\n")
+            with open(os.path.join(procfs_root, "2", "cgroup"), "w") as f:
+                f.write("12:cpu,cpuacct:/\n1:name=systemd:/system.slice/nginx.service\n")
+            self.assertEqual("/system.slice/postgresql.service", read_cgroup(1, procfs_root))
+            self.assertEqual("/system.slice/nginx.service", read_cgroup(2, procfs_root))
+            self.assertIsNone(read_cgroup(3, procfs_root))
+
+    def test_ProcessEventsCommandHandler(self) -> None:
+        handler = ProcessEventsCommandHandler(ProcessRegistry())
+        handler.configure({"process_events": {"proc_connector": False}})
+        handler.prefetch([['+']])
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+
+        # the first run only records the running processes
+        with self.assertRaises(PendingValueError):
+            handler.handle(['+'], fake_task_id)
+
+        marker = f"psmqtt-events-test-{os.getpid()}"
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)", marker])
+        try:
+            events = json.loads(handler.handle(['+'], fake_task_id))
+            self.assertIn(child.pid, [e["pid"] for e in events if e["event"] == "start" and marker in e["cmdline"]])
+        finally:
+            child.kill()
+            child.wait()
+
+        events = json.loads(handler.handle(['+'], fake_task_id))
+        exits = [e for e in events if e["event"] == "exit" and e["pid"] == child.pid]
+        self.assertEqual(1, len(exits))
+        self.assertIn(marker, exits[0]["cmdline"])
+        self.assertIsNotNone(exits[0]["create_time"])
+
+        with self.assertRaises(Exception):
+            handler.handle(['foo'], fake_task_id)
+
+    def test_ProcessEventsCommandHandlerProcConnector(self) -> None:
+        handler = ProcessEventsCommandHandler(ProcessRegistry())
+        # replace the subscription to the kernel proc connector
+        handler.connector = ProcConnector(handler.on_proc_events)
+
+        with self.assertRaises(PendingValueError):
+            handler.handle(['start'], "0.0")
+        with self.assertRaises(PendingValueError):
+            handler.handle(['exit'], "0.1")
+
+        handler.on_proc_events([ProcEvent("fork", os.getpid(), parent_pid=1), ProcEvent("exec", os.getpid())])
+        self.assertEqual(["0.0", "0.1"], sorted(handler.pop_refreshed_callers()))
+        self.assertEqual([], handler.pop_refreshed_callers())
+        events = json.loads(handler.handle(['start'], "0.0"))
+        self.assertEqual(1, len(events))
+        self.assertEqual(os.getpid(), events[0]["pid"])
+        self.assertEqual(psutil.Process().name(), events[0]["name"])
+
+        handler.on_proc_events([ProcEvent("exit", os.getpid(), exit_code=1, signal=0)])
+        events = json.loads(handler.handle(['exit'], "0.1"))
+        self.assertEqual(1, len(events))
+        self.assertEqual(1, events[0]["exit_code"])
+        self.assertEqual(psutil.Process().name(), events[0]["name"])
+
+        # events are published only once to each task
+        with self.assertRaises(PendingValueError):
+            handler.handle(['start'], "0.0")
+
+        # processes forked without executing a new program have both a start and an exit event
+        handler.on_proc_events([ProcEvent("fork", os.getpid(), parent_pid=1)])
+        handler.on_proc_events([ProcEvent("exit", os.getpid(), exit_code=0, signal=0)])
+        events = json.loads(handler.handle(['+'], "0.0"))
+        self.assertEqual(["start", "exit"], [e["event"] for e in events])
+        # a process started before the subscription has no start event, even when it executes a new program
+        handler.on_proc_events([ProcEvent("exec", os.getpid())])
+        handler.on_proc_events([ProcEvent("exit", os.getpid(), exit_code=0, signal=0)])
+        events = json.loads(handler.handle(['+'], "0.0"))
+        self.assertEqual(["exit"], [e["event"] for e in events])
+
+        # the subscription is cancelled when PSMQTT exits
+        connector = handler.connector
+        with mock.patch.object(connector, 'stop') as stop:
+            handler.shutdown()
+        stop.assert_called_once_with()
+        self.assertIsNone(handler.connector)
+
+    def test_compute_rate(self) -> None:
+        io = collections.namedtuple('io', ['read_bytes', 'write_bytes'])
+        cpu = collections.namedtuple('cpu', ['user', 'system'])
+        self.assertEqual(io(0, 0), compute_rate(io(100, 200), None, None))
+        self.assertEqual(io(0, 0), compute_rate(io(100, 200), io(0, 0), 0.01))
+        self.assertEqual(io(50, 0), compute_rate(io(200, 200), io(100, 200), 2))
+        self.assertEqual(cpu(0.25, 0.0), compute_rate(cpu(10.5, 2.0), cpu(10.0, 2.0), 2))
+        self.assertIs(ACCESS_DENIED, compute_rate(ACCESS_DENIED, io(0, 0), 1))
+
+    def test_ProcessesCommandHandlerRates(self) -> None:
+        registry = ProcessRegistry()
+        handler = ProcessesCommandHandler(registry)
+        pid = os.getpid()
+        self.assertEqual(frozenset({'cpu_times_rate'}), handler.get_required_attrs(str(pid), 'cpu_times_rate'))
+        self.assertEqual(frozenset({'io_counters_rate'}), handler.get_required_attrs('top_io_rate', 'pid'))
+
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+        # the first reading of each process produces zero rates
+        self.assertEqual(0, handler.handle([str(pid), 'cpu_times_rate', 'user'], fake_task_id))
+        busy_until = time.time() + 0.3
+        while time.time() < busy_until:
+            pass
+        self.assertGreater(handler.handle([str(pid), 'cpu_times_rate', 'user'], fake_task_id), 0)
+        rates = handler.handle([str(pid), 'num_ctx_switches_rate', '*'], fake_task_id)
+        assert isinstance(rates, dict)
+        self.assertEqual({'voluntary', 'involuntary'}, set(rates))
+
+        # the rates of a PID reused by a new process start again from zero
+        handler.handle([str(pid), 'cpu_times_rate', 'user'], fake_task_id)
+        registry.store.create_times[registry.slots_by_pid[pid]] = 0.0
+        self.assertEqual(0, handler.handle([str(pid), 'cpu_times_rate', 'user'], fake_task_id))
+
+        self.assertIsInstance(handler.handle(['top_io_rate', 'pid'], fake_task_id), int)
+        self.assertIsInstance(handler.handle(['top_io_counters_rate_read_bytes', 'pid'], fake_task_id), int)
+
+    @pytest.mark.skipif(not ProcfsReader.is_supported(), reason="requires the Linux /proc filesystem")
+    def test_ProcessesCommandHandlerProcfsBackend(self) -> None:
+        registry = ProcessRegistry()
+        handler = ProcessesCommandHandler(registry)
+        handler.configure({"processes": {"backend": "procfs"}})
+        self.assertIsNotNone(registry.procfs_reader)
+        pid = os.getpid()
+        me = psutil.Process()
+
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+
+        def read(property: str) -> Any:
+            # read by a walk of the process table
+            return handler.handle([f'name[{me.name()}]*', property], fake_task_id)[pid]
+
+        # properties read from /proc and through psutil
+        self.assertEqual(me.name(), read('name'))
+        self.assertEqual(me.ppid(), read('ppid'))
+        self.assertEqual(me.create_time(), read('create_time'))
+        self.assertEqual(me.exe(), read('exe'))
+        self.assertEqual(me.num_threads(), read('num_threads'))
+        num_created = registry.num_created
+
+        # CPU usage since the previous walk, as psutil.Process.cpu_percent()
+        self.assertEqual(0.0, read('cpu_percent'))
+        busy_until = time.time() + 0.3
+        while time.time() < busy_until:
+            pass
+        self.assertGreater(read('cpu_percent'), 10)
+        # the same instances are reused across walks
+        self.assertEqual(num_created, registry.num_created)
+
+        handler.configure({"processes": {"backend": "psutil"}})
+        self.assertIsNone(registry.procfs_reader)
@@ -1,24 +1,150 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+import concurrent.futures
+import logging
+import threading
+import time
 from pySMART import Device as SmartDevice
 from typing import (
+    Any,
+    Dict,
     List,
+    NamedTuple,
+    Optional,
+    Set,
 )
 
-from .handlers_base import BaseHandler, Payload
+from .handlers_base import BaseHandler, Payload, PendingValueError
+from .nvme_ioctl import (
+    get_nvme_controller_name,
+    get_nvme_value,
+    parse_nvme_health_log,
+    parse_nvme_identify_controller,
+    read_nvme_health_log,
+    read_nvme_identify_controller,
+    read_sysfs_nvme_value,
+)
+from .smartctl_json import (
+    DeviceStandbyError,
+    get_smartctl_json_value,
+    is_device_in_standby,
+)
+from .snapshot_cache import SnapshotCache
 from .utils import string_from_dict_optionally
 from .handlers_base import TaskParam
 
+class SmartCacheEntry(NamedTuple):
+    '''
+    The SMART data of a device, as last read from the device
+    '''
+    # Unix timestamp of the last interrogation of the device (including checks that found the device in standby)
+    checked_at: float
+    # Unix timestamp of the last successful read of SMART data; None if SMART data was never read
+    read_at: Optional[float]
+    info: Dict[str, Any]
+
 class SmartCommandHandler(BaseHandler):
     '''
-    Provides readings of S.M.A.R.T. counters via pySMART library
+    Provides readings of S.M.A.R.T. counters via pySMART library or,
+    if the "smartctl_json" backend is configured, via the JSON output of smartctl
     '''
 
+    BACKEND_PYSMART = "pysmart"
+    BACKEND_SMARTCTL_JSON = "smartctl_json"
+
+    # every reading forks the smartctl utility, which might take several seconds
+    is_blocking = True
+
     def __init__(self) -> None:
         super().__init__('smart')
+
+        # SMART data changes slowly: all tasks reading the same device within "cache_ttl_sec" seconds
+        # share a single interrogation of the device
+        self.cache_ttl_sec = 10.0
+        self.cache: Dict[str, SmartCacheEntry] = {}
+        # one lock per device, so that concurrent tasks for the same device do not interrogate it twice
+        self.device_locks: Dict[str, threading.Lock] = {}
+        self.device_locks_lock = threading.Lock()
+
+        # devices are read concurrently by a pool of threads, see prefetch()
+        self.collector: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+        self.backend = SmartCommandHandler.BACKEND_PYSMART
+
+        # when "standby_check" is enabled, devices in STANDBY or SLEEP mode are never spun up:
+        # their last SMART data is served instead, flagged with "standby"=True
+        self.standby_check = False
+
+        # when "stagger_polling" is enabled, the reads of the devices are spread across the interval between
+        # two executions of the smart tasks; tasks publish the last SMART data read and are published again
+        # as soon as the SMART data of their device has been refreshed
+        self.stagger_polling = False
+        # device -> Unix timestamp of the last prefetch() requesting that device
+        self.last_prefetch_time: Dict[str, float] = {}
+        # device -> IDs of the tasks reading that device
+        self.device_callers: Dict[str, Set[str]] = {}
+        self.refreshed_callers: List[str] = []
+
+        # when "native_nvme" is enabled, NVMe devices are read in-process through the NVMe admin ioctl
+        self.native_nvme = False
+        # device -> decoded Identify Controller data, which never changes
+        self.nvme_identify: Dict[str, Dict[str, Any]] = {}
+
+        # statistics
+        self.num_device_reads = 0
+        self.num_standby_skips = 0
+        return
+
+    def configure(self, options: Dict[str, Any]) -> None:
+        self.cache_ttl_sec = options["smart"]["cache_ttl_sec"]
+        self.backend = options["smart"]["backend"]
+        self.standby_check = options["smart"]["standby_check"]
+        self.stagger_polling = options["smart"]["stagger_polling"]
+        self.native_nvme = options["smart"]["native_nvme"]
+        max_parallel_devices = options["smart"]["max_parallel_devices"]
+        if max_parallel_devices > 0:
+            self.collector = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel_devices, thread_name_prefix="psmqtt-smart")
         return
 
+    def prefetch(self, params_list: List[List[str]]) -> None:
+        '''
+        Starts reading concurrently all devices needed by the provided tasks: the total time needed to read
+        all devices is then set by the slowest device, not by the sum of all devices.
+        smart tasks will find the data in the cache or will wait for the read of their device to complete.
+
+        When "stagger_polling" is enabled, the reads are instead spread evenly across the interval
+        elapsed since the previous prefetch of the same devices, to avoid I/O bursts on all disks at once.
+        '''
+        if self.collector is None:
+            return
+        devices = sorted({params[0] for params in params_list if len(params) > 0})
+        now = time.time()
+        for i, dev in enumerate(devices):
+            read_time = now
+            if self.stagger_polling:
+                last_prefetch_time = self.last_prefetch_time.get(dev, None)
+                if last_prefetch_time is not None:
+                    read_time += i * (now - last_prefetch_time) / len(devices)
+                self.last_prefetch_time[dev] = now
+            self.collector.submit(self._prefetch_device, dev, read_time)
+        return
+
+    def _prefetch_device(self, dev: str, read_time: float) -> None:
+        delay_sec = read_time - time.time()
+        if delay_sec > 0:
+            time.sleep(delay_sec)
+        try:
+            old_entry = self.cache.get(dev, None)
+            self.get_cached_value(dev)
+        except Exception as ex:
+            # the error will be reported by the task itself
+            logging.debug(f"SmartCommandHandler: failed to prefetch SMART data of {dev}: {ex}")
+            return
+        if self.stagger_polling and self.cache.get(dev, None) is not old_entry:
+            with self.device_locks_lock:
+                self.refreshed_callers += sorted(self.device_callers.get(dev, set()))
+
     def handle(self, params: List[str], caller_task_id: str) -> Payload:
         '''
         Takes 2 parameters:
@@ -35,7 +161,14 @@ class SmartCommandHandler(BaseHandler):
         #if TaskParam.is_wildcard(dev) and TaskParam.is_wildcard(param):
         #    raise Exception(f"{self.name}: Cannot list all SMART fields from all disks into the same task")
 
-        info = self.get_value(device)
+        if self.stagger_polling:
+            with self.device_locks_lock:
+                self.device_callers.setdefault(device, set()).add(caller_task_id)
+            # the device is refreshed by prefetch(): just serve its last SMART data, if any
+            entry = self.cache.get(device, None)
+            info = entry.info if entry is not None else self.get_cached_value(device)
+        else:
+            info = self.get_cached_value(device)
         #logging.debug(f"{info}")
 
         if field == '':
@@ -49,45 +182,138 @@ class SmartCommandHandler(BaseHandler):
         val = info.get(field, None)
         if val is not None:
             return val
+        if info.get("standby", False):
+            raise PendingValueError(f"{self.name}: Device '{device}' is in standby mode and its SMART data has not been read yet")
         raise Exception(f"{self.name}: Parameter '{field}' is not supported for device '{device}'")
 
+    def get_value_age(self, params: list[str]) -> Optional[float]:
+        # SMART data might be older than "cache_ttl_sec" only when standby devices are not read or reads are staggered
+        if not self.standby_check and not self.stagger_polling:
+            return None
+        entry = self.cache.get(params[0], None) if len(params) > 0 else None
+        if entry is None or entry.read_at is None:
+            return None
+        return time.time() - entry.read_at
+
+    def pop_refreshed_callers(self) -> List[str]:
+        with self.device_locks_lock:
+            ret = self.refreshed_callers
+            self.refreshed_callers = []
+        return ret
+
+    def get_cached_value(self, dev: str) -> Dict[str, Any]:
+        '''
+        Returns the SMART data of the provided device, reading it from the device only if
+        the cached data is older than "cache_ttl_sec" seconds
+        '''
+        request_time = time.time()
+        with self.device_locks_lock:
+            lock = self.device_locks.setdefault(dev, threading.Lock())
+
+        with lock:
+            # while waiting for the lock, another thread might have just read the same device:
+            entry = self.cache.get(dev, None)
+            if entry is not None and entry.checked_at >= request_time - self.cache_ttl_sec:
+                return entry.info
+
+            start_time = time.time()
+            try:
+                info = self.get_value(dev)
+            except DeviceStandbyError:
+                # do not wake up the device: serve the last SMART data read, if any
+                self.num_standby_skips += 1
+                logging.debug(f"SmartCommandHandler: {dev} is in standby mode, SMART data not read")
+                last_info = entry.info if entry is not None else {}
+                self.cache[dev] = SmartCacheEntry(time.time(), entry.read_at if entry is not None else None, {**last_info, "standby": True})
+                return self.cache[dev].info
+
+            self.num_device_reads += 1
+            if self.standby_check:
+                info = {**info, "standby": False}
+            now = time.time()
+            self.cache[dev] = SmartCacheEntry(now, now, info)
+            logging.debug(f"SmartCommandHandler: read SMART data of {dev} in {now - start_time:.2f}sec")
+            return info
+
     def get_value(self, dev: str) -> Payload:
         '''
-        Uses methods of pySMART to acquire SMART counters
+        Acquires SMART counters using the configured backend.
+        Raises DeviceStandbyError if "standby_check" is enabled and the device is in STANDBY or SLEEP mode.
         '''
+        if self.native_nvme and get_nvme_controller_name(dev) is not None:
+            # NVMe devices have no standby mode that SMART reads could wake up
+            return self.get_native_nvme_value(dev)
+
+        if self.backend == SmartCommandHandler.BACKEND_SMARTCTL_JSON:
+            try:
+                # the power mode is checked by the same smartctl invocation reading SMART data
+                return get_smartctl_json_value(dev, skip_standby=self.standby_check)
+            except DeviceStandbyError:
+                raise
+            except Exception as ex:
+                raise Exception(f"{self.name}: {ex}")
+
+        # the power mode is checked once per sampling pass, even when several tasks read the device
+        if self.standby_check and SnapshotCache.call(is_device_in_standby, dev):
+            raise DeviceStandbyError(f"{self.name}: Device '{dev}' is in low-power mode")
         smart_data = SmartDevice(dev)
         if smart_data.serial is None:
             raise Exception(f"{self.name}: Failed to read SMART data for device '{dev}': probably root permissions are required")
+        return get_pysmart_value(smart_data)
+
+    def get_native_nvme_value(self, dev: str) -> Dict[str, Any]:
+        '''
+        Reads the SMART/health log of an NVMe device without forking smartctl.
+        NVMe admin commands require root permissions: when they fail, only the identity and the temperature
+        of the device, as reported by sysfs, are returned.
+        '''
+        try:
+            if dev not in self.nvme_identify:
+                self.nvme_identify[dev] = parse_nvme_identify_controller(read_nvme_identify_controller(dev))
+            health_log = parse_nvme_health_log(read_nvme_health_log(dev))
+            return get_nvme_value(dev, self.nvme_identify[dev], health_log)
+        except (OSError, ValueError, ImportError) as ex:
+            logging.debug(f"SmartCommandHandler: cannot read the NVMe SMART/health log of {dev}, falling back to sysfs: {ex}")
 
-        # __getstate__() is a non-documented magic function returning some _selected_
-        # fields of the SmartDevice class into a dictionary, which is easier to index in psmqtt
-        info = smart_data.__getstate__()
-
-        # explode the "attributes" entry to dictionary keys in the form
-        #  attribute_raw[ATTRIBUTE_NAME]=RAW_VALUE
-        for a in info["attributes"]:
-            if a is not None:
-                assert isinstance(a, dict)
-                assert "name" in a
-                assert "raw" in a
-                info[f"attribute_raw[{a['name']}]"] = a["raw"]
-
-        # explode the "tests" entry to dictionary keys in the form
-        #  tests[TEST_NUM]=JSON
-        # sort the tests in such a way that test[0] is always the most recent one (having the highest "hours" value)
         try:
-            sorted_test_list = sorted(smart_data.tests, key=lambda x: int(x.hours), reverse=True)
-        except ValueError:
-            # failed casting to int... use the pySMART sorting
-            sorted_test_list = smart_data.tests
-        idx = 0
-        for t in sorted_test_list:
-            info[f"test[{idx}]"] = dict(t.__getstate__())
-            idx += 1
-
-        # delete fields that are useless after the flattening of SMART attributes and SMART tests just done:
-        del info["attributes"]
-        del info["if_attributes"]
-        del info["tests"]
-
-        return info
+            return read_sysfs_nvme_value(dev)
+        except Exception as ex:
+            raise Exception(f"{self.name}: Failed to read SMART data for device '{dev}': {ex}")
+
+
+def get_pysmart_value(smart_data: SmartDevice) -> Dict[str, Any]:
+    '''
+    Flattens the SMART counters read by pySMART into the dictionary published by "smart" tasks
+    '''
+    # __getstate__() is a non-documented magic function returning some _selected_
+    # fields of the SmartDevice class into a dictionary, which is easier to index in psmqtt
+    info = smart_data.__getstate__()
+
+    # explode the "attributes" entry to dictionary keys in the form
+    #  attribute_raw[ATTRIBUTE_NAME]=RAW_VALUE
+    for a in info["attributes"]:
+        if a is not None:
+            assert isinstance(a, dict)
+            assert "name" in a
+            assert "raw" in a
+            info[f"attribute_raw[{a['name']}]"] = a["raw"]
+
+    # explode the "tests" entry to dictionary keys in the form
+    #  tests[TEST_NUM]=JSON
+    # sort the tests in such a way that test[0] is always the most recent one (having the highest "hours" value)
+    try:
+        sorted_test_list = sorted(smart_data.tests, key=lambda x: int(x.hours), reverse=True)
+    except ValueError:
+        # failed casting to int... use the pySMART sorting
+        sorted_test_list = smart_data.tests
+    idx = 0
+    for t in sorted_test_list:
+        info[f"test[{idx}]"] = dict(t.__getstate__())
+        idx += 1
+
+    # delete fields that are useless after the flattening of SMART attributes and SMART tests just done:
+    del info["attributes"]
+    del info["if_attributes"]
+    del info["tests"]
+
+    return info
@@ -1,15 +1,30 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+import threading
+import time
 import unittest
+from unittest import mock
 import pytest
+from typing import (
+    Any,
+    Dict,
+)
 
+from .handlers_base import PendingValueError
 from .handlers_pysmart import (
     SmartCommandHandler,
 )
+from .smartctl_json import DeviceStandbyError
+from .snapshot_cache import SnapshotCache
 
 fake_task_id = "0.0"
 
+def make_options(**kwargs: Any) -> Dict[str, Any]:
+    smart = {"cache_ttl_sec": 10, "max_parallel_devices": 4, "backend": "pysmart", "standby_check": False, "stagger_polling": False, "native_nvme": False}
+    smart.update(kwargs)
+    return {"smart": smart}
+
 @pytest.mark.unit
 class TestHandlers(unittest.TestCase):
 
@@ -29,3 +44,134 @@ class TestHandlers(unittest.TestCase):
             pass
 
         return
+
+    def _make_mocked_handler(self, read_time_sec: float) -> SmartCommandHandler:
+        def get_value(s, dev):
+            time.sleep(read_time_sec)
+            return {"temperature": 35, "assessment": "PASS", "attribute_raw[Reallocated_Sector_Ct]": "0", "name": dev}
+        return type("TestHandler", (SmartCommandHandler, object), {"get_value": get_value})()
+
+    def test_SmartCommandHandlerCache(self) -> None:
+        handler = self._make_mocked_handler(0)
+        handler.configure(make_options(cache_ttl_sec=60, max_parallel_devices=0))
+
+        # all fields of the same device are read from a single interrogation
+        self.assertEqual(35, handler.handle(['/dev/sda', 'temperature'], fake_task_id))
+        self.assertEqual("PASS", handler.handle(['/dev/sda', 'assessment'], fake_task_id))
+        self.assertEqual("0", handler.handle(['/dev/sda', 'attribute_raw[Reallocated_Sector_Ct]'], fake_task_id))
+        self.assertEqual(1, handler.num_device_reads)
+        self.assertEqual("/dev/sdb", handler.handle(['/dev/sdb', 'name'], fake_task_id))
+        self.assertEqual(2, handler.num_device_reads)
+
+        # with no TTL, each task interrogates the device
+        handler.configure(make_options(cache_ttl_sec=0, max_parallel_devices=0))
+        handler.handle(['/dev/sda', 'temperature'], fake_task_id)
+        handler.handle(['/dev/sda', 'assessment'], fake_task_id)
+        self.assertEqual(4, handler.num_device_reads)
+
+    def test_SmartCommandHandlerConcurrentReads(self) -> None:
+        handler = self._make_mocked_handler(0.2)
+        handler.configure(make_options(cache_ttl_sec=0, max_parallel_devices=0))
+
+        # concurrent tasks for the same device share the same interrogation, even without TTL
+        threads = [threading.Thread(target=handler.handle, args=(['/dev/sda', 'temperature'], fake_task_id)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, handler.num_device_reads)
+
+    def test_SmartCommandHandlerPrefetch(self) -> None:
+        handler = self._make_mocked_handler(0.3)
+        handler.configure(make_options(cache_ttl_sec=60, max_parallel_devices=4))
+        devices = ['/dev/sda', '/dev/sdb', '/dev/sdc', '/dev/sdd']
+
+        start = time.time()
+        handler.prefetch([[d, 'temperature'] for d in devices] + [['/dev/sda', 'assessment']])
+        # prefetching must not block
+        self.assertLess(time.time() - start, 0.1)
+
+        for d in devices:
+            self.assertEqual(d, handler.handle([d, 'name'], fake_task_id))
+        # all devices were read concurrently, once
+        self.assertLess(time.time() - start, 0.9)
+        self.assertEqual(4, handler.num_device_reads)
+
+    def _make_standby_handler(self, sleeping_devices: set) -> SmartCommandHandler:
+        def get_value(s, dev):
+            if dev in sleeping_devices:
+                raise DeviceStandbyError(f"{dev} is sleeping")
+            return {"temperature": 35, "name": dev}
+        return type("TestHandler", (SmartCommandHandler, object), {"get_value": get_value})()
+
+    def test_SmartCommandHandlerStandby(self) -> None:
+        sleeping_devices: set = set()
+        handler = self._make_standby_handler(sleeping_devices)
+        handler.configure(make_options(cache_ttl_sec=0, max_parallel_devices=0, standby_check=True))
+
+        # a device sleeping since startup: only the "standby" field is available
+        sleeping_devices.add('/dev/sdb')
+        self.assertEqual(True, handler.handle(['/dev/sdb', 'standby'], fake_task_id))
+        with self.assertRaises(PendingValueError):
+            handler.handle(['/dev/sdb', 'temperature'], fake_task_id)
+        self.assertIsNone(handler.get_value_age(['/dev/sdb', 'temperature']))
+
+        # an awake device is read
+        self.assertEqual(False, handler.handle(['/dev/sda', 'standby'], fake_task_id))
+        self.assertEqual(1, handler.num_device_reads)
+
+        # once it goes to sleep, its last SMART data is published again
+        sleeping_devices.add('/dev/sda')
+        time.sleep(0.1)
+        self.assertEqual({"temperature": 35, "name": "/dev/sda", "standby": True}, handler.handle(['/dev/sda', '*'], fake_task_id))
+        self.assertEqual(1, handler.num_device_reads)
+        self.assertEqual(3, handler.num_standby_skips)
+        age = handler.get_value_age(['/dev/sda', 'temperature'])
+        assert age is not None
+        self.assertGreaterEqual(age, 0.1)
+
+        # and it is read again when it wakes up
+        sleeping_devices.clear()
+        self.assertEqual(False, handler.handle(['/dev/sda', 'standby'], fake_task_id))
+        self.assertEqual(2, handler.num_device_reads)
+
+    def test_SmartCommandHandlerStandbyCheckPerPass(self) -> None:
+        handler = SmartCommandHandler()
+        handler.configure(make_options(cache_ttl_sec=0, max_parallel_devices=0, standby_check=True))
+        SnapshotCache.clear()
+        SnapshotCache.begin_pass()
+        try:
+            with mock.patch("psmqtt.handlers_pysmart.is_device_in_standby", return_value=True) as is_device_in_standby:
+                self.assertEqual(True, handler.handle(['/dev/sda', 'standby'], fake_task_id))
+                self.assertEqual(True, handler.handle(['/dev/sda', 'standby'], "0.1"))
+        finally:
+            SnapshotCache.end_pass()
+        # the power mode of the device was checked once for all tasks of the sampling pass
+        self.assertEqual(1, is_device_in_standby.call_count)
+        self.assertEqual(2, handler.num_standby_skips)
+
+    def test_SmartCommandHandlerStaggeredPolling(self) -> None:
+        handler = self._make_mocked_handler(0)
+        handler.configure(make_options(cache_ttl_sec=0, max_parallel_devices=4, stagger_polling=True))
+        devices = ['/dev/sda', '/dev/sdb', '/dev/sdc', '/dev/sdd']
+        params_list = [[d, 'name'] for d in devices]
+
+        # first run: all devices are read immediately
+        handler.prefetch(params_list)
+        for i, d in enumerate(devices):
+            self.assertEqual(d, handler.handle([d, 'name'], str(i)))
+        self.assertEqual(4, handler.num_device_reads)
+        time.sleep(0.1)
+        handler.pop_refreshed_callers()
+
+        # next runs: reads are spread across the interval between the 2 runs
+        time.sleep(0.3)
+        handler.prefetch(params_list)
+        for i, d in enumerate(devices):
+            # the last SMART data read is served without waiting
+            self.assertEqual(d, handler.handle([d, 'name'], str(i)))
+        time.sleep(0.05)
+        self.assertEqual(['0'], handler.pop_refreshed_callers())
+        time.sleep(0.4)
+        self.assertEqual(['1', '2', '3'], handler.pop_refreshed_callers())
+        self.assertEqual(8, handler.num_device_reads)
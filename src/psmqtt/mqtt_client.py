@@ -4,7 +4,7 @@
 import logging
 import paho.mqtt.client as paho  # pip install paho-mqtt
 import time
-from typing import Any, Optional
+from typing import Any, Iterable, Optional, Tuple
 
 
 class MqttClient:
@@ -98,7 +98,6 @@ class MqttClient:
             return True
         return False
 
-    # FIXME: change this signature to allow batch-sending multiple messages
     def publish(self, topic:str, payload:str) -> None:
         '''
         Publish a message to the MQTT broker
@@ -108,6 +107,26 @@ class MqttClient:
         self._mqttc.publish(topic, payload, qos=self.qos, retain=self.retain)
         return
 
+    def publish_many(self, messages:Iterable[Tuple[str, str]]) -> int:
+        '''
+        Publish several (topic, payload) messages to the MQTT broker, in order.
+        Compared to invoking publish() for each message, bookkeeping is done once per batch and all messages
+        are queued back-to-back, so that the paho network thread sends them in a single wakeup.
+        Returns the number of messages published.
+        '''
+        publish = self._mqttc.publish
+        qos = self.qos
+        retain = self.retain
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        num_messages = 0
+        for topic, payload in messages:
+            if debug:
+                logging.debug("MqttClient.publish_many('%s', '%s')", topic, payload)
+            publish(topic, payload, qos=qos, retain=retain)
+            num_messages += 1
+        MqttClient.num_published_total += num_messages
+        return num_messages
+
     def loop_start(self) -> None:
         '''
         See https://www.eclipse.org/paho/clients/python/docs/#network-loop
@@ -0,0 +1,232 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import ctypes
+import glob
+import os
+import re
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
+
+from .smartctl_json import (
+    format_capacity,
+    get_nvme_health_attributes,
+)
+
+# see <linux/nvme_ioctl.h>: _IOWR('N', 0x41, struct nvme_admin_cmd)
+NVME_IOCTL_ADMIN_CMD = 0xC0484E41
+
+NVME_ADMIN_GET_LOG_PAGE = 0x02
+NVME_ADMIN_IDENTIFY = 0x06
+NVME_LOG_SMART_HEALTH = 0x02
+NVME_IDENTIFY_CNS_CONTROLLER = 0x01
+NVME_NSID_ALL = 0xFFFFFFFF
+
+NVME_HEALTH_LOG_SIZE = 512
+NVME_IDENTIFY_SIZE = 4096
+
+# bit of the "Optional Admin Command Support" field of the Identify Controller data structure
+NVME_OACS_SELF_TEST = 0x10
+
+KELVIN_TO_CELSIUS = 273
+
+
+class NvmeAdminCmd(ctypes.Structure):
+    '''
+    struct nvme_admin_cmd from <linux/nvme_ioctl.h>
+    '''
+    _fields_ = [
+        ("opcode", ctypes.c_uint8),
+        ("flags", ctypes.c_uint8),
+        ("rsvd1", ctypes.c_uint16),
+        ("nsid", ctypes.c_uint32),
+        ("cdw2", ctypes.c_uint32),
+        ("cdw3", ctypes.c_uint32),
+        ("metadata", ctypes.c_uint64),
+        ("addr", ctypes.c_uint64),
+        ("metadata_len", ctypes.c_uint32),
+        ("data_len", ctypes.c_uint32),
+        ("cdw10", ctypes.c_uint32),
+        ("cdw11", ctypes.c_uint32),
+        ("cdw12", ctypes.c_uint32),
+        ("cdw13", ctypes.c_uint32),
+        ("cdw14", ctypes.c_uint32),
+        ("cdw15", ctypes.c_uint32),
+        ("timeout_ms", ctypes.c_uint32),
+        ("result", ctypes.c_uint32),
+    ]
+
+
+def get_nvme_controller_name(dev: str) -> Optional[str]:
+    '''
+    Returns the name of the NVMe controller of the provided device (e.g. "nvme0" for "/dev/nvme0n1"),
+    or None if the provided device is not an NVMe device
+    '''
+    m = re.match(r'^(?:/dev/)?(nvme\d+)(?:n\d+)?$', dev)
+    return m.group(1) if m is not None else None
+
+
+def _le_int(buf: bytes, offset: int, size: int) -> int:
+    return int.from_bytes(buf[offset:offset + size], "little")
+
+
+def _ascii(buf: bytes, offset: int, size: int) -> str:
+    return buf[offset:offset + size].decode("ascii", errors="replace").strip(" \x00")
+
+
+def parse_nvme_health_log(buf: bytes) -> Dict[str, Any]:
+    '''
+    Decodes the SMART/health information log page (log identifier 0x02) defined by the NVMe specification.
+    Fields are named like in the JSON output of smartctl ("nvme_smart_health_information_log") and
+    temperatures are converted to Celsius degrees.
+    '''
+    if len(buf) < NVME_HEALTH_LOG_SIZE:
+        raise ValueError(f"NVMe SMART/health log too short: {len(buf)} bytes")
+    log = {
+        "critical_warning": buf[0],
+        "temperature": _le_int(buf, 1, 2) - KELVIN_TO_CELSIUS,
+        "available_spare": buf[3],
+        "available_spare_threshold": buf[4],
+        "percentage_used": buf[5],
+        "data_units_read": _le_int(buf, 32, 16),
+        "data_units_written": _le_int(buf, 48, 16),
+        "host_reads": _le_int(buf, 64, 16),
+        "host_writes": _le_int(buf, 80, 16),
+        "controller_busy_time": _le_int(buf, 96, 16),
+        "power_cycles": _le_int(buf, 112, 16),
+        "power_on_hours": _le_int(buf, 128, 16),
+        "unsafe_shutdowns": _le_int(buf, 144, 16),
+        "media_errors": _le_int(buf, 160, 16),
+        "num_err_log_entries": _le_int(buf, 176, 16),
+        "warning_temp_time": _le_int(buf, 192, 4),
+        "critical_comp_time": _le_int(buf, 196, 4),
+    }
+    # up to 8 temperature sensors; zero means "not implemented"
+    sensors = [_le_int(buf, 200 + 2 * i, 2) for i in range(8)]
+    log["temperature_sensors"] = [k - KELVIN_TO_CELSIUS for k in sensors if k != 0]
+    return log
+
+
+def parse_nvme_identify_controller(buf: bytes) -> Dict[str, Any]:
+    '''
+    Decodes the few fields of the Identify Controller data structure (CNS 0x01) which are published by "smart" tasks
+    '''
+    if len(buf) < NVME_IDENTIFY_SIZE:
+        raise ValueError(f"NVMe Identify Controller data too short: {len(buf)} bytes")
+    return {
+        "serial": _ascii(buf, 4, 20),
+        "model": _ascii(buf, 24, 40),
+        "firmware": _ascii(buf, 64, 8),
+        "oacs": _le_int(buf, 256, 2),
+        "total_capacity": _le_int(buf, 280, 16),
+    }
+
+
+def _admin_command(fd: int, opcode: int, nsid: int, cdw10: int, data_len: int) -> bytes:
+    # fcntl is not available on Windows
+    import fcntl
+
+    data = ctypes.create_string_buffer(data_len)
+    cmd = NvmeAdminCmd(opcode=opcode, nsid=nsid, addr=ctypes.addressof(data), data_len=data_len, cdw10=cdw10)
+    ret = fcntl.ioctl(fd, NVME_IOCTL_ADMIN_CMD, cmd, True)
+    if ret != 0:
+        # a positive value is the NVMe status code of the failed command
+        raise OSError(f"NVMe admin command 0x{opcode:02x} failed with status 0x{ret:x}")
+    return data.raw
+
+
+def read_nvme_health_log(dev: str) -> bytes:
+    '''
+    Reads the SMART/health information log page of the provided NVMe device with a single Get Log Page admin command
+    '''
+    # number of dwords to transfer, zero-based, in the lower 16 bits of NUMDL
+    numd = NVME_HEALTH_LOG_SIZE // 4 - 1
+    fd = os.open(dev, os.O_RDONLY)
+    try:
+        return _admin_command(fd, NVME_ADMIN_GET_LOG_PAGE, NVME_NSID_ALL, (numd << 16) | NVME_LOG_SMART_HEALTH, NVME_HEALTH_LOG_SIZE)
+    finally:
+        os.close(fd)
+
+
+def read_nvme_identify_controller(dev: str) -> bytes:
+    '''
+    Reads the Identify Controller data structure of the provided NVMe device
+    '''
+    fd = os.open(dev, os.O_RDONLY)
+    try:
+        return _admin_command(fd, NVME_ADMIN_IDENTIFY, 0, NVME_IDENTIFY_CNS_CONTROLLER, NVME_IDENTIFY_SIZE)
+    finally:
+        os.close(fd)
+
+
+def get_nvme_value(dev: str, identify: Dict[str, Any], health_log: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Builds from the decoded Identify Controller data and SMART/health log the same dictionary produced
+    by SmartCommandHandler for NVMe devices; self-tests are not included
+    '''
+    self_tests = (identify["oacs"] & NVME_OACS_SELF_TEST) != 0
+    info: Dict[str, Any] = {
+        'capacity': format_capacity(identify["total_capacity"]) if identify["total_capacity"] else None,
+        'diagnostics': None,
+        'firmware': identify["firmware"],
+        'interface': 'nvme',
+        'is_ssd': True,
+        'messages': [],
+        'model': identify["model"],
+        'name': dev.replace('/dev/', ''),
+        'path': dev,
+        'rotation_rate': None,
+        'serial': identify["serial"],
+        'smart_capable': True,
+        'smart_enabled': True,
+        # like smartctl, any critical warning bit means failure
+        'smart_status': 'PASS' if health_log["critical_warning"] == 0 else 'FAIL',
+        'temperature': health_log["temperature"],
+        'test_capabilities': {'offline': False, 'short': self_tests, 'long': self_tests, 'conveyance': False, 'selective': False},
+    }
+    info.update(get_nvme_health_attributes(health_log))
+    return info
+
+
+def read_sysfs_nvme_value(dev: str, sysfs_root: str = "/sys/class/nvme") -> Dict[str, Any]:
+    '''
+    Reads from sysfs the identity and the temperature of the provided NVMe device.
+    Unlike NVMe admin commands, this does not require root permissions; the temperature is provided by
+    the "nvme" hwmon driver (Linux 5.5+).
+    '''
+    ctrl = get_nvme_controller_name(dev)
+    if ctrl is None:
+        raise Exception(f"Device '{dev}' is not an NVMe device")
+    ctrl_dir = os.path.join(sysfs_root, ctrl)
+    if not os.path.isdir(ctrl_dir):
+        raise Exception(f"NVMe controller '{ctrl}' not found in {sysfs_root}")
+
+    def read_attr(path: str) -> Optional[str]:
+        try:
+            with open(path, "r") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    temperature = None
+    # temp1_input is the composite temperature, in millidegrees Celsius
+    for path in sorted(glob.glob(os.path.join(ctrl_dir, "hwmon*", "temp1_input")) +
+                       glob.glob(os.path.join(ctrl_dir, "device", "hwmon", "hwmon*", "temp1_input"))):
+        value = read_attr(path)
+        if value is not None:
+            temperature = round(int(value) / 1000)
+            break
+
+    return {
+        'interface': 'nvme',
+        'is_ssd': True,
+        'model': read_attr(os.path.join(ctrl_dir, "model")),
+        'name': dev.replace('/dev/', ''),
+        'path': dev,
+        'serial': read_attr(os.path.join(ctrl_dir, "serial")),
+        'firmware': read_attr(os.path.join(ctrl_dir, "firmware_rev")),
+        'temperature': temperature,
+    }
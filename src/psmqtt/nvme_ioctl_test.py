@@ -0,0 +1,95 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import ctypes
+import json
+import os
+import tempfile
+import unittest
+import pytest
+
+from .handlers_pysmart import SmartCommandHandler
+from .nvme_ioctl import (
+    NvmeAdminCmd,
+    get_nvme_controller_name,
+    get_nvme_value,
+    parse_nvme_health_log,
+    parse_nvme_identify_controller,
+    read_sysfs_nvme_value,
+)
+from .smartctl_json import parse_smartctl_json
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata")
+
+
+def read_testdata(basename: str) -> bytes:
+    with open(os.path.join(TESTDATA_DIR, basename), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.unit
+class TestNvmeIoctl(unittest.TestCase):
+
+    def test_admin_cmd_layout(self) -> None:
+        # must match struct nvme_admin_cmd of the Linux kernel
+        self.assertEqual(72, ctypes.sizeof(NvmeAdminCmd))
+        self.assertEqual(24, NvmeAdminCmd.addr.offset)
+        self.assertEqual(40, NvmeAdminCmd.cdw10.offset)
+
+    def test_controller_name(self) -> None:
+        self.assertEqual("nvme0", get_nvme_controller_name("/dev/nvme0"))
+        self.assertEqual("nvme1", get_nvme_controller_name("/dev/nvme1n1"))
+        self.assertIsNone(get_nvme_controller_name("/dev/sda"))
+        self.assertIsNone(get_nvme_controller_name("/dev/nvme0n1p1"))
+
+    def test_parse_health_log(self) -> None:
+        log = parse_nvme_health_log(read_testdata("nvme_health_log.bin"))
+
+        # same values decoded by smartctl from the same device
+        expected = json.loads(read_testdata("smartctl_nvme.json"))["nvme_smart_health_information_log"]
+        self.assertEqual(expected, log)
+
+        with self.assertRaises(ValueError):
+            parse_nvme_health_log(b"\x00" * 100)
+
+    def test_parity_with_smartctl(self) -> None:
+        identify = parse_nvme_identify_controller(read_testdata("nvme_identify_controller.bin"))
+        self.assertEqual("Samsung SSD 970 EVO Plus 1TB", identify["model"])
+
+        info = get_nvme_value("/dev/nvme0", identify, parse_nvme_health_log(read_testdata("nvme_health_log.bin")))
+        json_info = parse_smartctl_json(json.loads(read_testdata("smartctl_nvme.json")))
+        # all fields but self-tests are the same published using the smartctl_json backend
+        self.assertEqual({k: v for k, v in json_info.items() if not k.startswith("test[")}, info)
+
+    def test_critical_warning(self) -> None:
+        buf = bytearray(read_testdata("nvme_health_log.bin"))
+        # "available spare capacity has fallen below the threshold"
+        buf[0] = 0x01
+        identify = parse_nvme_identify_controller(read_testdata("nvme_identify_controller.bin"))
+        info = get_nvme_value("/dev/nvme0", identify, parse_nvme_health_log(bytes(buf)))
+        self.assertEqual("FAIL", info["smart_status"])
+        self.assertEqual("1", info["attribute_raw[Critical_Warning]"])
+
+    def test_sysfs_fallback(self) -> None:
+        with tempfile.TemporaryDirectory() as sysfs_root:
+            ctrl_dir = os.path.join(sysfs_root, "nvme0")
+            os.makedirs(os.path.join(ctrl_dir, "hwmon3"))
+            for name, value in [("model", "Samsung SSD 970 EVO Plus 1TB  \n"), ("serial", "S4EWNX0N654321B\n"),
+                                ("firmware_rev", "2B2QEXM7\n"), ("hwmon3/temp1_input", "38850\n")]:
+                with open(os.path.join(ctrl_dir, name), "w") as f:
+                    f.write(value)
+
+            info = read_sysfs_nvme_value("/dev/nvme0n1", sysfs_root)
+            self.assertEqual("Samsung SSD 970 EVO Plus 1TB", info["model"])
+            self.assertEqual("S4EWNX0N654321B", info["serial"])
+            self.assertEqual(39, info["temperature"])
+
+            with self.assertRaises(Exception):
+                read_sysfs_nvme_value("/dev/nvme1", sysfs_root)
+
+    def test_handler_missing_device(self) -> None:
+        handler = SmartCommandHandler()
+        handler.native_nvme = True
+        # neither the NVMe ioctl nor sysfs can read a missing device
+        with self.assertRaises(Exception):
+            handler.get_value("/dev/nvme99")
@@ -0,0 +1,153 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import errno
+import logging
+import os
+import socket
+import struct
+import threading
+from typing import (
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+# see <linux/netlink.h>, <linux/connector.h> and <linux/cn_proc.h>
+NETLINK_CONNECTOR = 11
+NLMSG_DONE = 3
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+# struct nlmsghdr, struct cn_msg and the header of struct proc_event, in host byte order
+NLMSGHDR = struct.Struct("=IHHII")
+CN_MSG = struct.Struct("=IIIIHH")
+PROC_EVENT_HEADER = struct.Struct("=IIQ")
+
+RECV_BUFFER_SIZE = 65536
+
+
+class ProcEvent(NamedTuple):
+    '''
+    A process event reported by the kernel proc connector: "fork", "exec" or "exit".
+    Events of threads other than the main thread of each process are never reported.
+    '''
+    what: str
+    pid: int
+    # the PID of the parent, for "fork" events
+    parent_pid: Optional[int] = None
+    # the exit status and the number of the terminating signal, for "exit" events
+    exit_code: Optional[int] = None
+    signal: Optional[int] = None
+
+
+def build_control_message(op: int) -> bytes:
+    '''
+    Builds the message subscribing to (PROC_CN_MCAST_LISTEN) or unsubscribing from (PROC_CN_MCAST_IGNORE) process events
+    '''
+    payload = struct.pack("=I", op)
+    cn_msg = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+    return NLMSGHDR.pack(NLMSGHDR.size + len(cn_msg), NLMSG_DONE, 0, 0, os.getpid()) + cn_msg
+
+
+def parse_messages(data: bytes) -> List[ProcEvent]:
+    '''
+    Decodes the process events contained in a datagram received from the proc connector
+    '''
+    events = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        msg_len = NLMSGHDR.unpack_from(data, offset)[0]
+        if msg_len < NLMSGHDR.size or offset + msg_len > len(data):
+            break
+        event_offset = offset + NLMSGHDR.size + CN_MSG.size
+        if event_offset + PROC_EVENT_HEADER.size <= offset + msg_len:
+            what = PROC_EVENT_HEADER.unpack_from(data, event_offset)[0]
+            event_data = event_offset + PROC_EVENT_HEADER.size
+            if what == PROC_EVENT_FORK:
+                parent_pid, parent_tgid, child_pid, child_tgid = struct.unpack_from("=IIII", data, event_data)
+                if child_pid == child_tgid:
+                    events.append(ProcEvent("fork", child_tgid, parent_pid=parent_tgid))
+            elif what == PROC_EVENT_EXEC:
+                pid, tgid = struct.unpack_from("=II", data, event_data)
+                if pid == tgid:
+                    events.append(ProcEvent("exec", tgid))
+            elif what == PROC_EVENT_EXIT:
+                pid, tgid, exit_code, exit_signal = struct.unpack_from("=IIII", data, event_data)
+                if pid == tgid:
+                    # exit_code is the wait() status of the process
+                    events.append(ProcEvent("exit", tgid, exit_code=(exit_code >> 8) & 0xff, signal=exit_code & 0x7f))
+        # netlink messages are aligned to 4 bytes
+        offset += (msg_len + 3) & ~3
+    return events
+
+
+class ProcConnector:
+    '''
+    Receives process events from the Linux kernel through the netlink proc connector, in a background thread,
+    and forwards them to the provided callback.
+    Subscribing to the proc connector requires the CAP_NET_ADMIN capability (e.g. running as root).
+    If receiving fails for any reason other than lost events, the connector stops and "on_failure" is invoked.
+    '''
+
+    def __init__(self, callback: Callable[[List[ProcEvent]], None], on_failure: Optional[Callable[[OSError], None]] = None) -> None:
+        self.callback = callback
+        self.on_failure = on_failure
+        self.sock: Optional[socket.socket] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        '''
+        Subscribes to process events; raises OSError if the proc connector is not available
+        '''
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            sock.bind((os.getpid(), CN_IDX_PROC))
+            sock.send(build_control_message(PROC_CN_MCAST_LISTEN))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.thread = threading.Thread(target=self._receive, name="proc-connector", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        sock = self.sock
+        self.sock = None
+        if sock is not None:
+            try:
+                sock.send(build_control_message(PROC_CN_MCAST_IGNORE))
+            except OSError:
+                pass
+            sock.close()
+
+    def _receive(self) -> None:
+        while True:
+            sock = self.sock
+            if sock is None:
+                return
+            try:
+                data = sock.recv(RECV_BUFFER_SIZE)
+            except OSError as ex:
+                if self.sock is None:
+                    # stopped
+                    return
+                if ex.errno == errno.ENOBUFS:
+                    # some events were lost because they were not consumed fast enough: the next ones are still received
+                    logging.warning(f"ProcConnector: some process events were lost: {ex}")
+                    continue
+                logging.warning(f"ProcConnector: failed to receive process events, stopping: {ex}")
+                self.stop()
+                if self.on_failure is not None:
+                    self.on_failure(ex)
+                return
+            events = parse_messages(data)
+            if events:
+                self.callback(events)
@@ -0,0 +1,85 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import errno
+import os
+import struct
+import unittest
+from unittest import mock
+import pytest
+
+from .proc_connector import (
+    CN_IDX_PROC,
+    CN_MSG,
+    NLMSG_DONE,
+    NLMSGHDR,
+    PROC_CN_MCAST_LISTEN,
+    PROC_EVENT_EXEC,
+    PROC_EVENT_EXIT,
+    PROC_EVENT_FORK,
+    PROC_EVENT_HEADER,
+    ProcConnector,
+    ProcEvent,
+    build_control_message,
+    parse_messages,
+)
+
+
+def build_event_message(what: int, data: bytes) -> bytes:
+    '''
+    Builds a netlink message as sent by the kernel proc connector
+    '''
+    event = PROC_EVENT_HEADER.pack(what, 0, 123456789) + data
+    cn_msg = CN_MSG.pack(CN_IDX_PROC, 1, 0, 0, len(event), 0) + event
+    msg = NLMSGHDR.pack(NLMSGHDR.size + len(cn_msg), NLMSG_DONE, 0, 0, 0) + cn_msg
+    # messages are padded to 4 bytes
+    return msg + b"\x00" * (-len(msg) % 4)
+
+
+@pytest.mark.unit
+class TestProcConnector(unittest.TestCase):
+
+    def test_control_message(self) -> None:
+        msg = build_control_message(PROC_CN_MCAST_LISTEN)
+        self.assertEqual(NLMSGHDR.size + CN_MSG.size + 4, len(msg))
+        self.assertEqual((len(msg), NLMSG_DONE, 0, 0, os.getpid()), NLMSGHDR.unpack_from(msg))
+        self.assertEqual((CN_IDX_PROC, 1, 0, 0, 4, 0), CN_MSG.unpack_from(msg, NLMSGHDR.size))
+        self.assertEqual(PROC_CN_MCAST_LISTEN, struct.unpack_from("=I", msg, NLMSGHDR.size + CN_MSG.size)[0])
+
+    def test_parse_messages(self) -> None:
+        data = build_event_message(PROC_EVENT_FORK, struct.pack("=IIII", 100, 100, 200, 200)) + \
+            build_event_message(PROC_EVENT_FORK, struct.pack("=IIII", 200, 200, 201, 200)) + \
+            build_event_message(PROC_EVENT_EXEC, struct.pack("=II", 200, 200)) + \
+            build_event_message(PROC_EVENT_EXIT, struct.pack("=IIII", 201, 200, 0, 17)) + \
+            build_event_message(PROC_EVENT_EXIT, struct.pack("=IIII", 200, 200, (3 << 8), 17)) + \
+            build_event_message(PROC_EVENT_EXIT, struct.pack("=IIII", 300, 300, 9, 17))
+
+        # events of threads (PID different from the thread group ID) are skipped
+        self.assertEqual([
+            ProcEvent("fork", 200, parent_pid=100),
+            ProcEvent("exec", 200),
+            ProcEvent("exit", 200, exit_code=3, signal=0),
+            ProcEvent("exit", 300, exit_code=0, signal=9),
+        ], parse_messages(data))
+
+        # truncated messages are ignored
+        self.assertEqual([ProcEvent("fork", 200, parent_pid=100)], parse_messages(data[:100]))
+        self.assertEqual([], parse_messages(b""))
+
+    def test_receive_errors(self) -> None:
+        received = []
+        failures = []
+        connector = ProcConnector(received.extend, failures.append)
+        sock = mock.Mock()
+        sock.recv.side_effect = [OSError(errno.ENOBUFS, "No buffer space available"),
+                                 build_event_message(PROC_EVENT_EXEC, struct.pack("=II", 200, 200)),
+                                 OSError(errno.EBADF, "Bad file descriptor")]
+        connector.sock = sock
+        connector._receive()
+
+        # lost events do not stop the connector, any other error does
+        self.assertEqual([ProcEvent("exec", 200)], received)
+        self.assertEqual(3, sock.recv.call_count)
+        self.assertEqual([errno.EBADF], [ex.errno for ex in failures])
+        self.assertIsNone(connector.sock)
+        sock.close.assert_called_once_with()
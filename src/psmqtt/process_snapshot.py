@@ -0,0 +1,770 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+from array import array
+import bisect
+from collections import deque
+import heapq
+from itertools import repeat
+import logging
+import threading
+import time
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+import weakref
+
+import psutil
+
+from .procfs_reader import ProcfsReader
+
+
+class _AccessDenied:
+    '''
+    Placeholder stored in the snapshot for the properties that could not be read because of missing permissions
+    '''
+
+    def __repr__(self) -> str:
+        return "ACCESS_DENIED"
+
+
+ACCESS_DENIED = _AccessDenied()
+
+
+class ProcessIndex:
+    '''
+    Maps the values of a process property (e.g. "name") to the PIDs of the processes having that value.
+    The index is updated incrementally by ProcessRegistry, as processes start, exit or change value.
+    '''
+
+    def __init__(self, attr: str) -> None:
+        self.attr = attr
+        self.pids_by_value: Dict[str, Set[int]] = {}
+        self.value_by_pid: Dict[int, str] = {}
+
+    @staticmethod
+    def get_key(value: Any) -> Optional[str]:
+        '''
+        Converts a property value to the index key: e.g. command lines are indexed as a single string
+        '''
+        if value is ACCESS_DENIED or value is None:
+            return None
+        if isinstance(value, list):
+            return " ".join(value)
+        return str(value)
+
+    def update(self, pid: int, value: Any) -> None:
+        key = ProcessIndex.get_key(value)
+        old_key = self.value_by_pid.get(pid, None)
+        if key == old_key:
+            return
+        if old_key is not None:
+            self.remove(pid)
+        if key is not None:
+            self.value_by_pid[pid] = key
+            self.pids_by_value.setdefault(key, set()).add(pid)
+
+    def remove(self, pid: int) -> None:
+        key = self.value_by_pid.pop(pid, None)
+        if key is not None:
+            pids = self.pids_by_value[key]
+            pids.discard(pid)
+            if not pids:
+                del self.pids_by_value[key]
+
+    def copy(self) -> 'ProcessIndex':
+        '''
+        Returns a copy of this index, which is not altered by the next walks of the process table
+        '''
+        other = ProcessIndex(self.attr)
+        other.pids_by_value = {key: set(pids) for key, pids in self.pids_by_value.items()}
+        other.value_by_pid = dict(self.value_by_pid)
+        return other
+
+
+class ProcessColumns:
+    '''
+    Columnar store of the properties of all running processes, owned by ProcessRegistry and refreshed in place
+    by each walk of the process table. Each process gets a row ("slot") for its whole life, identified by
+    its PID and creation time; the slots of exited processes are reused by new processes, so that memory use
+    depends on the number of running processes rather than on how many processes started and exited.
+
+    Numeric properties are stored in typed arrays: one per property or, for the properties returning a named tuple,
+    one per field (e.g. "memory_info_rss"); values that could not be read are stored as NaN.
+    Other properties (e.g. "name" or "cmdline") are stored in a list per property, holding one value per slot.
+    Dictionaries with the properties of a process are built only for the processes actually published, see get_info().
+    '''
+
+    NUMERIC_ATTRS = frozenset({'ppid', 'cpu_percent', 'memory_percent', 'num_threads', 'num_fds', 'nice', 'create_time'})
+    TUPLE_ATTRS = frozenset({'memory_info', 'memory_full_info', 'io_counters', 'cpu_times', 'num_ctx_switches',
+                             'io_counters_rate', 'cpu_times_rate', 'num_ctx_switches_rate'})
+
+    NAN = float('nan')
+
+    def __init__(self) -> None:
+        # PID of the process of each slot, -1 for free slots
+        self.pids = array('q')
+        # creation time of the process of each slot, NaN if unknown
+        self.create_times = array('d')
+        # ID of the walk of the process table that found the process of each slot, see ProcessRegistry
+        self.first_walk_ids = array('q')
+        # monotonic time of the last reading of each slot, to compute rates
+        self.read_times = array('d')
+        # total CPU time and time of its reading, to compute the CPU usage of each slot without psutil
+        self.cpu_totals = array('d')
+        self.cpu_total_times = array('d')
+        # the psutil.Process instance of each slot, created only when needed
+        self.processes: List[Optional[psutil.Process]] = []
+
+        # column name -> value of each slot
+        self.columns: Dict[str, array] = {}
+        # names of the columns holding integer values
+        self.int_columns: Set[str] = set()
+        # named-tuple property -> its type, to rebuild the values from the columns of its fields
+        self.tuple_types: Dict[str, Any] = {}
+        # non-numeric property -> value of each slot
+        self.objects: Dict[str, List[Any]] = {}
+
+        self.free_slots: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def allocate(self, pid: int, create_time: Optional[float], walk_id: int) -> int:
+        '''
+        Returns a free slot for a new process
+        '''
+        nan = ProcessColumns.NAN
+        ct = create_time if create_time is not None else nan
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.pids[slot] = pid
+            self.create_times[slot] = ct
+            self.first_walk_ids[slot] = walk_id
+            self.read_times[slot] = nan
+            self.cpu_totals[slot] = nan
+            self.cpu_total_times[slot] = nan
+            return slot
+        slot = len(self.pids)
+        self.pids.append(pid)
+        self.create_times.append(ct)
+        self.first_walk_ids.append(walk_id)
+        self.read_times.append(nan)
+        self.cpu_totals.append(nan)
+        self.cpu_total_times.append(nan)
+        self.processes.append(None)
+        for column in self.columns.values():
+            column.append(nan)
+        for values in self.objects.values():
+            values.append(None)
+        return slot
+
+    def free(self, slot: int) -> None:
+        '''
+        Releases the slot of a process that exited
+        '''
+        self.pids[slot] = -1
+        self.processes[slot] = None
+        for values in self.objects.values():
+            values[slot] = None
+        self.free_slots.append(slot)
+
+    def set_number(self, name: str, slot: int, value: Any) -> None:
+        column = self.columns.get(name, None)
+        if column is None:
+            if value is None or value is ACCESS_DENIED:
+                # the column is created by the first readable value
+                return
+            column = self.columns[name] = array('d', repeat(ProcessColumns.NAN, len(self.pids)))
+            if isinstance(value, int):
+                self.int_columns.add(name)
+        column[slot] = ProcessColumns.NAN if value is None or value is ACCESS_DENIED else value
+
+    def set_tuple(self, attr: str, slot: int, value: Any) -> None:
+        if value is None or value is ACCESS_DENIED:
+            tuple_type = self.tuple_types.get(attr, None)
+            if tuple_type is not None:
+                for field in tuple_type._fields:
+                    self.columns[f"{attr}_{field}"][slot] = ProcessColumns.NAN
+            return
+        if attr not in self.tuple_types:
+            self.tuple_types[attr] = type(value)
+        # fields of named tuples depend on the platform
+        for field, x in zip(value._fields, value):
+            self.set_number(f"{attr}_{field}", slot, x)
+
+    def store(self, slot: int, info: Dict[str, Any]) -> None:
+        '''
+        Stores the properties read for the process of the provided slot
+        '''
+        for attr, value in info.items():
+            if attr in ProcessColumns.NUMERIC_ATTRS:
+                self.set_number(attr, slot, value)
+            elif attr in ProcessColumns.TUPLE_ATTRS:
+                self.set_tuple(attr, slot, value)
+            elif attr != 'pid':
+                values = self.objects.get(attr, None)
+                if values is None:
+                    values = self.objects[attr] = [None] * len(self.pids)
+                values[slot] = value
+
+    def store_rate(self, attr: str, base_attr: str, slot: int, new_value: Any, delta_time_seconds: Optional[float]) -> None:
+        '''
+        Stores the rate of change of the counters of the "base_attr" property, comparing the value just read
+        with the one stored in the slot; must be invoked before storing the new value.
+        Without a previous value (delta_time_seconds is None) the rate is zero.
+        '''
+        if new_value is None or new_value is ACCESS_DENIED:
+            self.set_tuple(attr, slot, ACCESS_DENIED)
+            return
+        if attr not in self.tuple_types:
+            self.tuple_types[attr] = type(new_value)
+        for field, new in zip(new_value._fields, new_value):
+            old_column = self.columns.get(f"{base_attr}_{field}", None)
+            old = old_column[slot] if old_column is not None and delta_time_seconds is not None else None
+            self.set_number(f"{attr}_{field}", slot, compute_field_rate(new, old, delta_time_seconds))
+
+    def get_info(self, slot: int, attrs: Iterable[str]) -> Dict[str, Any]:
+        '''
+        Builds the dictionary of the provided properties of the process of a slot;
+        properties that could not be read are set to ACCESS_DENIED
+        '''
+        info: Dict[str, Any] = {}
+        for attr in attrs:
+            if attr in ProcessColumns.NUMERIC_ATTRS:
+                info[attr] = self.get_number(attr, slot)
+            elif attr in ProcessColumns.TUPLE_ATTRS:
+                tuple_type = self.tuple_types.get(attr, None)
+                fields = [self.get_number(f"{attr}_{field}", slot) for field in tuple_type._fields] if tuple_type is not None else []
+                info[attr] = tuple_type._make(fields) if fields and ACCESS_DENIED not in fields else ACCESS_DENIED
+            else:
+                values = self.objects.get(attr, None)
+                info[attr] = values[slot] if values is not None else ACCESS_DENIED
+        return info
+
+    def get_number(self, name: str, slot: int) -> Any:
+        column = self.columns.get(name, None)
+        if column is None:
+            return ACCESS_DENIED
+        value = column[slot]
+        if value != value:
+            # NaN is the only value not equal to itself
+            return ACCESS_DENIED
+        return int(value) if name in self.int_columns else value
+
+    def copy(self) -> 'ProcessColumns':
+        '''
+        Returns a copy of this store, which is not altered by the next walks of the process table
+        '''
+        other = ProcessColumns()
+        other.pids = self.pids[:]
+        other.create_times = self.create_times[:]
+        other.first_walk_ids = self.first_walk_ids[:]
+        other.read_times = self.read_times[:]
+        other.cpu_totals = self.cpu_totals[:]
+        other.cpu_total_times = self.cpu_total_times[:]
+        other.processes = list(self.processes)
+        other.columns = {name: column[:] for name, column in self.columns.items()}
+        other.int_columns = set(self.int_columns)
+        other.tuple_types = dict(self.tuple_types)
+        other.objects = {attr: list(values) for attr, values in self.objects.items()}
+        other.free_slots = list(self.free_slots)
+        return other
+
+
+class ProcessSnapshot:
+    '''
+    ProcessSnapshot is the result of a single walk of the process table, shared by all "processes" tasks
+    of the same sampling pass (see SnapshotCache): all properties needed by those tasks are read at once.
+
+    The properties are stored in the ProcessColumns of the registry and indexed by its ProcessIndex instances, which the next
+    walk refreshes in place: a snapshot still in use at that time (e.g. because of "cache_ttl") gets its own copy of both
+    first, see detach(). Until then they must be read holding "lock".
+    All processes of the snapshot are sorted by PID; rankings and sums read only the columns,
+    while get_info() builds the dictionary of a single process to publish its properties.
+    Properties that could not be read because of missing permissions are set to ACCESS_DENIED.
+    '''
+
+    def __init__(self, attrs: FrozenSet[str], walk_id: int, store: ProcessColumns, pids: array, slots: array,
+                 indexes: Optional[Dict[str, ProcessIndex]] = None, lock: Optional[threading.RLock] = None) -> None:
+        self.attrs = attrs
+        self.walk_id = walk_id
+        self.timestamp = time.time()
+        self.store = store
+        # PIDs of all processes, sorted, and their slots in the store
+        self.pids = pids
+        self.slots = slots
+        # property -> index of the values of that property, see ProcessRegistry
+        self.indexes = indexes if indexes is not None else {}
+        # held while reading the store and the indexes, which are shared with the registry until detach()
+        self.lock = lock if lock is not None else threading.RLock()
+        # metric -> (number of processes requested, PIDs of the processes having the largest values of that metric)
+        self.top_processes: Dict[str, Tuple[int, List[int]]] = {}
+        # column names -> value of each process of the snapshot (the sum of the columns if more than one), see get_values()
+        self.values: Dict[Tuple[str, ...], Optional[array]] = {}
+        # parent PID -> PIDs of its children, see get_children()
+        self.children: Optional[Dict[int, List[int]]] = None
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def detach(self) -> None:
+        '''
+        Invoked by the registry, holding the lock, before refreshing the store and the indexes for a new walk
+        '''
+        self.store = self.store.copy()
+        self.indexes = {attr: index.copy() for attr, index in self.indexes.items()}
+        # the copies are not shared: stop contending with the walks of the registry
+        self.lock = threading.RLock()
+
+    def get_row(self, pid: int) -> int:
+        '''
+        Returns the position of the process having the provided PID, or -1
+        '''
+        row = bisect.bisect_left(self.pids, pid)
+        return row if row < len(self.pids) and self.pids[row] == pid else -1
+
+    def has_process(self, pid: int) -> bool:
+        return self.get_row(pid) >= 0
+
+    def get_process(self, pid: int) -> Optional[psutil.Process]:
+        '''
+        Returns the psutil.Process instance of the process having the provided PID, or None if it was not running
+        when the snapshot was taken or it exited since then
+        '''
+        row = self.get_row(pid)
+        if row < 0:
+            return None
+        slot = self.slots[row]
+        with self.lock:
+            process = self.store.processes[slot]
+            if process is None:
+                # not needed by the walk, e.g. with the procfs backend
+                try:
+                    process = psutil.Process(pid)
+                    create_time = self.store.create_times[slot]
+                    if create_time == create_time and process.create_time() != create_time:
+                        # PID reused by a new process
+                        return None
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    return None
+                self.store.processes[slot] = process
+        return process
+
+    def get_info(self, pid: int, attrs: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        '''
+        Returns the provided properties (default: all the properties read by the snapshot) of the process having
+        the provided PID, or None if it was not running when the snapshot was taken.
+        Properties not read by the snapshot are not included.
+        '''
+        row = self.get_row(pid)
+        if row < 0:
+            return None
+        attrs = self.attrs if attrs is None else self.attrs.intersection(attrs)
+        with self.lock:
+            return self.store.get_info(self.slots[row], attrs)
+
+    def get_create_time(self, pid: int) -> Optional[float]:
+        row = self.get_row(pid)
+        if row < 0:
+            return None
+        with self.lock:
+            create_time = self.store.create_times[self.slots[row]]
+        return create_time if create_time == create_time else None
+
+    def get_started(self, walk_id: int) -> List[int]:
+        '''
+        Returns the PIDs of the processes found for the first time by a walk following the provided one
+        '''
+        with self.lock:
+            first_walk_ids = self.store.first_walk_ids
+            return [pid for pid, slot in zip(self.pids, self.slots) if first_walk_ids[slot] > walk_id]
+
+    def get_values(self, names: Sequence[str]) -> Optional[array]:
+        '''
+        Returns the value of the provided column for each process of the snapshot, in the same order of "pids" or,
+        if several names are provided, the sum of those columns; returns None if any column is not available.
+        The values are gathered from the store once per snapshot.
+        '''
+        key = tuple(names)
+        if key in self.values:
+            return self.values[key]
+        with self.lock:
+            columns = [self.store.columns.get(name, None) for name in names]
+            if any(c is None for c in columns):
+                values = None
+            elif len(columns) == 1:
+                values = array('d', map(columns[0].__getitem__, self.slots))
+            else:
+                values = array('d', map(sum, zip(*(map(c.__getitem__, self.slots) for c in columns))))
+        self.values[key] = values
+        return values
+
+    def sum_values(self, names: Sequence[str], pids: Iterable[int]) -> Optional[float]:
+        '''
+        Returns the sum of get_values(names) over the provided processes, skipping NaN values;
+        returns None if the columns are not available
+        '''
+        values = self.get_values(names)
+        if values is None:
+            return None
+        rows = [row for row in map(self.get_row, pids) if row >= 0]
+        return sum(v for v in map(values.__getitem__, rows) if v == v)
+
+    def get_children(self) -> Dict[int, List[int]]:
+        '''
+        Returns the PIDs of the children of each process; the map is built once per snapshot.
+        Requires the "ppid" property.
+        '''
+        if self.children is None:
+            children: Dict[int, List[int]] = {}
+            ppids = self.get_values(['ppid'])
+            if ppids is not None:
+                for pid, ppid in zip(self.pids, ppids):
+                    if ppid == ppid and ppid != pid:
+                        children.setdefault(int(ppid), []).append(pid)
+            self.children = children
+        return self.children
+
+    def get_subtree(self, root_pid: int) -> List[int]:
+        '''
+        Returns the PIDs of the provided process and of all its descendants, sorted
+        '''
+        if not self.has_process(root_pid):
+            return []
+        children = self.get_children()
+        pids = [root_pid]
+        i = 0
+        while i < len(pids):
+            pids.extend(children.get(pids[i], ()))
+            i += 1
+        return sorted(pids)
+
+    def get_top(self, metric: str, k: int, columns: Sequence[str]) -> List[int]:
+        '''
+        Returns the PIDs of the "k" processes having the largest values of the provided metric, in decreasing order.
+        The metric is the sum of the provided columns; processes whose metric could not be read are never returned.
+        The ranking costs O(n log k) and is done once per metric: all later requests for
+        up to "k" processes are served from the same list.
+        '''
+        entry = self.top_processes.get(metric, None)
+        if entry is None or entry[0] < k:
+            values = self.get_values(columns)
+            if values is None:
+                top = []
+            else:
+                # NaN is the only value not equal to itself
+                rows = heapq.nlargest(k, (i for i, v in enumerate(values) if v == v), key=values.__getitem__)
+                top = [self.pids[i] for i in rows]
+            entry = self.top_processes[metric] = (k, top)
+        return entry[1][:k]
+
+
+# minimal interval between two readings of the counters of a process to compute their rate of change
+MINIMAL_RATE_DELTA_TIME_SECONDS = 0.1
+
+
+def compute_field_rate(new: Any, old: Any, delta_time_seconds: Optional[float]) -> Any:
+    '''
+    Computes the rate of change per second of a monotonic counter; returns zero when no previous reading is available
+    (old is None or NaN). Integer counters (e.g. bytes) produce integer rates, other counters (e.g. CPU seconds)
+    are rounded to milliseconds.
+    '''
+    if old is None or old != old or delta_time_seconds is None or delta_time_seconds < MINIMAL_RATE_DELTA_TIME_SECONDS:
+        return 0 if isinstance(new, int) else 0.0
+    # counters of the same process never decrease
+    rate = max(new - old, 0) / delta_time_seconds
+    return int(rate) if isinstance(new, int) else round(rate, 3)
+
+
+def compute_rate(new_value: Any, old_value: Any, delta_time_seconds: Optional[float]) -> Any:
+    '''
+    Computes the rate of change per second of each field of a named tuple of monotonic counters, e.g. psutil.Process.io_counters();
+    returns zeroes when no previous reading is available, see compute_field_rate()
+    '''
+    if new_value is ACCESS_DENIED or new_value is None:
+        return ACCESS_DENIED
+    if old_value is ACCESS_DENIED or old_value is None:
+        old_value = repeat(None)
+    return type(new_value)._make(compute_field_rate(new, old, delta_time_seconds) for new, old in zip(new_value, old_value))
+
+
+def read_cgroup(pid: int, procfs_root: str = "/proc") -> Any:
+    '''
+    Returns the control group of a process, e.g. "/system.slice/postgresql.service", reading /proc/<pid>/cgroup:
+    the cgroup v2 path if available, or the path of the systemd hierarchy of cgroup v1.
+    Returns None if control groups are not supported (e.g. outside Linux) and ACCESS_DENIED if the file cannot be read.
+    '''
+    try:
+        with open(f"{procfs_root}/{pid}/cgroup", "r") as f:
+            lines = f.read().splitlines()
+    except PermissionError:
+        return ACCESS_DENIED
+    except OSError:
+        return None
+    paths = {}
+    for line in lines:
+        # hierarchy-ID:controller-list:cgroup-path
+        fields = line.split(':', 2)
+        if len(fields) == 3:
+            paths[fields[1]] = fields[2]
+    return paths.get('', paths.get('name=systemd', next(iter(paths.values()), None)))
+
+
+class ProcessRegistry:
+    '''
+    ProcessRegistry keeps the properties of all running processes across sampling passes in a ProcessColumns store,
+    where each process has a slot identified by (pid, create_time), so that a PID reused by a new process never inherits
+    the state of the old one. Slots of processes that exited are freed at each walk and reused by new processes.
+
+    The CPU usage of each process is computed from its CPU times, as psutil.Process.cpu_percent() does, comparing them
+    with those stored in its slot by the previous walk; therefore psutil.Process instances are not kept across walks:
+    they are created by the snapshots only for the processes whose properties are published.
+
+    The registry also maintains a ProcessIndex for each property of INDEXED_ATTRS read by the walks.
+    Besides psutil properties, walks can read the "cgroup" property (see read_cgroup()) and the properties of RATE_ATTRS,
+    i.e. the rate of change of the counters of each process since the previous walk, if that walk read them too.
+
+    Several handlers can share the same registry, and thus the same walk: each of them declares
+    the properties needed by its tasks with set_prefetch_attrs().
+    '''
+
+    INDEXED_ATTRS = frozenset({'name', 'exe', 'username', 'cmdline', 'cgroup'})
+    # properties read by the registry itself rather than by psutil.Process.as_dict()
+    RATE_ATTRS = {'io_counters_rate': 'io_counters', 'num_ctx_switches_rate': 'num_ctx_switches', 'cpu_times_rate': 'cpu_times'}
+    EXTRA_ATTRS = frozenset({'cgroup', 'cpu_percent'}) | frozenset(RATE_ATTRS)
+
+    # max number of exited processes remembered for the "process_events" tasks, see get_exits()
+    MAX_EXITS = 10000
+
+    def __init__(self) -> None:
+        self.store = ProcessColumns()
+        # PID -> slot of the running processes
+        self.slots_by_pid: Dict[int, int] = {}
+        # ID of the last walk of the process table
+        self.walk_id = 0
+        # process property -> ID of the last walk that read it
+        self.attr_walk_ids: Dict[str, int] = {}
+        # the processes that exited: (ID of the walk that found them exited, ID of the walk that found them started,
+        # PID, creation time, name, command line)
+        self.exits: Deque[Tuple[int, int, int, Optional[float], Any, Any]] = deque(maxlen=ProcessRegistry.MAX_EXITS)
+        self.indexes: Dict[str, ProcessIndex] = {}
+        # handler name -> process properties needed by its tasks in the current sampling pass
+        self.prefetch_attrs: Dict[str, FrozenSet[str]] = {}
+        self.lock = threading.RLock()
+        # the snapshot sharing the store of the registry, see ProcessSnapshot.detach()
+        self.live_snapshot: Optional[weakref.ref] = None
+        # set to read the most common properties directly from /proc, see set_backend()
+        self.procfs_reader: Optional[ProcfsReader] = None
+
+        # statistics
+        self.num_created = 0
+        self.num_evicted = 0
+
+    def set_prefetch_attrs(self, owner: str, attrs: FrozenSet[str]) -> None:
+        self.prefetch_attrs[owner] = attrs
+
+    def get_prefetch_attrs(self) -> FrozenSet[str]:
+        '''
+        Returns the union of the properties declared by all handlers sharing this registry
+        '''
+        return frozenset().union(*self.prefetch_attrs.values())
+
+    def set_backend(self, backend: str) -> None:
+        '''
+        Selects how the properties of processes are read: "psutil", or "procfs" to parse the most common ones
+        directly from /proc (see ProcfsReader). Falls back to "psutil" where /proc is not available.
+        '''
+        if backend == "procfs" and ProcfsReader.is_supported():
+            if self.procfs_reader is None:
+                self.procfs_reader = ProcfsReader(ad_value=ACCESS_DENIED)
+        else:
+            if backend == "procfs":
+                logging.warning("ProcessRegistry: the procfs backend is not supported on this platform, falling back to psutil")
+            self.procfs_reader = None
+
+    def get_known_info(self, pid: int) -> Dict[str, Any]:
+        '''
+        Returns the name, command line and creation time of a process read by the last walk of the process table, if any
+        '''
+        with self.lock:
+            slot = self.slots_by_pid.get(pid, None)
+            if slot is None:
+                return {'name': None, 'cmdline': None, 'create_time': None}
+            info = self.store.get_info(slot, ['name', 'cmdline'])
+            create_time = self.store.create_times[slot]
+        return {'name': None if info['name'] is ACCESS_DENIED else info['name'],
+                'cmdline': None if info['cmdline'] is ACCESS_DENIED else info['cmdline'],
+                'create_time': create_time if create_time == create_time else None}
+
+    def get_exits(self, since_walk_id: int, upto_walk_id: int) -> List[Tuple[int, Optional[float], Any, Any]]:
+        '''
+        Returns the PID, creation time, name and command line of the processes that were running at the walk "since_walk_id"
+        and were found exited by a walk up to "upto_walk_id"
+        '''
+        with self.lock:
+            return [(pid, create_time, name, cmdline) for walk_id, first_walk_id, pid, create_time, name, cmdline in self.exits
+                    if since_walk_id < walk_id <= upto_walk_id and first_walk_id <= since_walk_id]
+
+    @staticmethod
+    def _read_process(pid: int, sorted_attrs: List[str]) -> Tuple[Optional[float], Dict[str, Any]]:
+        '''
+        Reads the properties of a process through psutil; returns its creation time (None if unknown) and its properties
+        '''
+        # the new instance reads the creation time of the process currently having this PID
+        p = psutil.Process(pid)
+        try:
+            create_time: Optional[float] = p.create_time()
+        except psutil.AccessDenied:
+            create_time = None
+        return create_time, p.as_dict(attrs=sorted_attrs, ad_value=ACCESS_DENIED)
+
+    @staticmethod
+    def _read_process_procfs(reader: ProcfsReader, pid: int, procfs_attrs: FrozenSet[str],
+                             psutil_attrs: List[str]) -> Tuple[Optional[float], Dict[str, Any]]:
+        '''
+        Same as _read_process(), reading the properties of procfs_attrs from /proc and only the others through psutil
+        '''
+        info = reader.read(pid, procfs_attrs)
+        create_time = info['create_time'] if info['create_time'] is not ACCESS_DENIED else None
+        if psutil_attrs:
+            info.update(psutil.Process(pid).as_dict(attrs=psutil_attrs, ad_value=ACCESS_DENIED))
+        return create_time, info
+
+    def _get_slot(self, pid: int, create_time: Optional[float]) -> Tuple[int, bool]:
+        '''
+        Returns the slot of a process read by the current walk, and whether the slot was read by the previous walk
+        '''
+        store = self.store
+        slot = self.slots_by_pid.get(pid, None)
+        if slot is not None:
+            known_create_time = store.create_times[slot]
+            if create_time is None or known_create_time != known_create_time or create_time == known_create_time:
+                return slot, True
+        # new process, or PID reused by a new process
+        self.num_created += 1
+        return store.allocate(pid, create_time, self.walk_id), False
+
+    def _free_slot(self, slot: int) -> None:
+        '''
+        Frees the slot of a process that exited, remembering it for get_exits()
+        '''
+        store = self.store
+        info = store.get_info(slot, ['name', 'cmdline'])
+        create_time = store.create_times[slot]
+        self.exits.append((self.walk_id, store.first_walk_ids[slot], store.pids[slot],
+                           create_time if create_time == create_time else None, info['name'], info['cmdline']))
+        store.free(slot)
+        self.num_evicted += 1
+
+    def take_snapshot(self, attrs: FrozenSet[str]) -> ProcessSnapshot:
+        '''
+        Walks the process table once, reading the provided properties of all processes.
+        This function is meant to be invoked through SnapshotCache.call().
+        '''
+        start_time = time.time()
+        rate_attrs = [(attr, base_attr) for attr, base_attr in ProcessRegistry.RATE_ATTRS.items() if attr in attrs]
+        read_cgroups = 'cgroup' in attrs
+        # CPU usage is computed from the CPU times, see _update_cpu_percent()
+        read_cpu_percent = 'cpu_percent' in attrs
+        read_attrs = (attrs - ProcessRegistry.EXTRA_ATTRS) | {base_attr for _, base_attr in rate_attrs}
+        if read_cpu_percent:
+            read_attrs |= {'cpu_times'}
+        # psutil reads all properties when asked for none of them
+        sorted_attrs = sorted(read_attrs) or ['pid']
+        reader = self.procfs_reader
+        if reader is not None:
+            # the creation time is always read, to detect reused PIDs
+            procfs_attrs = (ProcfsReader.SUPPORTED_ATTRS & read_attrs) | {'create_time'}
+            psutil_attrs = [attr for attr in sorted_attrs if attr not in procfs_attrs and attr != 'pid']
+            pids = reader.pids()
+        else:
+            pids = sorted(psutil.pids())
+        snapshot_pids = array('q')
+        snapshot_slots = array('q')
+        with self.lock:
+            live_snapshot = self.live_snapshot() if self.live_snapshot is not None else None
+            if live_snapshot is not None:
+                # the store is about to be refreshed in place
+                live_snapshot.detach()
+            self.walk_id += 1
+            walk_id = self.walk_id
+            # rates are computed only from the counters read by the previous walk
+            prev_walk_attrs = {attr for attr, attr_walk_id in self.attr_walk_ids.items() if attr_walk_id == walk_id - 1}
+            for attr in read_attrs:
+                self.attr_walk_ids[attr] = walk_id
+            # an index is kept up to date only by walks reading its property: drop the indexes that would become stale
+            self.indexes = {attr: self.indexes.get(attr, ProcessIndex(attr)) for attr in ProcessRegistry.INDEXED_ATTRS & attrs}
+            indexes = list(self.indexes.values())
+            store = self.store
+            slots_by_pid = {}
+            for pid in pids:
+                try:
+                    if reader is not None:
+                        create_time, info = self._read_process_procfs(reader, pid, procfs_attrs, psutil_attrs)
+                    else:
+                        create_time, info = self._read_process(pid, sorted_attrs)
+                except psutil.NoSuchProcess:
+                    # process exited while walking the process table
+                    continue
+                slot, known = self._get_slot(pid, create_time)
+                if read_cgroups:
+                    info['cgroup'] = read_cgroup(pid)
+                now = time.monotonic()
+                if read_cpu_percent:
+                    self._update_cpu_percent(slot, info, now)
+                if rate_attrs:
+                    prev_time = store.read_times[slot] if known else ProcessColumns.NAN
+                    delta_time = now - prev_time if prev_time == prev_time else None
+                    for attr, base_attr in rate_attrs:
+                        store.store_rate(attr, base_attr, slot, info[base_attr], delta_time if base_attr in prev_walk_attrs else None)
+                store.store(slot, info)
+                store.read_times[slot] = now
+                slots_by_pid[pid] = slot
+                snapshot_pids.append(pid)
+                snapshot_slots.append(slot)
+                for index in indexes:
+                    index.update(pid, info[index.attr])
+
+            # free the slots of the processes that exited, or whose PID was reused
+            for pid, slot in self.slots_by_pid.items():
+                if slots_by_pid.get(pid, None) != slot:
+                    self._free_slot(slot)
+                    if pid not in slots_by_pid:
+                        for index in indexes:
+                            index.remove(pid)
+            self.slots_by_pid = slots_by_pid
+
+            snapshot = ProcessSnapshot(attrs, walk_id, store, snapshot_pids, snapshot_slots, dict(self.indexes), self.lock)
+            self.live_snapshot = weakref.ref(snapshot)
+
+        logging.debug(f"ProcessRegistry: read {len(attrs)} properties of {len(snapshot_pids)} processes in {time.time() - start_time:.3f}sec")
+        return snapshot
+
+    def _update_cpu_percent(self, slot: int, info: Dict[str, Any], now: float) -> None:
+        '''
+        Same as psutil.Process.cpu_percent(): sets the CPU usage since the previous walk, 0.0 for new processes
+        '''
+        store = self.store
+        cpu_times = info['cpu_times']
+        if cpu_times is ACCESS_DENIED:
+            info['cpu_percent'] = ACCESS_DENIED
+            return
+        cpu_total = cpu_times.user + cpu_times.system
+        prev_total = store.cpu_totals[slot]
+        prev_time = store.cpu_total_times[slot]
+        if prev_total == prev_total and now > prev_time:
+            info['cpu_percent'] = round(max(cpu_total - prev_total, 0) / (now - prev_time) * 100, 1)
+        else:
+            info['cpu_percent'] = 0.0
+        store.cpu_totals[slot] = cpu_total
+        store.cpu_total_times[slot] = now
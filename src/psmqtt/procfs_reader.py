@@ -0,0 +1,194 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import os
+import sys
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    List,
+)
+
+import psutil
+
+# the state letters of /proc/<pid>/stat, see "man 5 proc"
+PROC_STATUSES = {
+    "R": psutil.STATUS_RUNNING,
+    "S": psutil.STATUS_SLEEPING,
+    "D": psutil.STATUS_DISK_SLEEP,
+    "T": psutil.STATUS_STOPPED,
+    "t": psutil.STATUS_TRACING_STOP,
+    "Z": psutil.STATUS_ZOMBIE,
+    "X": psutil.STATUS_DEAD,
+    "x": psutil.STATUS_DEAD,
+    "W": psutil.STATUS_WAKING,
+    "I": psutil.STATUS_IDLE,
+    "P": psutil.STATUS_PARKED,
+}
+
+# large enough for /proc/<pid>/stat, statm and io; /proc/<pid>/status is read in more chunks if needed
+BUFFER_SIZE = 4096
+
+# the kernel truncates the command name ("comm") of processes to 15 characters
+TASK_COMM_LEN = 15
+
+
+class ProcfsReader:
+    '''
+    Reads the properties of processes directly from /proc/<pid>/stat, statm, io and status (Linux only),
+    as a faster alternative to psutil.Process.as_dict() for the most common properties (see SUPPORTED_ATTRS).
+    Each file is read with a single system call into a buffer reused for all processes, and only the fields
+    of the requested properties are parsed. Values are the same returned by psutil, with the same types.
+
+    This is meant to be used only by ProcessRegistry: the other properties are still read through psutil.
+    '''
+
+    # properties parsed from /proc/<pid>/stat
+    STAT_ATTRS = frozenset({'name', 'ppid', 'status', 'num_threads', 'nice', 'create_time', 'cpu_times'})
+    SUPPORTED_ATTRS = STAT_ATTRS | frozenset({'memory_info', 'io_counters', 'num_ctx_switches'})
+
+    def __init__(self, ad_value: Any = None, procfs_root: str = "/proc") -> None:
+        # the value of the properties that cannot be read because of missing permissions, as in psutil.Process.as_dict()
+        self.ad_value = ad_value
+        self.procfs_root = procfs_root
+        self.buffer = bytearray(BUFFER_SIZE)
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        # the same boot time used by psutil, so that creation times are identical to psutil.Process.create_time()
+        self.boot_time = psutil.boot_time()
+
+        # the named tuples returned by psutil on this platform
+        me = psutil.Process()
+        self.pcputimes = type(me.cpu_times())
+        self.pmem = type(me.memory_info())
+        self.pctxsw = type(me.num_ctx_switches())
+        self.pio = type(me.io_counters()) if hasattr(me, "io_counters") else None
+
+    @staticmethod
+    def is_supported() -> bool:
+        return sys.platform.startswith("linux") and os.path.exists("/proc/self/stat")
+
+    def pids(self) -> List[int]:
+        '''
+        Returns the sorted PIDs of all running processes
+        '''
+        with os.scandir(self.procfs_root) as it:
+            return sorted(int(entry.name) for entry in it if entry.name.isdigit())
+
+    def _read_file(self, pid: int, name: str) -> bytes:
+        fd = os.open(f"{self.procfs_root}/{pid}/{name}", os.O_RDONLY)
+        try:
+            size = os.readv(fd, [self.buffer])
+            data = bytes(memoryview(self.buffer)[:size])
+            if size == len(self.buffer):
+                # longer than the buffer
+                chunks = [data]
+                while True:
+                    chunk = os.read(fd, BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                data = b"".join(chunks)
+            return data
+        finally:
+            os.close(fd)
+
+    def read_file(self, pid: int, name: str) -> Any:
+        '''
+        Returns the content of /proc/<pid>/<name>, or the ad_value if it cannot be read because of missing permissions;
+        raises psutil.NoSuchProcess if the process does not exist
+        '''
+        try:
+            return self._read_file(pid, name)
+        except (FileNotFoundError, ProcessLookupError):
+            raise psutil.NoSuchProcess(pid)
+        except PermissionError:
+            return self.ad_value
+
+    def read(self, pid: int, attrs: FrozenSet[str]) -> Dict[str, Any]:
+        '''
+        Reads the provided properties (all in SUPPORTED_ATTRS) of a process.
+        Properties that cannot be read because of missing permissions are set to the ad_value.
+        '''
+        info: Dict[str, Any] = {}
+        if not attrs.isdisjoint(ProcfsReader.STAT_ATTRS):
+            self._parse_stat(pid, attrs, info)
+        if 'memory_info' in attrs:
+            data = self.read_file(pid, "statm")
+            if data is self.ad_value:
+                info['memory_info'] = self.ad_value
+            else:
+                vms, rss, shared, text, lib, data_size, dirty = (int(x) * self.page_size for x in data.split()[:7])
+                info['memory_info'] = self.pmem(rss, vms, shared, text, lib, data_size, dirty)
+        if 'io_counters' in attrs:
+            info['io_counters'] = self._parse_io(pid)
+        if 'num_ctx_switches' in attrs:
+            data = self.read_file(pid, "status")
+            if data is self.ad_value:
+                info['num_ctx_switches'] = self.ad_value
+            else:
+                info['num_ctx_switches'] = self.pctxsw(self._get_status_field(data, b"\nvoluntary_ctxt_switches:"),
+                                                       self._get_status_field(data, b"\nnonvoluntary_ctxt_switches:"))
+        return info
+
+    def _parse_stat(self, pid: int, attrs: FrozenSet[str], info: Dict[str, Any]) -> None:
+        data = self.read_file(pid, "stat")
+        if data is self.ad_value:
+            info.update({attr: self.ad_value for attr in attrs & ProcfsReader.STAT_ATTRS})
+            return
+        # the command name is between parentheses and can contain spaces and parentheses itself;
+        # fields are numbered as in "man 5 proc" minus 3
+        rpar = data.rfind(b")")
+        fields = data[rpar + 2:].split()
+        if 'name' in attrs:
+            name = os.fsdecode(data[data.find(b"(") + 1:rpar])
+            if len(name) >= TASK_COMM_LEN:
+                # like psutil, use the full name of the executable if the command name has been truncated
+                cmdline = self.read_file(pid, "cmdline")
+                if cmdline is not self.ad_value and cmdline:
+                    extended_name = os.path.basename(os.fsdecode(cmdline.split(b"\x00", 1)[0]))
+                    if extended_name.startswith(name):
+                        name = extended_name
+            info['name'] = name
+        if 'ppid' in attrs:
+            info['ppid'] = int(fields[1])
+        if 'status' in attrs:
+            info['status'] = PROC_STATUSES.get(fields[0].decode(), "?")
+        if 'nice' in attrs:
+            info['nice'] = int(fields[16])
+        if 'num_threads' in attrs:
+            info['num_threads'] = int(fields[17])
+        if 'create_time' in attrs:
+            info['create_time'] = float(fields[19]) / self.clock_ticks + self.boot_time
+        if 'cpu_times' in attrs:
+            ticks = self.clock_ticks
+            # user, system, children_user, children_system and (on recent psutil versions) iowait
+            values = [float(fields[i]) / ticks for i in (11, 12, 13, 14, 39) if i < len(fields)]
+            info['cpu_times'] = self.pcputimes._make(values[:len(self.pcputimes._fields)])
+
+    def _parse_io(self, pid: int) -> Any:
+        if self.pio is None:
+            return self.ad_value
+        data = self.read_file(pid, "io")
+        if data is self.ad_value:
+            return self.ad_value
+        fields = {}
+        for line in data.splitlines():
+            name, _, value = line.partition(b": ")
+            if value:
+                fields[name] = int(value)
+        try:
+            return self.pio(fields[b"syscr"], fields[b"syscw"], fields[b"read_bytes"], fields[b"write_bytes"],
+                            fields[b"rchar"], fields[b"wchar"])
+        except KeyError:
+            return self.ad_value
+
+    @staticmethod
+    def _get_status_field(data: bytes, name: bytes) -> int:
+        start = data.find(name)
+        if start < 0:
+            return 0
+        start += len(name)
+        end = data.find(b"\n", start)
+        return int(data[start:end if end >= 0 else len(data)])
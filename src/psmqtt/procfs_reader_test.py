@@ -0,0 +1,151 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import pytest
+
+import psutil
+
+from .procfs_reader import ProcfsReader
+
+requires_procfs = pytest.mark.skipif(not ProcfsReader.is_supported(), reason="requires the Linux /proc filesystem")
+
+ACCESS_DENIED = object()
+
+
+def write_file(path: str, content: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+@pytest.mark.unit
+@requires_procfs
+class TestProcfsReader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp(prefix="psmqtt-procfs-")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def make_process(self, pid: int, comm: bytes, cmdline: bytes = b"") -> str:
+        path = os.path.join(self.root, str(pid))
+        os.mkdir(path)
+        # the command name contains spaces and parentheses; fields after it as in "man 5 proc"
+        stat_fields = ["S", "1", "42", "42", "0", "-1", "4194560", "100", "0", "0", "0",
+                       "250", "50", "10", "5", "20", "-5", "3", "0", "1000"] + ["0"] * 19 + ["7"]
+        write_file(os.path.join(path, "stat"), b"%d (%s) %s\n" % (pid, comm, " ".join(stat_fields).encode()))
+        write_file(os.path.join(path, "statm"), b"300 200 100 10 0 150 0\n")
+        write_file(os.path.join(path, "io"), b"rchar: 1000\nwchar: 2000\nsyscr: 10\nsyscw: 20\n"
+                                             b"read_bytes: 4096\nwrite_bytes: 8192\ncancelled_write_bytes: 0\n")
+        write_file(os.path.join(path, "status"), b"Name:\tfoo\n" + b"Pad:\tx\n" * 1000 +
+                                                 b"voluntary_ctxt_switches:\t123\nnonvoluntary_ctxt_switches:\t45\n")
+        write_file(os.path.join(path, "cmdline"), cmdline)
+        return path
+
+    def test_read(self) -> None:
+        self.make_process(10, b"my (odd) name")
+        self.make_process(9, b"kworker/0:1")
+        os.mkdir(os.path.join(self.root, "self"))
+        reader = ProcfsReader(ad_value=ACCESS_DENIED, procfs_root=self.root)
+        ticks = reader.clock_ticks
+        page_size = reader.page_size
+
+        self.assertEqual([9, 10], reader.pids())
+        info = reader.read(10, ProcfsReader.SUPPORTED_ATTRS)
+        self.assertEqual("my (odd) name", info['name'])
+        self.assertEqual(1, info['ppid'])
+        self.assertEqual(psutil.STATUS_SLEEPING, info['status'])
+        self.assertEqual(-5, info['nice'])
+        self.assertEqual(3, info['num_threads'])
+        self.assertAlmostEqual(1000 / ticks + psutil.boot_time(), info['create_time'])
+        self.assertAlmostEqual(250 / ticks, info['cpu_times'].user)
+        self.assertAlmostEqual(50 / ticks, info['cpu_times'].system)
+        self.assertAlmostEqual(5 / ticks, info['cpu_times'].children_system)
+        self.assertEqual(200 * page_size, info['memory_info'].rss)
+        self.assertEqual(300 * page_size, info['memory_info'].vms)
+        self.assertEqual((10, 20, 4096, 8192), tuple(info['io_counters'])[:4])
+        # the "status" file is longer than the read buffer
+        self.assertEqual((123, 45), tuple(info['num_ctx_switches']))
+
+        # only the requested properties are read
+        self.assertEqual({'ppid'}, set(reader.read(10, frozenset({'ppid'}))))
+
+        with self.assertRaises(psutil.NoSuchProcess):
+            reader.read(11, frozenset({'ppid'}))
+
+    def test_read_truncated_name(self) -> None:
+        self.make_process(10, b"a-very-long-pro", b"/usr/bin/a-very-long-program\x00--flag\x00")
+        self.make_process(11, b"another-long-na", b"/usr/bin/python3\x00script\x00")
+        reader = ProcfsReader(ad_value=ACCESS_DENIED, procfs_root=self.root)
+        self.assertEqual("a-very-long-program", reader.read(10, frozenset({'name'}))['name'])
+        # the executable does not match the command name
+        self.assertEqual("another-long-na", reader.read(11, frozenset({'name'}))['name'])
+
+    def test_read_access_denied(self) -> None:
+        self.make_process(10, b"foo")
+        reader = ProcfsReader(ad_value=ACCESS_DENIED, procfs_root=self.root)
+        orig_read_file = reader._read_file
+
+        def read_file(pid: int, name: str) -> bytes:
+            if name == "io":
+                raise PermissionError(name)
+            return orig_read_file(pid, name)
+        reader._read_file = read_file  # type: ignore
+        info = reader.read(10, frozenset({'io_counters', 'ppid'}))
+        self.assertIs(ACCESS_DENIED, info['io_counters'])
+        self.assertEqual(1, info['ppid'])
+
+    def test_same_values_as_psutil(self) -> None:
+        reader = ProcfsReader(ad_value=ACCESS_DENIED)
+        p = psutil.Process()
+        info = reader.read(p.pid, ProcfsReader.SUPPORTED_ATTRS)
+        expected = p.as_dict(attrs=sorted(ProcfsReader.SUPPORTED_ATTRS), ad_value=ACCESS_DENIED)
+        self.assertEqual(set(expected), set(info))
+        for attr in ['name', 'ppid', 'status', 'nice', 'num_threads', 'create_time']:
+            self.assertEqual(expected[attr], info[attr], attr)
+        for attr in ['cpu_times', 'memory_info', 'io_counters', 'num_ctx_switches']:
+            self.assertIs(type(expected[attr]), type(info[attr]), attr)
+        self.assertAlmostEqual(expected['cpu_times'].user, info['cpu_times'].user, delta=0.1)
+        self.assertAlmostEqual(expected['memory_info'].vms, info['memory_info'].vms, delta=16 * 1024 * 1024)
+        self.assertIn(p.pid, reader.pids())
+
+
+@pytest.mark.benchmark
+@requires_procfs
+class BenchmarkProcfsReader(unittest.TestCase):
+
+    ATTRS = frozenset({'name', 'ppid', 'status', 'cpu_times', 'memory_info', 'num_ctx_switches'})
+
+    def _time(self, func) -> float:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    def _psutil(self) -> None:
+        for p in psutil.process_iter(attrs=sorted(self.ATTRS), ad_value=ACCESS_DENIED):
+            pass
+
+    def _procfs(self, reader: ProcfsReader) -> None:
+        for pid in reader.pids():
+            try:
+                reader.read(pid, self.ATTRS)
+            except psutil.NoSuchProcess:
+                pass
+
+    def test_benchmark(self) -> None:
+        reader = ProcfsReader(ad_value=ACCESS_DENIED)
+        num_processes = len(reader.pids())
+        results = {
+            "psutil.process_iter": min(self._time(self._psutil) for _ in range(5)),
+            "ProcfsReader": min(self._time(lambda: self._procfs(reader)) for _ in range(5)),
+        }
+        for name, elapsed_sec in results.items():
+            logging.info(f"{name:>20}: {elapsed_sec * 1000:8.1f}ms, {elapsed_sec * 1e6 / num_processes:6.1f}us per process")
+        # the procfs backend exists only to be faster than psutil
+        self.assertLessEqual(results["ProcfsReader"], results["psutil.process_iter"])
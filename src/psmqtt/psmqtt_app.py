@@ -8,12 +8,16 @@ import socket
 import logging
 import sys
 import platform
+import signal
 import time
+from typing import Any, List
 
 from .config import Config
 from .mqtt_client import MqttClient
 from .task import Task
+from .task_executor import TaskExecutor
 from .schedule import Schedule
+from .snapshot_cache import SnapshotCache
 from .utils import get_mac_address
 
 class PsmqttApp:
@@ -23,48 +27,51 @@ class PsmqttApp:
         self.config = None  # instance of Config
         self.mqtt_client = None  # instance of MqttClient
         self.scheduler = None  # instance of sched.scheduler
+        self.task_executor = None  # instance of TaskExecutor
 
         self.last_logged_status = (None, None, None)
         self.schedule_list = []  # list of Schedule instances
+        self.schedule_due_time = {}  # Unix timestamp of the next occurrence of each Schedule, by schedule index
+        self.tasks_by_id = {}  # all Task instances of all Schedules, by task ID
 
     @staticmethod
-    def on_schedule_timer(app: 'PsmqttApp', schedule: Schedule) -> None:
+    def on_schedule_timer(app: 'PsmqttApp') -> None:
         '''
-        Takes a list of tasks to be run immediately.
-        The list must contain dictionary items, each having "task", "params", "topic" and "formatter" fields.
-        E.g.:
-            [
-            { "task: "cpu_percent",
-                "params": [],
-                "topic": None,
-                "formatter": None },
-            { "task": "virtual_memory",
-                "params": [ "percent" ],
-                "topic": "foobar",
-                "formatter": None }
-            ]
+        Runs all scheduling rules that are due now, or that will be due within the
+        "schedule_coalescing_window_sec" configured in the options.
+        All tasks of the due scheduling rules are executed as a single sampling pass,
+        so that e.g. an "every 10 seconds" and an "every 30 seconds" rule coming due
+        together share the same psutil readings and the same wakeup.
         '''
+        now = time.time()
+        window_sec = app.config.config["options"]["schedule_coalescing_window_sec"]
+        due_schedules = [sch for sch in app.schedule_list
+                         if app.schedule_due_time[sch.schedule_rule_idx] <= now + window_sec]
 
-        task_list = schedule.get_tasks()
-        logging.debug("PsmqttApp.on_schedule_timer(%s, %d tasks)", schedule.parsed_rrule, len(task_list))
+        logging.debug("PsmqttApp.on_schedule_timer(%s)", [sch.parsed_rrule for sch in due_schedules])
+        app.run_schedules(due_schedules)
 
         # support for the "exit_after" feature
         exit_after = app.config.config["options"]["exit_after_num_tasks"]
-        reschedule = True
-
-        for task in task_list:
-            # main entrypoint for TASK execution:
-            task.run_task(app.mqtt_client)
-
-            if exit_after > 0 and Task.num_total_tasks_executed() >= exit_after:
-                reschedule = False
-                break
+        reschedule = exit_after <= 0 or Task.num_total_tasks_executed() < exit_after
 
         # add next timer task
         if reschedule:
-            app.scheduler.enter(schedule.get_next_occurrence(), 1, PsmqttApp.on_schedule_timer, (app, schedule))
+            for sch in due_schedules:
+                # compute the next occurrence strictly after the occurrence just served, since we might
+                # have been running this schedule slightly ahead of its due time
+                due_time = app.schedule_due_time[sch.schedule_rule_idx]
+                app.schedule_due_time[sch.schedule_rule_idx] = sch.get_next_occurrence_time(max(now, due_time))
+            app.enter_next_schedule_timer()
         return
 
+    def enter_next_schedule_timer(self) -> None:
+        '''
+        Adds to the scheduler a single timer event for the first scheduling rule that is due
+        '''
+        next_due_time = min(self.schedule_due_time.values())
+        self.scheduler.enterabs(next_due_time, 1, PsmqttApp.on_schedule_timer, tuple([self]))
+
     @staticmethod
     def log_status() -> None:
         logging.info(f"psmqtt status: {Task.num_success} successful tasks; {Task.num_errors} failed tasks; {MqttClient.num_disconnects} MQTT disconnections; {MqttClient.num_published_successful}/{MqttClient.num_published_total} successful/total MQTT messages published")
@@ -127,7 +134,7 @@ class PsmqttApp:
             "configuration_url": "https://github.com/eschava/psmqtt",
             "connections": [["mac", get_mac_address()]],
         }
-        num_msgs = 0
+        messages = []
         for sch in self.schedule_list:
 
             expire_time_sec = sch.get_max_interval_sec()
@@ -148,21 +155,67 @@ class PsmqttApp:
                 if payload is not None:
                     topic = t.get_ha_discovery_topic(ha_discovery_topic, ha_device_name)
                     logging.info(f"Publishing an MQTT discovery messages on topic '{topic}'")
-                    self.mqtt_client.publish(topic, payload)
-                    num_msgs += 1
+                    messages.append((topic, payload))
+        num_msgs = self.mqtt_client.publish_many(messages)
         logging.info(f"Published a total of {num_msgs} MQTT discovery messages under the topic prefix '{ha_discovery_topic}' for the device '{ha_device_name}'. The HomeAssistant MQTT integration should now be showing {num_msgs} sensors for the device '{ha_device_name}'.")
         return num_msgs
 
+    def run_schedules(self, schedules: List[Schedule]) -> int:
+        '''
+        Runs all tasks of the provided scheduling rules in a single sampling pass.
+        When a worker pool is configured, the tasks of "parallel" scheduling rules and the tasks
+        having a blocking handler are submitted to the pool; all other tasks run in the main thread.
+        Returns the number of tasks that were run or submitted to the pool.
+        '''
+        exit_after = self.config.config["options"]["exit_after_num_tasks"]
+        use_pool = self.task_executor is not None and self.task_executor.is_enabled() and self.mqtt_client.is_connected()
+        num_tasks = 0
+
+        # let slow handlers start collecting data for all tasks of this pass concurrently:
+        Task.prefetch_handlers([t for sch in schedules for t in sch.get_tasks()])
+
+        SnapshotCache.begin_pass()
+        try:
+            for sch in schedules:
+                inline_tasks = sch.get_tasks()
+                if use_pool:
+                    pool_tasks = [t for t in sch.get_tasks() if sch.parallel or t.is_blocking()]
+                    inline_tasks = [t for t in sch.get_tasks() if t not in pool_tasks]
+                    if pool_tasks:
+                        num_tasks += self.task_executor.submit(pool_tasks, sch.max_concurrency)
+
+                for task in inline_tasks:
+                    # main entrypoint for TASK execution:
+                    task.run_task(self.mqtt_client)
+                    num_tasks += 1
+
+                    if exit_after > 0 and Task.num_total_tasks_executed() >= exit_after:
+                        return num_tasks
+        finally:
+            SnapshotCache.end_pass()
+
+        return num_tasks
+
+    def publish_refreshed_values(self) -> int:
+        '''
+        Re-runs the tasks whose value has been refreshed in background by their handler
+        (e.g. "directory_usage" with background refresh enabled), so that fresh values
+        are published without waiting for the next occurrence of their scheduling rule.
+        '''
+        num_tasks = 0
+        for h in Task.handlers.values():
+            for task_id in h.pop_refreshed_callers():
+                if task_id in self.tasks_by_id:
+                    self.tasks_by_id[task_id].run_task(self.mqtt_client)
+                    num_tasks += 1
+        return num_tasks
+
     def run_all_tasks(self) -> int:
         '''
         Run all tasks immediately, disregarding the schedule.
         Returns the number of tasks that were run.
         '''
-        num_tasks = 0
-        for sch in self.schedule_list:
-            for task in sch.get_tasks():
-                task.run_task(self.mqtt_client)
-                num_tasks += 1
+        num_tasks = self.run_schedules(self.schedule_list)
 
         logging.info(f"Executed {num_tasks} tasks.")
         return num_tasks
@@ -214,6 +267,7 @@ class PsmqttApp:
             sys.exit(2)
 
         self.config.apply_logging_config()
+        Task.configure_handlers(self.config.config["options"])
 
         #
         # hello message
@@ -253,21 +307,28 @@ class PsmqttApp:
                 new_schedule = Schedule(sch['cron'],
                                         sch['tasks'],
                                         self.config.config["mqtt"]["publish_topic_prefix"],
-                                        i)
+                                        i,
+                                        sch['parallel'],
+                                        sch['max_concurrency'])
             except ValueError as e:
                 logging.error(f"Cannot parse schedule #{i}: {e}. Aborting.")
                 return 4
 
-            # upon startup psmqtt will immediately run all scheduling rules, just
-            # scattered 100ms one from each other:
-            first_time_delay_sec = i + 0.1
-
-            # include this in our scheduler:
-            self.scheduler.enter(first_time_delay_sec, 1, PsmqttApp.on_schedule_timer, (self, new_schedule))
+            # upon startup psmqtt will immediately run all scheduling rules, in a single
+            # sampling pass 100ms from now:
+            self.schedule_due_time[i] = time.time() + 0.1
             i += 1
 
             # store the Schedule also locally:
             self.schedule_list.append(new_schedule)
+            for t in new_schedule.get_tasks():
+                self.tasks_by_id[t.task_id] = t
+
+        # include this in our scheduler:
+        self.enter_next_schedule_timer()
+
+        # optional worker pool for slow tasks
+        self.task_executor = TaskExecutor(self.config.config["options"]["worker_threads"])
 
         # add periodic log
         try:
@@ -309,6 +370,12 @@ class PsmqttApp:
                 time.sleep(sleep_quantum_sec)
                 time_waited_sec += sleep_quantum_sec
 
+                # publish results of tasks that were executed in the worker pool
+                self.task_executor.publish_completed_results(self.mqtt_client)
+
+                # publish values that were just refreshed by handlers computing them in background
+                self.publish_refreshed_values()
+
                 if exit_after > 0 and Task.num_total_tasks_executed() >= exit_after:
                     logging.warning("exiting after executing %d tasks as requested in the configuration file", Task.num_total_tasks_executed())
                     self.keep_running = False
@@ -329,8 +396,15 @@ class PsmqttApp:
 
                         # see https://github.com/eschava/psmqtt/issues/79
                         logging.warning("Detected notification that Home Assistant just (re)started; phase 2: publishing all sensor values (regardless of their schedule)...")
+                        for sch in self.schedule_list:
+                            for t in sch.get_tasks():
+                                t.reset_last_published()
                         self.run_all_tasks()
 
+    @staticmethod
+    def on_sigterm(signum: int, frame: Any) -> None:
+        raise KeyboardInterrupt("SIGTERM")
+
     def run(self) -> int:
         # estabilish a connection to the MQTT broker
         try:
@@ -350,6 +424,9 @@ class PsmqttApp:
 
         self.last_ha_discovery_messages_connection_id = MqttClient.CONN_ID_INVALID
 
+        # exit gracefully also when stopped via SIGTERM (e.g. by systemd or docker)
+        signal.signal(signal.SIGTERM, PsmqttApp.on_sigterm)
+
         # block the main thread on the MQTT client loop
         self.keep_running = True
         while self.keep_running:
@@ -368,7 +445,9 @@ class PsmqttApp:
                 logging.warning("KeyboardInterrupt caught, exiting")
                 break
 
-        # gracefully stop the event loop of MQTT client
+        # stop worker threads (if any), save the state of handlers and gracefully stop the event loop of MQTT client
+        self.task_executor.shutdown()
+        Task.shutdown_handlers()
         self.mqtt_client.loop_stop()
 
         # log status one last time
@@ -14,17 +14,25 @@ class Schedule:
     '''
     Defines a psmqtt SCHEDULING RULE, whose main properties are:
     * "cron" which defines how frequently this rule will run
-    " "ts a list of Task classes
+    * "tasks" a list of Task classes
+    * "parallel" and "max_concurrency" which define how tasks are executed when a worker pool is configured
     '''
 
     def __init__(self,
             cron:str,
             tasks_dict:List[Dict[str,Any]],
             mqtt_topic_prefix:str,
-            schedule_rule_idx:int) -> None:
+            schedule_rule_idx:int,
+            parallel:bool = False,
+            max_concurrency:int = 0) -> None:
         self.cron_expr = cron
         self.schedule_rule_idx = schedule_rule_idx
 
+        # when a worker pool is configured, "parallel" rules run all their tasks in the pool,
+        # with at most "max_concurrency" tasks running at the same time (zero means no limit)
+        self.parallel = parallel
+        self.max_concurrency = max_concurrency
+
         # parse the cron expression
         self.recurrent_event = RecurringEvent()
         self.parsed_rrule = self.recurrent_event.parse(cron)
@@ -44,7 +52,9 @@ class Schedule:
                      t["formatter"],
                     t["ha_discovery"],
                     mqtt_topic_prefix,
-                     self.schedule_rule_idx, j))
+                     self.schedule_rule_idx, j,
+                     t["cache_ttl"],
+                     t.get("publish_on_change", None)))
             j += 1
 
         # summary of the whole instance:
@@ -58,6 +68,17 @@ class Schedule:
         now = datetime.datetime.now()
         return (rrulestr(self.parsed_rrule).after(now) - now).total_seconds()
 
+    def get_next_occurrence_time(self, after: float) -> float:
+        '''
+        Compute the first time (as a Unix timestamp) this schedule needs to run strictly after
+        the provided Unix timestamp.
+        This is useful when a schedule is executed slightly ahead of its due time (e.g. because it
+        was coalesced with other schedules) to avoid running it twice for the same occurrence.
+        '''
+        # NOTE: we need reparse rule each time (see #10)
+        after_dt = datetime.datetime.fromtimestamp(after)
+        return rrulestr(self.parsed_rrule).after(after_dt).timestamp()
+
     def get_max_interval_sec(self) -> int:
         '''
         This function attempts to find the max possible interval between 2 occurrences of the
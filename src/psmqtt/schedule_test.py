@@ -2,6 +2,7 @@
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
 import unittest
+import time
 import pytest
 
 from .schedule import Schedule
@@ -16,7 +17,8 @@ class TestTask(unittest.TestCase):
                          "params": [],
                          "topic": "foobar",
                          "formatter": "a-fake-one",
-                         "ha_discovery": None
+                         "ha_discovery": None,
+                         "cache_ttl": 0
                         }],
                      "some-mqtt-prefix",
                      42)
@@ -37,3 +39,17 @@ class TestTask(unittest.TestCase):
                      "some-mqtt-prefix",
                      42)
             self.assertEqual(t["expected_max_interval"], s.get_max_interval_sec())
+
+    def test_schedule_next_occurrence_time(self):
+        s = Schedule("every 10 seconds",
+                     [],
+                     "some-mqtt-prefix",
+                     42)
+        now = time.time()
+        next_time = s.get_next_occurrence_time(now)
+        self.assertGreater(next_time, now)
+        self.assertLessEqual(next_time, now + 10)
+
+        # asking for the occurrence after a point in the future never returns that same point
+        later_time = s.get_next_occurrence_time(next_time)
+        self.assertAlmostEqual(later_time, next_time + 10, delta=0.001)
@@ -0,0 +1,295 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import json
+import re
+import shutil
+import subprocess
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+)
+
+# The fields of the NVMe SMART/health information log, as named in the JSON output of smartctl,
+# and the name of the "attribute_raw[NAME]" key used to publish them.
+# Names are derived from the labels used by smartctl in its text output.
+NVME_HEALTH_ATTRIBUTES = [
+    ("critical_warning", "Critical_Warning"),
+    ("temperature", "Temperature"),
+    ("available_spare", "Available_Spare"),
+    ("available_spare_threshold", "Available_Spare_Threshold"),
+    ("percentage_used", "Percentage_Used"),
+    ("data_units_read", "Data_Units_Read"),
+    ("data_units_written", "Data_Units_Written"),
+    ("host_reads", "Host_Read_Commands"),
+    ("host_writes", "Host_Write_Commands"),
+    ("controller_busy_time", "Controller_Busy_Time"),
+    ("power_cycles", "Power_Cycles"),
+    ("power_on_hours", "Power_On_Hours"),
+    ("unsafe_shutdowns", "Unsafe_Shutdowns"),
+    ("media_errors", "Media_and_Data_Integrity_Errors"),
+    ("num_err_log_entries", "Error_Information_Log_Entries"),
+    ("warning_temp_time", "Warning_Comp_Temperature_Time"),
+    ("critical_comp_time", "Critical_Comp_Temperature_Time"),
+]
+
+# bits of the smartctl exit status meaning that no data could be read at all; see "man smartctl"
+SMARTCTL_FATAL_EXIT_STATUS_MASK = 0x03
+
+
+class DeviceStandbyError(Exception):
+    '''
+    Raised when the SMART data of a device has not been read because the device is in a low-power mode
+    (STANDBY or SLEEP) and reading it would have spun it up
+    '''
+    pass
+
+
+def format_capacity(num_bytes: int) -> str:
+    '''
+    Formats a capacity with 3 significant digits, exactly like smartctl does
+    (e.g. "500 GB" or "1.00 TB"); pySMART reports this human-readable string as "capacity"
+    '''
+    prefixes = " KMGTP"
+    i = 0
+    d = 1
+    while num_bytes >= d * 1000:
+        d *= 1000
+        i += 1
+        if i >= len(prefixes) - 1:
+            break
+    n = num_bytes // d
+    if i == 0:
+        return f"{n} B"
+    elif n >= 100:
+        return f"{(num_bytes + d // 2) // d} {prefixes[i]}B"
+    elif n >= 10:
+        return f"{n}.{((num_bytes % d) * 10 + d // 2) // d} {prefixes[i]}B"
+    return f"{n}.{((num_bytes % d) * 100 + d // 2) // d:02d} {prefixes[i]}B"
+
+
+def _get_when_failed(attr: Dict[str, Any]) -> str:
+    # the JSON output uses "" / "past" / "now" where the text output uses "-" / "In_the_past" / "FAILING_NOW"
+    return {"": "-", "past": "In_the_past", "now": "FAILING_NOW"}.get(attr.get("when_failed", ""), attr.get("when_failed", ""))
+
+
+def _get_ata_tests(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    tests = []
+    table = data.get("ata_smart_self_test_log", {}).get("standard", {}).get("table", [])
+    for idx, t in enumerate(table):
+        lba = t.get("lba", None)
+        tests.append({
+            'num': idx + 1,
+            'type': t.get("type", {}).get("string", None),
+            'status': t.get("status", {}).get("string", None),
+            'hours': str(t.get("lifetime_hours", "")),
+            'lba': str(lba) if lba is not None else "-",
+            'remain': f"{t.get('status', {}).get('remaining_percent', 0):02d}%",
+            'segment': None,
+            'sense': None,
+            'asc': None,
+            'ascq': None,
+            'nsid': None,
+            'sct': None,
+            'code': None,
+        })
+    return tests
+
+
+def _get_nvme_tests(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    tests = []
+    table = data.get("nvme_self_test_log", {}).get("table", [])
+    for idx, t in enumerate(table):
+        sct = t.get("status_code_type", None)
+        code = t.get("status_code", None)
+        tests.append({
+            'num': idx,
+            'type': t.get("self_test_code", {}).get("string", None),
+            'status': t.get("self_test_result", {}).get("string", None),
+            'hours': t.get("power_on_hours", None),
+            'lba': t.get("lba", None),
+            'remain': 0,
+            'segment': t.get("segment", None),
+            'sense': None,
+            'asc': None,
+            'ascq': None,
+            'nsid': t.get("nsid", None),
+            'sct': f"0x{sct:x}" if sct is not None else "-",
+            'code': f"0x{code:02x}" if code is not None else "-",
+        })
+    return tests
+
+
+def parse_smartctl_json(data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Converts the output of "smartctl --json -a" into the same dictionary produced by
+    SmartCommandHandler from the pySMART state of a device, i.e. the dictionary published by "smart" tasks:
+    all SMART attributes are flattened into "attribute_raw[ATTRIBUTE_NAME]" keys and
+    all self-tests into "test[TEST_INDEX]" keys, where test[0] is the most recent test.
+    '''
+    device = data.get("device", {})
+    dev_type = device.get("type", None)
+    is_nvme = dev_type == "nvme" or device.get("protocol", "") == "NVMe"
+
+    smart_support = data.get("smart_support", {})
+    if is_nvme:
+        smart_capable = smart_enabled = True
+    else:
+        smart_capable = smart_support.get("available", False)
+        smart_enabled = smart_support.get("enabled", False)
+
+    assessment = None
+    if "smart_status" in data:
+        assessment = "PASS" if data["smart_status"].get("passed", False) else "FAIL"
+
+    num_bytes = data.get("user_capacity", {}).get("bytes", data.get("nvme_total_capacity", None))
+    rotation_rate = data.get("rotation_rate", None)
+
+    ata_capabilities = data.get("ata_smart_data", {}).get("capabilities", {})
+    if is_nvme:
+        nvme_self_tests = "nvme_self_test_log" in data
+        test_capabilities = {'offline': False, 'short': nvme_self_tests, 'long': nvme_self_tests, 'conveyance': False, 'selective': False}
+    else:
+        self_tests = ata_capabilities.get("self_tests_supported", dev_type not in (None, "ata", "sat"))
+        test_capabilities = {
+            'offline': ata_capabilities.get("exec_offline_immediate_supported", False),
+            'short': self_tests,
+            'long': self_tests,
+            'conveyance': ata_capabilities.get("conveyance_self_test_supported", False),
+            'selective': ata_capabilities.get("selective_self_test_supported", False),
+        }
+
+    info: Dict[str, Any] = {
+        'capacity': format_capacity(num_bytes) if num_bytes else None,
+        'diagnostics': None,
+        'firmware': data.get("firmware_version", None),
+        'interface': dev_type if dev_type else 'UNKNOWN INTERFACE',
+        'is_ssd': is_nvme or rotation_rate == 0,
+        'messages': [],
+        'model': data.get("model_name", data.get("scsi_model_name", None)),
+        'name': device.get("name", "").replace('/dev/', '').replace('nvd', 'nvme'),
+        'path': device.get("name", None),
+        'rotation_rate': rotation_rate if rotation_rate else None,
+        'serial': data.get("serial_number", None),
+        'smart_capable': smart_capable,
+        'smart_enabled': smart_enabled,
+        'smart_status': assessment,
+        'temperature': data.get("temperature", {}).get("current", None),
+        'test_capabilities': test_capabilities,
+    }
+
+    # ATA attributes, in order of ID
+    temperature_attributes = {}
+    for attr in sorted(data.get("ata_smart_attributes", {}).get("table", []), key=lambda a: a["id"]):
+        raw = attr.get("raw", {}).get("string", "")
+        info[f"attribute_raw[{attr['name']}]"] = raw
+        if attr["id"] in (190, 194):
+            m = re.search(r'\d+', raw)
+            if m is not None:
+                temperature_attributes[attr["id"]] = int(m.group())
+
+        when_failed = _get_when_failed(attr)
+        if when_failed == 'In_the_past':
+            info['messages'].append(f"{attr['name']} failed in the past with value {attr.get('worst')}. [Threshold: {attr.get('thresh')}]")
+            if info['smart_status'] != 'FAIL':
+                info['smart_status'] = 'WARN'
+        elif when_failed == 'FAILING_NOW':
+            info['messages'].append(f"{attr['name']} is failing now with value {attr.get('value')}. [Threshold: {attr.get('thresh')}]")
+            info['smart_status'] = 'FAIL'
+        elif when_failed != '-':
+            info['messages'].append(f"{attr['name']} says it failed '{when_failed}'. [V={attr.get('value')},W={attr.get('worst')},T={attr.get('thresh')}]")
+            if info['smart_status'] != 'FAIL':
+                info['smart_status'] = 'WARN'
+
+    # like pySMART, prefer the temperature reported by SMART attributes
+    if 190 in temperature_attributes:
+        info['temperature'] = temperature_attributes[190]
+    elif 194 in temperature_attributes:
+        info['temperature'] = temperature_attributes[194]
+
+    # NVMe health information log
+    health_log = data.get("nvme_smart_health_information_log", None)
+    if health_log is not None:
+        info.update(get_nvme_health_attributes(health_log))
+
+    tests = _get_nvme_tests(data) if is_nvme else _get_ata_tests(data)
+    try:
+        tests = sorted(tests, key=lambda x: int(x['hours']), reverse=True)
+    except (TypeError, ValueError):
+        # keep the order of the self-test log
+        pass
+    for idx, t in enumerate(tests):
+        info[f"test[{idx}]"] = t
+
+    return info
+
+
+def get_nvme_health_attributes(health_log: Dict[str, Any]) -> Dict[str, str]:
+    '''
+    Converts the fields of the NVMe SMART/health information log (named like in the smartctl JSON output)
+    into "attribute_raw[NAME]" keys, whose values are strings, like for ATA attributes
+    '''
+    return {f"attribute_raw[{name}]": str(health_log[key]) for key, name in NVME_HEALTH_ATTRIBUTES if key in health_log}
+
+
+def read_smartctl_json(dev: str, args: List[str], skip_standby: bool = False) -> Dict[str, Any]:
+    '''
+    Runs "smartctl --json" once for the provided device and returns its parsed output.
+    When "skip_standby" is True, smartctl checks the power mode of the device before sending any command
+    that might spin it up (like "smartctl -n standby") and DeviceStandbyError is raised if the device is sleeping.
+    '''
+    if shutil.which("smartctl") is None:
+        raise Exception("smartctl utility is not available")
+
+    cmd = ["smartctl", "--json"]
+    if skip_standby:
+        cmd += ["-n", "standby"]
+    proc = subprocess.run(cmd + args + [dev], capture_output=True)
+    try:
+        data = json.loads(proc.stdout)
+    except ValueError as ex:
+        raise Exception(f"Failed to parse the JSON output of smartctl for device '{dev}': {ex}")
+
+    # smartctl uses non-zero exit codes also to report e.g. failing disks: check only the "fatal" bits
+    exit_status = data.get("smartctl", {}).get("exit_status", proc.returncode)
+    if exit_status & SMARTCTL_FATAL_EXIT_STATUS_MASK:
+        messages = " ".join([m.get("string", "") for m in data.get("smartctl", {}).get("messages", [])])
+        # e.g. "Device is in STANDBY mode, exit(2)"
+        if skip_standby and ("STANDBY" in messages or "SLEEP" in messages):
+            raise DeviceStandbyError(f"Device '{dev}' is in low-power mode: {messages}")
+        raise Exception(f"Failed to read SMART data for device '{dev}': {messages}")
+    return data
+
+
+# bit of the smartctl exit status set also when the device is in a low-power mode; see "man smartctl"
+SMARTCTL_OPEN_FAILED_EXIT_STATUS = 0x02
+
+
+def parse_smartctl_standby(exit_status: int, output: str) -> bool:
+    '''
+    Parses the result of "smartctl -n standby -i": True if the device is in STANDBY or SLEEP mode
+    (e.g. "Device is in STANDBY mode, exit(2)")
+    '''
+    return bool(exit_status & SMARTCTL_OPEN_FAILED_EXIT_STATUS) and ("STANDBY" in output or "SLEEP" in output)
+
+
+def is_device_in_standby(dev: str) -> bool:
+    '''
+    Returns True if the provided device is in STANDBY or SLEEP mode. The check itself never spins up the device.
+    The plain-text output of smartctl is parsed, so that the check works also with smartctl releases older than 7.0
+    (lacking the "--json" option).
+    '''
+    if shutil.which("smartctl") is None:
+        raise Exception("smartctl utility is not available")
+
+    proc = subprocess.run(["smartctl", "-n", "standby", "-i", dev], capture_output=True)
+    return parse_smartctl_standby(proc.returncode, proc.stdout.decode(errors="replace"))
+
+
+def get_smartctl_json_value(dev: str, skip_standby: bool = False) -> Optional[Dict[str, Any]]:
+    '''
+    Reads the SMART data of the provided device using a single smartctl invocation
+    '''
+    return parse_smartctl_json(read_smartctl_json(dev, ["-a"], skip_standby))
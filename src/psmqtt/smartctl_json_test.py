@@ -0,0 +1,114 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import json
+import os
+import unittest
+import pytest
+from pySMART import Device as SmartDevice
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .handlers_pysmart import get_pysmart_value
+from .smartctl_json import (
+    format_capacity,
+    parse_smartctl_json,
+    parse_smartctl_standby,
+)
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata")
+
+
+class FakeSmartctl:
+    '''
+    Replaces the pySMART wrapper of the smartctl utility, replaying the text output of "smartctl -a"
+    '''
+
+    def __init__(self, dev_type: str, text_output: str) -> None:
+        self.dev_type = dev_type
+        self.lines = text_output.splitlines()
+
+    def generic_call(self, params: List[str], pass_options: bool = False) -> Tuple[List[str], int]:
+        if params[:2] == ['-d', 'test']:
+            return ["", "", "", f"{params[2]}: Device of type '{self.dev_type}' [ATA] opened"], 0
+        return self.lines, 0
+
+    def try_generic_call(self, params: List[str], pass_options: bool = False) -> Tuple[List[str], int]:
+        return self.generic_call(params, pass_options)
+
+    def all(self, disk: str, interface: Optional[str] = None) -> List[str]:
+        return self.lines
+
+    def info(self, disk: str, interface: Optional[str] = None) -> List[str]:
+        return self.lines
+
+
+def read_testdata(basename: str) -> str:
+    with open(os.path.join(TESTDATA_DIR, basename), "r") as f:
+        return f.read()
+
+
+@pytest.mark.unit
+class TestSmartctlJson(unittest.TestCase):
+
+    def assert_parity(self, dev: str, dev_type: str, basename: str) -> Dict[str, Any]:
+        pysmart_info = get_pysmart_value(SmartDevice(dev, smartctl=FakeSmartctl(dev_type, read_testdata(basename + ".txt"))))
+        json_info = parse_smartctl_json(json.loads(read_testdata(basename + ".json")))
+
+        # every field published with pySMART must be published, with the same value, from the JSON output of smartctl
+        for key, value in pysmart_info.items():
+            self.assertIn(key, json_info)
+            self.assertEqual(value, json_info[key], key)
+        return json_info
+
+    def test_sata_ssd(self) -> None:
+        info = self.assert_parity("/dev/sda", "sat", "smartctl_sata_ssd")
+        self.assertEqual("500 GB", info["capacity"])
+        self.assertEqual(31, info["temperature"])
+        self.assertEqual("PASS", info["smart_status"])
+        self.assertEqual("21543", info["attribute_raw[Power_On_Hours]"])
+        self.assertEqual("21500", info["test[0]"]["hours"])
+        self.assertEqual("Extended offline", info["test[2]"]["type"])
+
+    def test_nvme(self) -> None:
+        info = self.assert_parity("/dev/nvme0", "nvme", "smartctl_nvme")
+        self.assertEqual("1.00 TB", info["capacity"])
+        self.assertEqual(38, info["temperature"])
+        self.assertEqual(8900, info["test[0]"]["hours"])
+
+        # NVMe health log fields are published only from the JSON output
+        self.assertEqual("2", info["attribute_raw[Percentage_Used]"])
+        self.assertEqual("42", info["attribute_raw[Unsafe_Shutdowns]"])
+        self.assertEqual("3", info["attribute_raw[Error_Information_Log_Entries]"])
+
+    def test_failing_attributes(self) -> None:
+        data = json.loads(read_testdata("smartctl_sata_ssd.json"))
+        attributes = data["ata_smart_attributes"]["table"]
+        attributes[0]["when_failed"] = "past"
+        info = parse_smartctl_json(data)
+        self.assertEqual("WARN", info["smart_status"])
+        self.assertEqual(["Reallocated_Sector_Ct failed in the past with value 100. [Threshold: 10]"], info["messages"])
+
+        attributes[1]["when_failed"] = "now"
+        info = parse_smartctl_json(data)
+        self.assertEqual("FAIL", info["smart_status"])
+        self.assertEqual(2, len(info["messages"]))
+
+    def test_format_capacity(self) -> None:
+        self.assertEqual("512 B", format_capacity(512))
+        self.assertEqual("500 GB", format_capacity(500107862016))
+        self.assertEqual("1.00 TB", format_capacity(1000204886016))
+        self.assertEqual("12.0 TB", format_capacity(12000138625024))
+        self.assertEqual("2.50 MB", format_capacity(2500000))
+
+    def test_parse_smartctl_standby(self) -> None:
+        self.assertTrue(parse_smartctl_standby(2, "smartctl 6.6 2017-11-05\n\nDevice is in STANDBY mode, exit(2)\n"))
+        self.assertTrue(parse_smartctl_standby(2, "Device is in SLEEP mode, exit(2)\n"))
+        # awake device, or device that could not be opened
+        self.assertFalse(parse_smartctl_standby(0, "=== START OF INFORMATION SECTION ===\nDevice Model: TEST\n"))
+        self.assertFalse(parse_smartctl_standby(2, "Smartctl open device: /dev/sdz failed: No such device\n"))
@@ -0,0 +1,213 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import logging
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Tuple,
+)
+
+
+class SnapshotCache:
+    '''
+    SnapshotCache memoizes the output of psutil functions for the duration of a single
+    "sampling pass" (i.e. a single run of PsmqttApp.on_schedule_timer()).
+
+    Many tasks of the same scheduling rule typically read different fields of the same psutil
+    function, e.g. 'virtual_memory' with params [percent], [used], [available], etc.
+    Without this cache each task would invoke psutil.virtual_memory() again; with this cache
+    the psutil function is invoked only once per sampling pass and all tasks read
+    from the same snapshot.
+
+    Entries are keyed by the psutil function and its arguments.
+    A task can optionally accept entries older than the current sampling pass by
+    specifying a "cache_ttl" (in seconds) in the configuration file; see set_max_age().
+
+    Outside a sampling pass (see begin_pass() and end_pass()) and for tasks having no
+    "cache_ttl", the cache is fully transparent: every call() invokes the function.
+
+    Tasks submitted to the worker pool may run after end_pass() has been invoked, or even during the
+    next sampling pass: the pass is captured with hold_pass() when tasks are submitted, the worker
+    thread joins it with enter_pass() and its entries are retained until release_pass().
+    '''
+
+    # all cached values: key -> pass ID -> (timestamp, value)
+    _entries: Dict[Tuple[Hashable, ...], Dict[int, Tuple[float, Any]]] = {}
+
+    # ID of the sampling pass currently running; zero means "no sampling pass is running"
+    _current_pass_id = 0
+    _last_pass_id = 0
+
+    # sampling passes whose entries are still in use: pass ID -> number of holders
+    _open_passes: Dict[int, int] = {}
+
+    # the max "cache_ttl" of all tasks: entries older than this are evicted at each new sampling pass
+    _max_ttl_sec = 0.0
+
+    # the "cache_ttl" of the task currently running and the sampling pass it belongs to, stored per-thread
+    _task_context = threading.local()
+
+    _lock = threading.Lock()
+
+    # one lock per cache key, held while the value of that key is being produced
+    _key_locks: Dict[Tuple[Hashable, ...], threading.Lock] = {}
+
+    # statistics
+    num_hits = 0
+    num_misses = 0
+
+    @staticmethod
+    def register_ttl(ttl_sec: float) -> None:
+        '''
+        Must be called for each task having a non-zero "cache_ttl", to ensure that cache
+        entries are retained for long enough.
+        '''
+        with SnapshotCache._lock:
+            SnapshotCache._max_ttl_sec = max(SnapshotCache._max_ttl_sec, ttl_sec)
+
+    @staticmethod
+    def begin_pass() -> None:
+        '''
+        Marks the beginning of a new sampling pass; all values cached during previous passes
+        are discarded unless some task declared a "cache_ttl" long enough to still use them.
+        '''
+        now = time.time()
+        with SnapshotCache._lock:
+            SnapshotCache._last_pass_id += 1
+            SnapshotCache._current_pass_id = SnapshotCache._last_pass_id
+            SnapshotCache._open_passes[SnapshotCache._current_pass_id] = 1
+            SnapshotCache._evict(now)
+
+    @staticmethod
+    def end_pass() -> None:
+        '''
+        Marks the end of the current sampling pass
+        '''
+        with SnapshotCache._lock:
+            pass_id = SnapshotCache._current_pass_id
+            SnapshotCache._current_pass_id = 0
+        SnapshotCache.release_pass(pass_id)
+
+    @staticmethod
+    def hold_pass() -> int:
+        '''
+        Returns the ID of the sampling pass currently running (zero if none) and retains its entries
+        until release_pass() is invoked with the same ID.
+        '''
+        with SnapshotCache._lock:
+            pass_id = SnapshotCache._current_pass_id
+            if pass_id != 0:
+                SnapshotCache._open_passes[pass_id] += 1
+            return pass_id
+
+    @staticmethod
+    def release_pass(pass_id: int) -> None:
+        '''
+        Releases a sampling pass obtained from hold_pass() or begin_pass()
+        '''
+        if pass_id == 0:
+            return
+        with SnapshotCache._lock:
+            SnapshotCache._open_passes[pass_id] -= 1
+            if SnapshotCache._open_passes[pass_id] == 0:
+                del SnapshotCache._open_passes[pass_id]
+                SnapshotCache._evict(time.time())
+
+    @staticmethod
+    def _evict(now: float) -> None:
+        # keep the entries of passes still in use and those that some task may still accept because of its "cache_ttl";
+        # must be invoked with _lock held
+        max_ttl = SnapshotCache._max_ttl_sec
+        open_passes = SnapshotCache._open_passes
+        entries = {}
+        for key, entries_by_pass in SnapshotCache._entries.items():
+            # of the passes no longer in use, only the most recent value can still be used
+            latest_pass_id = max(entries_by_pass, key=lambda p: entries_by_pass[p][0])
+            entries_by_pass = {p: e for p, e in entries_by_pass.items()
+                               if p in open_passes or (p == latest_pass_id and max_ttl > 0 and now - e[0] <= max_ttl)}
+            if entries_by_pass:
+                entries[key] = entries_by_pass
+        SnapshotCache._entries = entries
+        SnapshotCache._key_locks = {k: lock for k, lock in SnapshotCache._key_locks.items()
+                                    if k in SnapshotCache._entries or lock.locked()}
+
+    @staticmethod
+    def enter_pass(pass_id: int) -> None:
+        '''
+        Makes the next call() invocations from the calling thread use the entries of the provided
+        sampling pass (obtained from hold_pass()), regardless of the sampling pass currently running.
+        '''
+        SnapshotCache._task_context.pass_id = pass_id
+
+    @staticmethod
+    def leave_pass() -> None:
+        '''
+        Reverts enter_pass() for the calling thread
+        '''
+        SnapshotCache._task_context.pass_id = None
+
+    @staticmethod
+    def set_max_age(ttl_sec: float) -> None:
+        '''
+        Sets the "cache_ttl" of the task about to run in the calling thread:
+        the next call() invocations from the same thread will accept values that have been cached
+        up to "ttl_sec" seconds ago, even if they were cached in a previous sampling pass.
+        '''
+        SnapshotCache._task_context.max_age_sec = ttl_sec
+
+    @staticmethod
+    def call(func: Callable[..., Any], *args: Hashable, **kwargs: Hashable) -> Any:
+        '''
+        Invokes func(*args, **kwargs) or returns the value that was cached for the same
+        function and arguments in the current sampling pass.
+        All arguments must be hashable.
+        '''
+        pass_id = getattr(SnapshotCache._task_context, "pass_id", None)
+        if pass_id is None:
+            pass_id = SnapshotCache._current_pass_id
+        max_age_sec = getattr(SnapshotCache._task_context, "max_age_sec", 0)
+        if pass_id == 0 and max_age_sec == 0:
+            # cache disabled
+            return func(*args, **kwargs)
+
+        key = (func, args, tuple(sorted(kwargs.items())))
+        with SnapshotCache._lock:
+            key_lock = SnapshotCache._key_locks.setdefault(key, threading.Lock())
+
+        # concurrent callers (e.g. worker threads) wait for the first one to produce the value instead of
+        # invoking the same function at the same time:
+        with key_lock:
+            now = time.time()
+            with SnapshotCache._lock:
+                entries_by_pass = SnapshotCache._entries.get(key, {})
+                entry = entries_by_pass.get(pass_id, None) if pass_id != 0 else None
+                if entry is None and max_age_sec > 0 and entries_by_pass:
+                    # the most recent value, if not too old for the calling task
+                    entry = max(entries_by_pass.values(), key=lambda e: e[0])
+                    if now - entry[0] > max_age_sec:
+                        entry = None
+                if entry is not None:
+                    SnapshotCache.num_hits += 1
+                    return entry[1]
+                SnapshotCache.num_misses += 1
+
+            value = func(*args, **kwargs)
+            with SnapshotCache._lock:
+                if pass_id in SnapshotCache._open_passes or SnapshotCache._max_ttl_sec > 0:
+                    SnapshotCache._entries.setdefault(key, {})[pass_id] = (now, value)
+            logging.debug("SnapshotCache: cached new value for %s%s", getattr(func, "__name__", func), args)
+            return value
+
+    @staticmethod
+    def clear() -> None:
+        '''
+        Drops all cached values
+        '''
+        with SnapshotCache._lock:
+            SnapshotCache._entries = {}
+            SnapshotCache._key_locks = {}
@@ -0,0 +1,141 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import time
+import pytest
+
+from .snapshot_cache import SnapshotCache
+from .handlers_base import TupleCommandHandler
+
+fake_task_id = "0.0"
+
+
+class CountingFunction:
+    def __init__(self):
+        self.num_calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.num_calls += 1
+        return self.num_calls
+
+
+@pytest.mark.unit
+class TestSnapshotCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        SnapshotCache.clear()
+        SnapshotCache.set_max_age(0)
+        SnapshotCache._max_ttl_sec = 0
+
+    def test_no_caching_outside_pass(self) -> None:
+        f = CountingFunction()
+        self.assertEqual(1, SnapshotCache.call(f))
+        self.assertEqual(2, SnapshotCache.call(f))
+
+    def test_caching_within_pass(self) -> None:
+        f = CountingFunction()
+        SnapshotCache.begin_pass()
+        try:
+            self.assertEqual(1, SnapshotCache.call(f))
+            self.assertEqual(1, SnapshotCache.call(f))
+
+            # different arguments produce a different cache entry:
+            self.assertEqual(2, SnapshotCache.call(f, perdisk=True))
+            self.assertEqual(2, SnapshotCache.call(f, perdisk=True))
+            self.assertEqual(1, SnapshotCache.call(f))
+        finally:
+            SnapshotCache.end_pass()
+
+        # a new pass invalidates the previous values:
+        SnapshotCache.begin_pass()
+        try:
+            self.assertEqual(3, SnapshotCache.call(f))
+        finally:
+            SnapshotCache.end_pass()
+
+    def test_ttl_across_passes(self) -> None:
+        f = CountingFunction()
+        SnapshotCache.register_ttl(60)
+
+        SnapshotCache.begin_pass()
+        self.assertEqual(1, SnapshotCache.call(f))
+        SnapshotCache.end_pass()
+
+        SnapshotCache.begin_pass()
+        # a task with a TTL will accept the value cached in the previous pass
+        SnapshotCache.set_max_age(60)
+        self.assertEqual(1, SnapshotCache.call(f))
+        # a task without TTL will not
+        SnapshotCache.set_max_age(0)
+        self.assertEqual(2, SnapshotCache.call(f))
+        SnapshotCache.end_pass()
+
+        time.sleep(0.1)
+        SnapshotCache.begin_pass()
+        SnapshotCache.set_max_age(0.05)
+        self.assertEqual(3, SnapshotCache.call(f))
+        SnapshotCache.set_max_age(0)
+        SnapshotCache.end_pass()
+
+    def test_handlers_share_snapshot(self) -> None:
+        # two tasks reading different fields of virtual_memory must read the same snapshot
+        handler = TupleCommandHandler('virtual_memory')
+        SnapshotCache.begin_pass()
+        try:
+            misses_before = SnapshotCache.num_misses
+            vm1 = handler.handle(['*'], fake_task_id)
+            vm2 = handler.handle(['used'], fake_task_id)
+            self.assertEqual(vm1['used'], vm2)
+            self.assertEqual(misses_before + 1, SnapshotCache.num_misses)
+        finally:
+            SnapshotCache.end_pass()
+
+    def test_held_pass(self) -> None:
+        # tasks submitted to the worker pool keep using the pass they were submitted in
+        f = CountingFunction()
+        SnapshotCache.begin_pass()
+        self.assertEqual(1, SnapshotCache.call(f))
+        pass_id = SnapshotCache.hold_pass()
+        SnapshotCache.end_pass()
+
+        SnapshotCache.begin_pass()
+        try:
+            self.assertEqual(2, SnapshotCache.call(f))
+            SnapshotCache.enter_pass(pass_id)
+            try:
+                self.assertEqual(1, SnapshotCache.call(f))
+            finally:
+                SnapshotCache.leave_pass()
+            self.assertEqual(2, SnapshotCache.call(f))
+        finally:
+            SnapshotCache.end_pass()
+
+        # once released, the entries of the pass are dropped
+        SnapshotCache.release_pass(pass_id)
+        SnapshotCache.enter_pass(pass_id)
+        try:
+            self.assertEqual(3, SnapshotCache.call(f))
+            self.assertEqual(4, SnapshotCache.call(f))
+        finally:
+            SnapshotCache.leave_pass()
+        self.assertEqual({}, SnapshotCache._entries)
+
+    def test_concurrent_calls(self) -> None:
+        # concurrent callers of the same pass share a single invocation
+        num_calls = []
+
+        def slow_function() -> int:
+            num_calls.append(1)
+            time.sleep(0.1)
+            return len(num_calls)
+
+        SnapshotCache.begin_pass()
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(lambda _: SnapshotCache.call(slow_function), range(4)))
+        finally:
+            SnapshotCache.end_pass()
+        self.assertEqual([1] * 4, results)
+        self.assertEqual(1, len(num_calls))
@@ -6,19 +6,31 @@ import json
 import logging
 import hashlib
 import psutil
-from typing import Any, List, Dict
+import time
+from typing import Any, List, Dict, NamedTuple, Optional, Tuple
 
 from .handlers_base import TaskParam
 from .topic import Topic
 from .mqtt_client import MqttClient
 from .formatter import Formatter
+from .snapshot_cache import SnapshotCache
 
-from .handlers_base import Payload, TupleCommandHandler, ValueCommandHandler, IndexCommandHandler, IndexOrTotalCommandHandler, IndexTupleCommandHandler, IndexOrTotalTupleCommandHandler
-from .handlers_psutil_processes import ProcessesCommandHandler
+from .handlers_base import Payload, PendingValueError, TupleCommandHandler, ValueCommandHandler, IndexCommandHandler, IndexOrTotalCommandHandler, IndexTupleCommandHandler, IndexOrTotalTupleCommandHandler
+from .handlers_psutil_processes import ProcessesCommandHandler, ProcessGroupsCommandHandler, ProcessEventsCommandHandler
 from .handlers_psutil import DiskIOCountersCommandHandler, DiskIOCountersRateHandler, DiskUsageCommandHandler, NetIOCountersCommandHandler, NetIOCountersRateHandler, SensorsFansCommandHandler, SensorsTemperaturesCommandHandler, GetLoadAvgCommandHandler
 from .handlers_pysmart import SmartCommandHandler
 from .handlers_embedded import DirectoryUsageCommandHandler
 
+class TaskResult(NamedTuple):
+    '''
+    The outcome of a task execution: either a payload or the exception raised by the task handler
+    '''
+    payload: Optional[Payload]
+    error: Optional[Exception]
+    # the age (in seconds) of the payload, for tasks whose handler computes values in background
+    age: Optional[float] = None
+
+
 class Task:
     '''
     Defines a psmqtt task, whose main properties are:
@@ -27,6 +39,8 @@ class Task:
      * "topic" and
      * "formatter"
      * "ha_discovery"
+     * "cache_ttl"
+     * "publish_on_change"
     fields.
     '''
 
@@ -48,7 +62,7 @@ class Task:
             (IndexOrTotalCommandHandler, object),
             {
                 "get_value": lambda self, total:
-                    psutil.cpu_percent(percpu=not total)
+                    SnapshotCache.call(psutil.cpu_percent, percpu=not total)
             })('cpu_percent'),
 
         'cpu_times_percent': type(
@@ -56,7 +70,7 @@ class Task:
             (IndexOrTotalTupleCommandHandler, object),
             {
                 "get_value": lambda self, total:
-                    psutil.cpu_times_percent(percpu=not total)
+                    SnapshotCache.call(psutil.cpu_times_percent, percpu=not total)
             })('cpu_times_percent'),
 
         'cpu_stats': TupleCommandHandler('cpu_stats'),
@@ -85,6 +99,8 @@ class Task:
         # PROCESSES
 
         'processes': ProcessesCommandHandler(),
+        'process_groups': ProcessGroupsCommandHandler(),
+        'process_events': ProcessEventsCommandHandler(),
 
         # OTHERS
 
@@ -107,13 +123,28 @@ class Task:
             ha_discovery:Dict[str,Any],
             mqtt_topic_prefix:str,
             parent_schedule_rule_idx:int,
-            task_idx:int) -> None:
+            task_idx:int,
+            cache_ttl:float = 0,
+            publish_on_change:Optional[Dict[str, float]] = None) -> None:
         self.task_name = name
         self.params = params
         self.topic_name = mqtt_topic
         self.formatter = Formatter(formatter_str) if formatter_str is not None and formatter_str != '' else None
         self.ha_discovery = ha_discovery
 
+        # max age (in seconds) of psutil values cached by previous tasks that this task can reuse;
+        # zero means that only values sampled in the current sampling pass can be reused
+        self.cache_ttl = cache_ttl
+        if self.cache_ttl > 0:
+            SnapshotCache.register_ttl(self.cache_ttl)
+
+        # when set, values are published only when they change beyond the "deadband_abs"/"deadband_rel" thresholds,
+        # or when nothing was published for "max_silence_sec" seconds; see _filter_unchanged()
+        self.publish_on_change = publish_on_change
+        # MQTT topic -> last payload published on that topic, and when it was published
+        self.last_published: Dict[str, Tuple[str, float]] = {}
+        self.last_published_connection_id = MqttClient.CONN_ID_INVALID
+
         self.parent_schedule_rule_idx = parent_schedule_rule_idx
         self.task_friendly_name = f"schedule{parent_schedule_rule_idx}.task{task_idx}.{name}"
         self.task_id = f"{parent_schedule_rule_idx}.{task_idx}"
@@ -142,6 +173,9 @@ class Task:
                     # so that the Topic class knows that it's actually a multi-topic
                     continue
                 else:
+                    if x.endswith(']+'):
+                        # same for the join wildcard of process selectors like "name[PATTERN]+"
+                        x = x[:-1]
                     escapedParams.append(x.replace('/', '|'))
             elif isinstance(x,int):
                 escapedParams.append(str(x))
@@ -164,6 +198,38 @@ class Task:
         #else:
         return json.dumps(v)
 
+    @staticmethod
+    def configure_handlers(options: Dict[str, Any]) -> None:
+        '''
+        Applies the "options" section of the configuration file to all handlers
+        '''
+        for h in Task.handlers.values():
+            h.configure(options)
+
+    @staticmethod
+    def shutdown_handlers() -> None:
+        '''
+        Stops all handlers, see BaseHandler.shutdown()
+        '''
+        for h in Task.handlers.values():
+            try:
+                h.shutdown()
+            except Exception as ex:
+                logging.exception(f"Failed to shut down handler {h.name}: {ex}")
+
+    @staticmethod
+    def prefetch_handlers(tasks: List['Task']) -> None:
+        '''
+        Notifies each handler about the tasks that are about to run, see BaseHandler.prefetch().
+        Handlers not used by any of the tasks are notified with an empty list, so that they drop
+        whatever they prepared for a previous sampling pass.
+        '''
+        params_by_handler: Dict[str, List[List[str]]] = {name: [] for name in Task.handlers}
+        for t in tasks:
+            params_by_handler.setdefault(t.task_name, []).append(t.params)
+        for name, params_list in params_by_handler.items():
+            Task.handlers[name].prefetch(params_list)
+
     @staticmethod
     def get_supported_handlers() -> List[str]:
         '''
@@ -182,26 +248,54 @@ class Task:
             Task.num_errors += 1
             return
 
+        self.publish_result(mqttc, self.get_result())
+        return
+
+    def get_result(self) -> TaskResult:
+        '''
+        Runs the handler associated with this task and captures either its payload or the exception it raised.
+        This function does not interact with the MQTT client and can thus be invoked from worker threads.
+        '''
         try:
             payload = self.get_payload()
+            return TaskResult(payload, None, Task.handlers[self.task_name].get_value_age(self.params))
+        except Exception as ex:
+            return TaskResult(None, ex)
+
+    def publish_result(self, mqttc: MqttClient, result: TaskResult) -> None:
+        '''
+        Publishes the result of this task, obtained from get_result(), on the provided MQTT client
+        '''
+        if isinstance(result.error, PendingValueError):
+            logging.info(f"Task.run_task({self.task_friendly_name}): no value available yet: {result.error}")
+            return
+
+        try:
+            if result.error is not None:
+                raise result.error
+            payload = result.payload
             is_seq = isinstance(payload, list) or isinstance(payload, dict)
             if is_seq and not self.topic.is_multitopic():
                 raise Exception(f"Result of task '{self.task_friendly_name}' has several values but topic doesn't contain the wildcard '*' character. Please include the wildcard in the topic specification.")
             if not is_seq and self.topic.is_multitopic():
                 raise Exception(f"Result of task '{self.task_friendly_name}' has a single value but the topic contains the wildcard '*' character. Please remove the wildcard from the topic specification.")
 
+            # all the messages of the task are sent as a single batch
+            messages: List[Tuple[str, str]]
             if isinstance(payload, list):
-                for i, v in enumerate(payload):
-                    subtopic = self.topic.get_subtopic(str(i))
-                    mqttc.publish(subtopic, Task._payload_as_string(v))
-
+                messages = [(self.topic.get_subtopic(str(i)), Task._payload_as_string(v)) for i, v in enumerate(payload)]
             elif isinstance(payload, dict):
-                for key in payload:
-                    subtopic = self.topic.get_subtopic(str(key))
-                    v = payload[key]
-                    mqttc.publish(subtopic, Task._payload_as_string(v))
+                messages = [(self.topic.get_subtopic(str(key)), Task._payload_as_string(v)) for key, v in payload.items()]
             else:
-                mqttc.publish(self.topic.get_topic(), Task._payload_as_string(payload))
+                messages = [(self.topic.get_topic(), Task._payload_as_string(payload))]
+
+            if self.publish_on_change is not None:
+                messages = self._filter_unchanged(messages, mqttc.get_connection_id())
+
+            # the age is published together with the values it refers to
+            if result.age is not None and messages:
+                messages.append((self.topic.get_age_topic(), str(int(result.age))))
+            mqttc.publish_many(messages)
 
         except Exception as ex:
             mqttc.publish(self.topic.get_error_topic(), str(ex))
@@ -211,6 +305,58 @@ class Task:
         Task.num_success += 1
         return
 
+    def _filter_unchanged(self, messages: List[Tuple[str, str]], connection_id: int) -> List[Tuple[str, str]]:
+        '''
+        Implements "publish_on_change": drops the messages whose payload did not change since it was last published
+        on the same topic (see _is_changed()), unless that happened more than "max_silence_sec" seconds ago.
+        Each subtopic of multi-valued tasks is tracked separately.
+        The state is reset at each new connection to the MQTT broker, so that all values are published again.
+        '''
+        assert self.publish_on_change is not None
+        if connection_id != self.last_published_connection_id:
+            self.reset_last_published()
+            self.last_published_connection_id = connection_id
+
+        now = time.monotonic()
+        max_silence_sec = self.publish_on_change["max_silence_sec"]
+        changed = []
+        for topic, payload in messages:
+            last = self.last_published.get(topic, None)
+            if last is None or self._is_changed(payload, last[0]) or (max_silence_sec > 0 and now - last[1] >= max_silence_sec):
+                self.last_published[topic] = (payload, now)
+                changed.append((topic, payload))
+        return changed
+
+    def _is_changed(self, payload: str, last_payload: str) -> bool:
+        '''
+        Numeric payloads are considered changed only if they differ from the last published one by more than
+        "deadband_abs" and by more than "deadband_rel" times the last published value; other payloads if they differ at all
+        '''
+        assert self.publish_on_change is not None
+        if payload == last_payload:
+            return False
+        try:
+            value = float(payload)
+            last_value = float(last_payload)
+        except ValueError:
+            return True
+        delta = abs(value - last_value)
+        return delta > self.publish_on_change["deadband_abs"] and delta > self.publish_on_change["deadband_rel"] * abs(last_value)
+
+    def reset_last_published(self) -> None:
+        '''
+        Makes the next execution of a "publish_on_change" task publish all its values, even if unchanged
+        '''
+        self.last_published.clear()
+
+    def is_blocking(self) -> bool:
+        '''
+        Returns true if the handler of this task is known to block for long periods of time
+        (e.g. because it forks external utilities or walks large directory trees)
+        '''
+        handler = Task.handlers.get(self.task_name, None)
+        return handler is not None and handler.is_blocking
+
     def get_payload(self) -> Payload:
         '''
         Invokes the handler associated with this task (the task name defines the handler to be invoked);
@@ -223,7 +369,11 @@ class Task:
 
         # invoke the handler to read the sensor values
         handler = Task.handlers[self.task_name]
-        value = handler.handle(self.params, self.task_id)
+        SnapshotCache.set_max_age(self.cache_ttl)
+        try:
+            value = handler.handle(self.params, self.task_id)
+        finally:
+            SnapshotCache.set_max_age(0)
 
         # if we get here, the sensor reading was successful
         if logging.getLogger().isEnabledFor(logging.DEBUG):
@@ -295,6 +445,11 @@ class Task:
             if o in self.ha_discovery and self.ha_discovery[o]:
                 msg[o] = self.ha_discovery[o]
 
+        if self.publish_on_change is not None:
+            # unchanged values are published again only every "max_silence_sec" seconds (or never)
+            max_silence_sec = self.publish_on_change["max_silence_sec"]
+            default_expire_after = max(default_expire_after or 0, int(max_silence_sec * 1.5)) if max_silence_sec > 0 else None
+
         # expire_after is populated with user preference or a meaningful default value:
         if self.ha_discovery["expire_after"]:
             msg["expire_after"] = self.ha_discovery["expire_after"]
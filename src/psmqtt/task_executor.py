@@ -0,0 +1,143 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from .mqtt_client import MqttClient
+from .snapshot_cache import SnapshotCache
+from .task import Task, TaskResult
+
+
+class TaskBatch:
+    '''
+    A group of tasks submitted together to the TaskExecutor.
+    Tasks are executed concurrently but their results are published in the same order
+    of the task list.
+    Tasks run within the sampling pass that was running when the batch was submitted, see SnapshotCache.hold_pass().
+    '''
+
+    def __init__(self, tasks: List[Task], pass_id: int = 0) -> None:
+        self.tasks = tasks
+        self.pass_id = pass_id
+        self.results: List[Optional[TaskResult]] = [None] * len(tasks)
+        self.num_published = 0
+
+        # indexes of the tasks that still need to be picked up by a worker
+        self.todo: queue.SimpleQueue = queue.SimpleQueue()
+        for idx in range(len(tasks)):
+            self.todo.put(idx)
+
+    def is_fully_published(self) -> bool:
+        return self.num_published == len(self.tasks)
+
+
+class TaskExecutor:
+    '''
+    TaskExecutor runs tasks on a bounded pool of worker threads, so that slow tasks
+    (e.g. "smart" or "directory_usage") do not delay the tasks that run in the main thread.
+
+    Task results are collected by the worker threads, but they are published
+    only from the main thread, invoking publish_completed_results(), in a deterministic order.
+    '''
+
+    def __init__(self, num_workers: int) -> None:
+        self.num_workers = num_workers
+        self.pool = None
+        if num_workers > 0:
+            self.pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="psmqtt-worker")
+            logging.info(f"TaskExecutor: started a pool of {num_workers} worker threads")
+
+        # batches having results not yet published, in order of submission
+        self.batches: List[TaskBatch] = []
+
+        # IDs of tasks that have been submitted and whose result has not been published yet
+        self.tasks_in_flight: set[str] = set()
+        self.lock = threading.Lock()
+        return
+
+    def is_enabled(self) -> bool:
+        return self.pool is not None
+
+    def submit(self, tasks: List[Task], max_concurrency: int) -> int:
+        '''
+        Submits the provided tasks to the worker pool; at most "max_concurrency" tasks of this
+        list will be executed at the same time (zero means: as many as the worker threads).
+        Tasks whose previous execution is still in flight are skipped.
+        Returns the number of tasks that were actually submitted.
+        '''
+        assert self.pool is not None
+
+        tasks_to_submit = []
+        for t in tasks:
+            if t.task_id in self.tasks_in_flight:
+                logging.warning(f"TaskExecutor: skipping task {t.task_friendly_name}: its previous execution has not completed yet")
+                continue
+            tasks_to_submit.append(t)
+            self.tasks_in_flight.add(t.task_id)
+        if not tasks_to_submit:
+            return 0
+
+        batch = TaskBatch(tasks_to_submit, SnapshotCache.hold_pass())
+        with self.lock:
+            self.batches.append(batch)
+
+        # each worker job drains the batch queue, so that the number of jobs is the concurrency limit:
+        num_jobs = len(tasks_to_submit)
+        if max_concurrency > 0:
+            num_jobs = min(num_jobs, max_concurrency)
+        for _ in range(num_jobs):
+            self.pool.submit(TaskExecutor._worker_job, batch)
+        return len(tasks_to_submit)
+
+    @staticmethod
+    def _worker_job(batch: TaskBatch) -> None:
+        SnapshotCache.enter_pass(batch.pass_id)
+        try:
+            while True:
+                try:
+                    idx = batch.todo.get_nowait()
+                except queue.Empty:
+                    return
+                # Task.get_result() never raises
+                batch.results[idx] = batch.tasks[idx].get_result()
+        finally:
+            SnapshotCache.leave_pass()
+
+    def publish_completed_results(self, mqttc: MqttClient) -> int:
+        '''
+        Publishes the results of all tasks completed so far.
+        Within each batch, results are published in the same order of the tasks of the batch:
+        a completed task is published only once all tasks preceding it in the batch are published.
+        This function must be invoked from the main thread.
+        Returns the number of task results published.
+        '''
+        num_published = 0
+        with self.lock:
+            batches = list(self.batches)
+
+        for batch in batches:
+            while not batch.is_fully_published():
+                result = batch.results[batch.num_published]
+                if result is None:
+                    # still running
+                    break
+                task = batch.tasks[batch.num_published]
+                task.publish_result(mqttc, result)
+                self.tasks_in_flight.discard(task.task_id)
+                batch.num_published += 1
+                num_published += 1
+            if batch.is_fully_published():
+                SnapshotCache.release_pass(batch.pass_id)
+
+        with self.lock:
+            self.batches = [b for b in self.batches if not b.is_fully_published()]
+        return num_published
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
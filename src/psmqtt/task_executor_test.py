@@ -0,0 +1,151 @@
+# Copyright (c) 2016 psmqtt project
+# Licensed under the MIT License.  See LICENSE file in the project root for full license information.
+
+import unittest
+import time
+import pytest
+
+from .handlers_base import BaseHandler, Payload
+from .snapshot_cache import SnapshotCache
+from .task import Task
+from .task_executor import TaskExecutor
+
+
+class SleepingTestHandler(BaseHandler):
+    '''
+    Returns its only parameter after sleeping the number of seconds indicated by the parameter
+    '''
+    is_blocking = True
+
+    def __init__(self):
+        super().__init__('test_sleep')
+
+    def handle(self, params: list[str], caller_task_id: str) -> Payload:
+        time.sleep(float(params[0]))
+        return params[0]
+
+
+class SamplingTestHandler(BaseHandler):
+    '''
+    Returns the number of times the sampling function has been invoked, through the SnapshotCache
+    '''
+    is_blocking = True
+
+    def __init__(self):
+        super().__init__('test_sample')
+        self.num_samples = 0
+
+    def sample(self) -> int:
+        time.sleep(0.05)
+        self.num_samples += 1
+        return self.num_samples
+
+    def handle(self, params: list[str], caller_task_id: str) -> Payload:
+        return SnapshotCache.call(self.sample)
+
+
+class FakeMqttClient:
+    def __init__(self):
+        self.published = []
+
+    def is_connected(self) -> bool:
+        return True
+
+    def publish(self, topic: str, payload: str) -> None:
+        self.published.append((topic, payload))
+
+    def publish_many(self, messages) -> int:
+        messages = list(messages)
+        self.published.extend(messages)
+        return len(messages)
+
+
+@pytest.mark.unit
+class TestTaskExecutor(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Task.handlers['test_sleep'] = SleepingTestHandler()
+
+    def tearDown(self) -> None:
+        del Task.handlers['test_sleep']
+
+    def _make_task(self, idx: int, sleep_sec: str) -> Task:
+        return Task('test_sleep', [sleep_sec], f"task{idx}", "", None, "prefix/", 0, idx)
+
+    def _wait_all_published(self, executor: TaskExecutor, mqttc: FakeMqttClient, num_expected: int) -> None:
+        deadline = time.time() + 5
+        num_published = 0
+        while num_published < num_expected and time.time() < deadline:
+            num_published += executor.publish_completed_results(mqttc)
+            time.sleep(0.01)
+        self.assertEqual(num_expected, num_published)
+
+    def test_results_published_in_order(self) -> None:
+        executor = TaskExecutor(3)
+        mqttc = FakeMqttClient()
+        tasks = [self._make_task(0, "0.3"), self._make_task(1, "0"), self._make_task(2, "0.1")]
+
+        start = time.time()
+        self.assertEqual(3, executor.submit(tasks, 0))
+        # submission must not block the caller
+        self.assertLess(time.time() - start, 0.1)
+
+        # the fast tasks complete first but they cannot be published before the slow one
+        time.sleep(0.15)
+        self.assertEqual(0, executor.publish_completed_results(mqttc))
+
+        self._wait_all_published(executor, mqttc, 3)
+        self.assertEqual(["prefix/task0", "prefix/task1", "prefix/task2"], [t for t, _ in mqttc.published])
+        executor.shutdown()
+
+    def test_max_concurrency(self) -> None:
+        executor = TaskExecutor(4)
+        mqttc = FakeMqttClient()
+        tasks = [self._make_task(i, "0.1") for i in range(4)]
+
+        start = time.time()
+        executor.submit(tasks, 1)
+        self._wait_all_published(executor, mqttc, 4)
+
+        # with a concurrency limit of 1, the 4 tasks run one after the other
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        executor.shutdown()
+
+    def test_skip_tasks_in_flight(self) -> None:
+        executor = TaskExecutor(2)
+        mqttc = FakeMqttClient()
+        slow_task = self._make_task(0, "0.2")
+
+        self.assertEqual(1, executor.submit([slow_task], 0))
+        # the same task cannot be submitted again while its previous execution is in flight
+        self.assertEqual(0, executor.submit([slow_task], 0))
+
+        self._wait_all_published(executor, mqttc, 1)
+        self.assertEqual(1, executor.submit([slow_task], 0))
+        self._wait_all_published(executor, mqttc, 1)
+        executor.shutdown()
+
+    def test_tasks_share_submission_pass(self) -> None:
+        handler = SamplingTestHandler()
+        Task.handlers['test_sample'] = handler
+        executor = TaskExecutor(4)
+        mqttc = FakeMqttClient()
+        tasks = [Task('test_sample', [], f"sample{i}", "", None, "prefix/", 0, i) for i in range(4)]
+        try:
+            SnapshotCache.begin_pass()
+            try:
+                self.assertEqual(1, SnapshotCache.call(handler.sample))
+                executor.submit(tasks, 0)
+            finally:
+                SnapshotCache.end_pass()
+            # the workers run after the end of the pass, even during the next one, and reuse its value
+            SnapshotCache.begin_pass()
+            try:
+                self._wait_all_published(executor, mqttc, 4)
+            finally:
+                SnapshotCache.end_pass()
+            self.assertEqual(["1"] * 4, [v for _, v in mqttc.published])
+            self.assertEqual(1, handler.num_samples)
+        finally:
+            executor.shutdown()
+            del Task.handlers['test_sample']
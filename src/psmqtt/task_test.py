@@ -1,10 +1,29 @@
 # Copyright (c) 2016 psmqtt project
 # Licensed under the MIT License.  See LICENSE file in the project root for full license information.
 
+import json
 import unittest
+from unittest import mock
 import pytest
 
-from .task import Task
+from .task import Task, TaskResult
+
+
+class BatchingMqttClient:
+    def __init__(self):
+        self.batches = []
+        self.connection_id = 1
+
+    def get_connection_id(self) -> int:
+        return self.connection_id
+
+    def publish(self, topic: str, payload: str) -> None:
+        self.batches.append([(topic, payload)])
+
+    def publish_many(self, messages) -> int:
+        self.batches.append(list(messages))
+        return len(self.batches[-1])
+
 
 @pytest.mark.unit
 class TestTask(unittest.TestCase):
@@ -76,6 +95,12 @@ class TestTask(unittest.TestCase):
                 "input_task": {"task": "no_prefix_task", "params": ["param1", "/", "param/2", ""]},
                 "expected_topic_name": "no_prefix_task/param1/|/param|2"
             },
+            # with process selectors:
+            {
+                "prefix": "",
+                "input_task": {"task": "processes", "params": ["cmdline[*psmqtt*]+", "cpu_percent"]},
+                "expected_topic_name": "processes/cmdline[*psmqtt*]/cpu_percent"
+            },
 
         ]
 
@@ -91,6 +116,88 @@ class TestTask(unittest.TestCase):
             topic = task._topic_from_task(t["prefix"])
             self.assertEqual(topic.get_topic(), t["expected_topic_name"])
 
+    def test_publish_result(self):
+        task = Task('cpu_percent', ['*'], "", "", {}, "prefix/", 0, 0)
+        mqttc = BatchingMqttClient()
+        # all subtopics and the age of the value are published in a single batch
+        task.publish_result(mqttc, TaskResult([1.5, 2.5], None, 3.2))  # type: ignore
+        self.assertEqual([[("prefix/cpu_percent/0", "1.5"), ("prefix/cpu_percent/1", "2.5"), ("prefix/cpu_percent/*/age", "3")]],
+                         mqttc.batches)
+
+        mqttc = BatchingMqttClient()
+        task = Task('cpu_percent', [], "", "", {}, "prefix/", 0, 0)
+        task.publish_result(mqttc, TaskResult(None, Exception("failure")))  # type: ignore
+        self.assertEqual([[("prefix/cpu_percent/error", "failure")]], mqttc.batches)
+
+    def test_publish_on_change(self):
+        task = Task('cpu_percent', ['*'], "", "", {}, "prefix/", 0, 0,
+                    publish_on_change={"deadband_abs": 1, "deadband_rel": 0, "max_silence_sec": 60})
+        mqttc = BatchingMqttClient()
+        with mock.patch("time.monotonic", return_value=1000.0):
+            task.publish_result(mqttc, TaskResult([10.0, "a"], None, 5))  # type: ignore
+            # changes within the deadband are not published, the age is published only together with some value
+            task.publish_result(mqttc, TaskResult([10.5, "a"], None, 6))  # type: ignore
+            task.publish_result(mqttc, TaskResult([9.5, "b"], None, 7))  # type: ignore
+            # the deadband is relative to the last published value
+            task.publish_result(mqttc, TaskResult([11.5, "b"], None, 8))  # type: ignore
+        self.assertEqual([
+            [("prefix/cpu_percent/0", "10.0"), ("prefix/cpu_percent/1", "a"), ("prefix/cpu_percent/*/age", "5")],
+            [],
+            [("prefix/cpu_percent/1", "b"), ("prefix/cpu_percent/*/age", "7")],
+            [("prefix/cpu_percent/0", "11.5"), ("prefix/cpu_percent/*/age", "8")],
+        ], mqttc.batches)
+
+        # unchanged values are published again after "max_silence_sec" seconds and after reconnecting to the broker
+        mqttc.batches = []
+        with mock.patch("time.monotonic", return_value=1059.0):
+            task.publish_result(mqttc, TaskResult([11.5, "b"], None))  # type: ignore
+        with mock.patch("time.monotonic", return_value=1060.0):
+            task.publish_result(mqttc, TaskResult([11.5, "b"], None))  # type: ignore
+            task.publish_result(mqttc, TaskResult([11.5, "b"], None))  # type: ignore
+            mqttc.connection_id = 2
+            task.publish_result(mqttc, TaskResult([11.5, "b"], None))  # type: ignore
+        self.assertEqual([
+            [],
+            [("prefix/cpu_percent/0", "11.5"), ("prefix/cpu_percent/1", "b")],
+            [],
+            [("prefix/cpu_percent/0", "11.5"), ("prefix/cpu_percent/1", "b")],
+        ], mqttc.batches)
+
+        # relative deadband
+        task = Task('cpu_percent', [], "", "", {}, "prefix/", 0, 0,
+                    publish_on_change={"deadband_abs": 0, "deadband_rel": 0.1, "max_silence_sec": 0})
+        mqttc = BatchingMqttClient()
+        for value in [100, 109, 111, 111, 90]:
+            task.publish_result(mqttc, TaskResult(value, None))  # type: ignore
+        self.assertEqual([[("prefix/cpu_percent", "100")], [], [("prefix/cpu_percent", "111")], [], [("prefix/cpu_percent", "90")]],
+                         mqttc.batches)
+
+    def test_publish_on_change_ha_expire_after(self):
+        ha_discovery = {"name": "CPU", "platform": "sensor", "expire_after": None}
+        task = Task('cpu_percent', [], "", "", ha_discovery, "prefix/", 0, 0,
+                    publish_on_change={"deadband_abs": 0, "deadband_rel": 0, "max_silence_sec": 600})
+        self.assertEqual(900, json.loads(task.get_ha_discovery_payload("dev", "1.0", {}, 15))["expire_after"])
+        # unchanged values are never published again: HA must not expire the sensor
+        task.publish_on_change = {"deadband_abs": 0, "deadband_rel": 0, "max_silence_sec": 0}
+        self.assertNotIn("expire_after", json.loads(task.get_ha_discovery_payload("dev", "1.0", {}, 15)))
+        # user preference
+        ha_discovery["expire_after"] = 60
+        self.assertEqual(60, json.loads(task.get_ha_discovery_payload("dev", "1.0", {}, 15))["expire_after"])
+
+    def test_prefetch_handlers(self):
+        registry = Task.handlers['processes'].registry
+        groups_task = Task('process_groups', ['name[*]', 'threads'], "", "", None, "prefix/", 0, 0)
+        processes_task = Task('processes', ['top_cpu', 'pid'], "", "", None, "prefix/", 0, 1)
+
+        Task.prefetch_handlers([groups_task, processes_task])
+        self.assertIn('num_threads', registry.get_prefetch_attrs())
+
+        # the properties declared for a previous pass do not widen the next walks of the process table
+        Task.prefetch_handlers([processes_task])
+        self.assertEqual(frozenset({'cpu_percent'}), registry.get_prefetch_attrs())
+        Task.prefetch_handlers([])
+        self.assertEqual(frozenset(), registry.get_prefetch_attrs())
+
     def test_get_ha_unique_id_non_empty_params(self):
         test_task = Task(
             'test_task',
@@ -49,3 +49,6 @@ class Topic:
 
     def get_error_topic(self) -> str:
         return self.topic + "/error"
+
+    def get_age_topic(self) -> str:
+        return self.topic + "/age"